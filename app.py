@@ -1,7 +1,6 @@
 from flask import Flask, request, session, jsonify
 from flask_migrate import Migrate
 from flask_cors import CORS
-import requests
 import os
 from routes.jobs import jobs_bp
 from routes.journal import journal_bp
@@ -11,27 +10,17 @@ from routes.auth import auth_bp
 from routes.mileage import mileage_bp
 from routes.finances import finances_bp
 from routes.square import square_bp
+from routes.sync import sync_bp
+from routes.search import search_bp
 from database.db import db
+from utils.outbound import outbound_queue
+from utils.identity import register_identity_loader
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def send_push_notification(token, title, body):
-    message = {
-        'to': token,
-        'sound': 'default',
-        'title': title,
-        'body': body,
-    }
-    response = requests.post(
-        'https://exp.host/--/api/v2/push/send',
-        json=message,
-        headers={'Content-Type': 'application/json'}
-    )
-    return response.json()
-
 app = Flask(__name__)
 
 # Configure CORS with environment-specific origins
@@ -56,6 +45,8 @@ if not app.config['SQLALCHEMY_DATABASE_URI']:
     raise ValueError("DATABASE_URL environment variable is required")
 
 db.init_app(app)
+outbound_queue.init_app(app)
+register_identity_loader(app)
 @app.before_request
 def log_origin():
     origin = request.headers.get('Origin')
@@ -126,6 +117,8 @@ app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(mileage_bp, url_prefix="/mileage")
 app.register_blueprint(finances_bp, url_prefix="/finances")
 app.register_blueprint(square_bp, url_prefix="/square")
+app.register_blueprint(sync_bp, url_prefix="/sync")
+app.register_blueprint(search_bp, url_prefix="/search")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -77,6 +77,7 @@ class Client(db.Model):
     google_refresh_token = db.Column(db.Text) 
     google_token_expires = db.Column(db.DateTime)
     google_calendar_connected = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
     def __repr__(self):
@@ -1,7 +1,16 @@
 from database.db import db
+import datetime
 
 class Booking(db.Model):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # Backs the keyset pagination used by the /jobs listings
+        db.Index("ix_bookings_status_date_id", "status", "date", "id"),
+        # Backs date-window reads such as the booked-slots feed
+        db.Index("ix_bookings_date", "date"),
+        # Backs the per-client EXISTS/count lookups behind the visible contacts list
+        db.Index("ix_bookings_client_id_status", "client_id", "status"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey("client.id"), nullable=False)
@@ -17,3 +26,8 @@ class Booking(db.Model):
     mileage = db.relationship('Mileage', backref='booking', lazy=True)
     journal_id = db.Column(db.Integer, db.ForeignKey('journal.id'), nullable=True)
     status = db.Column(db.Enum("pending", "accepted", "denied", "completed", name="booking_status"), default="pending")
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+# Backs the newest-first, paginated client history; declared here so the sort
+# direction can be spelled out on the columns
+db.Index("ix_bookings_client_id_date_time", Booking.client_id, Booking.date.desc(), Booking.time.desc())
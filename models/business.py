@@ -12,8 +12,9 @@ class Finance(db.Model):
     description = db.Column(db.Text)
     amount = db.Column(Numeric(10, 2), nullable=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
-    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'))
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), index=True)
     pdfs = db.relationship('PDF', backref='finance', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -112,6 +113,7 @@ class Mileage(db.Model):
     time = db.Column(db.String(10))
     notes = db.Column(db.Text)
     job_id = db.Column(db.Integer, db.ForeignKey('bookings.id'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -4,13 +4,18 @@ from database.db import db
 class JournalSigner(db.Model):
     __tablename__ = "journal_signer"
     id = db.Column(db.Integer, primary_key=True)
-    journal_id = db.Column(db.Integer, db.ForeignKey('journal.id'), nullable=False)
+    journal_id = db.Column(db.Integer, db.ForeignKey('journal.id'), nullable=False, index=True)
     name = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(255))
     phone = db.Column(db.String(20))
 
 class JournalEntry(db.Model):
     __tablename__ = "journal"
+    __table_args__ = (
+        # Back the keyset-paginated journal listing and its filters
+        db.Index("ix_journal_date_id", "date", "id"),
+        db.Index("ix_journal_document_type_date_id", "document_type", "date", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
@@ -21,6 +26,7 @@ class JournalEntry(db.Model):
     signers = db.relationship('JournalSigner', backref='journal', lazy=True)
     completed_bookings = db.relationship('Booking', backref='journal_entry', lazy=True)
     pdfs = db.relationship('PDF', backref='journal_entry', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class PDF(db.Model):
     __tablename__ = "pdfs"
@@ -28,5 +34,32 @@ class PDF(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(512), nullable=False)
-    journal_id = db.Column(db.Integer, db.ForeignKey('journal.id'), nullable=False)
-    finance_id = db.Column(db.Integer, db.ForeignKey('finances.id'), nullable=True)
\ No newline at end of file
+    # Job uploads are not tied to a journal entry
+    journal_id = db.Column(db.Integer, db.ForeignKey('journal.id'), nullable=True)
+    finance_id = db.Column(db.Integer, db.ForeignKey('finances.id'), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    # Content address in the document store; NULL for files saved before it existed
+    sha256 = db.Column(db.String(64), index=True)
+    size = db.Column(db.BigInteger)
+    mime_type = db.Column(db.String(100))
+
+class DocumentRelease(db.Model):
+    """Stored bytes whose PDF row was deleted; utils.storage collects them after a grace period"""
+    __tablename__ = "document_releases"
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    released_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class DocumentDerivative(db.Model):
+    """Thumbnail and extracted text for a stored document, shared by every PDF row with the same hash"""
+    __tablename__ = "document_derivatives"
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    status = db.Column(db.Enum("done", "failed", name="derivative_status"), nullable=False)
+    # The thumbnail lives in the document store under its own hash
+    thumbnail_sha256 = db.Column(db.String(64))
+    text = db.Column(db.Text)
+    page_count = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(255))
+    processed_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
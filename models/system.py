@@ -1,5 +1,6 @@
 from database.db import db
 from sqlalchemy import Column, Integer, String, Float, DateTime, Text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 import datetime
 
 class SystemSetting(db.Model):
@@ -100,4 +101,33 @@ class PricingPolicy(db.Model):
             "is_active": self.is_active,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+        }
+
+class ChangeLog(db.Model):
+    """Append-only feed of row changes; (txid, id) of the last entry served is the /sync token"""
+    __tablename__ = "change_log"
+    __table_args__ = (
+        db.Index("ix_change_log_txid_id", "txid", "id"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    # Writing transaction; /sync only serves transactions older than every one still running
+    txid = db.Column(db.BigInteger, nullable=False, server_default=db.text("txid_current()"))
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.Enum("upsert", "delete", name="change_op"), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False, index=True)
+
+class SearchDocument(db.Model):
+    """Denormalized search text for one client, booking or journal entry, maintained by utils.search"""
+    __tablename__ = "search_documents"
+    __table_args__ = (
+        db.Index("ix_search_documents_vector", "search_vector", postgresql_using="gin"),
+    )
+
+    entity = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(255), nullable=False)
+    subtitle = db.Column(db.String(255))
+    search_vector = db.Column(TSVECTOR, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -2,16 +2,18 @@ from flask import Blueprint, jsonify, request, session
 from werkzeug.security import check_password_hash, generate_password_hash
 from database.db import db
 from models.accounts import Admin, Client, SchirmersNotary
-from models.bookings import Booking
 from models.system import SystemSetting, Backup, Service, Subscription
+from utils.stats import cached_admin_stats
+from utils.mailer import mailer
+from utils.identity import current_identity
+from utils.company import company_profile, invalidate_company_profile
+from utils.pricing import active_policy, invalidate_pricing, quote_bookings, MAX_QUOTE_BATCH
 import datetime
 import random
 import string
-import smtplib
 from email.mime.text import MIMEText
 from datetime import timedelta
 import traceback
-import os
 from google_auth_oauthlib.flow import Flow
 
 auth_bp = Blueprint('auth', __name__)
@@ -73,53 +75,25 @@ SUBSCRIPTION_PLANS = {
 
 def require_admin():
     """Helper function to check if current user is admin"""
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
-    print(f"[require_admin] X-User-Id: {user_id}, user_type: {user_type}")
-    if not user_id:
+    identity = current_identity()
+    if not identity.user_id:
         print("[require_admin] No user_id provided")
         return None
-    if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            print(f"[require_admin] No admin found for user_id {user_id}")
-            return None
-    if user_type != 'admin':
-        print(f"[require_admin] user_type {user_type} is not admin")
+    if not identity.is_admin:
+        print(f"[require_admin] user_id {identity.user_id} is not an admin")
         return None
-    print(f"[require_admin] Admin authentication passed for user_id={user_id}")
-    return user_id
+    return identity.user_id
 
 def require_ceo():
     """Helper function to check if current user is CEO"""
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
-    print(f"[require_ceo] X-User-Id: {user_id}, user_type: {user_type}")
-    if not user_id:
+    identity = current_identity()
+    if not identity.user_id:
         print("[require_ceo] No user_id provided")
         return None
-    if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-            user_id = 1
-            print(f"[require_ceo] Found admin, setting user_type=admin, user_id=1")
-        else:
-            print(f"[require_ceo] No admin found for user_id {user_id}")
-            return None
-    # Now user_type is guaranteed to be set
-    if user_type != 'admin':
-        print(f"[require_ceo] user_type {user_type} is not admin after assignment")
-        return None
-    ceo_record = SchirmersNotary.query.first()
-    print(f"[require_ceo] ceo_record: {ceo_record}")
-    if not ceo_record or ceo_record.ceo_admin_id != int(user_id):
-        print(f"[require_ceo] ceo_record missing or ceo_admin_id mismatch (expected {user_id}, got {getattr(ceo_record, 'ceo_admin_id', None)})")
+    if not identity.is_ceo:
+        print(f"[require_ceo] user_id {identity.user_id} is not the CEO")
         return None
-    print(f"[require_ceo] CEO authentication passed for user_id={user_id}")
-    return user_id
+    return identity.user_id
 
 def get_user_subscription_data(user_id):
     """Get subscription data from the client table in accounts model"""
@@ -258,45 +232,28 @@ def logout():
 
 @auth_bp.route('/session')
 def get_session_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({'logged_in': False}), 401
-        
-    # If user_type is not in session, determine it by checking if user exists as admin or client
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({'logged_in': False}), 401
+        return jsonify({'logged_in': False}), 401
                 
     return jsonify({'logged_in': True, 'user_id': user_id, 'user_type': user_type})
 
 @auth_bp.route('/profile', methods=['GET'])
 def view_profile():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
+    user = identity.user
     if user_type == 'admin':
-        user = Admin.query.get(user_id)
         if not user:
             return jsonify({"message": "Admin not found"}), 404
         return jsonify({
@@ -309,7 +266,6 @@ def view_profile():
             "notification_enabled": user.notification_enabled
         })
     elif user_type == 'client':
-        user = Client.query.get(user_id)
         if not user:
             return jsonify({"message": "Client not found"}), 404
         return jsonify({
@@ -324,27 +280,18 @@ def view_profile():
 
 @auth_bp.route('/profile/update', methods=['PATCH'])
 def update_profile():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
-    # If user_type is not in session, determine it by checking if user exists as admin or client
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     data = request.get_json()
     try:
+        user = identity.user
         if user_type == 'admin':
-            user = Admin.query.get(user_id)
             if not user:
                 return jsonify({"message": "Admin not found"}), 404
             user.name = data.get('name', user.name)
@@ -357,7 +304,6 @@ def update_profile():
             if 'push_token' in data:
                 user.push_token = data['push_token']
         elif user_type == 'client':
-            user = Client.query.get(user_id)
             if not user:
                 return jsonify({"message": "Client not found"}), 404
             user.name = data.get('name', user.name)
@@ -378,12 +324,13 @@ def update_profile():
 
 @auth_bp.route('/twofa/request', methods=['POST'])
 def request_2fa():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
+    identity = current_identity()
+    user_id = identity.user_id
     user_type = session.get('user_type')
     if not user_id or not user_type:
         return jsonify({"error": "Not logged in"}), 401
 
-    user = Admin.query.get(user_id) if user_type == 'admin' else Client.query.get(user_id)
+    user = identity.user
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -392,12 +339,7 @@ def request_2fa():
     user.two_factor_code_created = datetime.datetime.utcnow()
     db.session.commit()
 
-    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-    smtp_user = os.environ.get('SMTP_USERNAME')
-    smtp_password = os.environ.get('SMTP_PASSWORD')
-
-    if not smtp_user or not smtp_password:
+    if not mailer.is_configured():
         return jsonify({"error": "Email service not configured"}), 500
 
     subject = "Your 2FA Confirmation Code"
@@ -405,15 +347,11 @@ def request_2fa():
 
     msg = MIMEText(body)
     msg["Subject"] = subject
-    msg["From"] = smtp_user
+    msg["From"] = mailer.username or "no-reply@schirmersnotary.com"
     msg["To"] = user.email
 
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.sendmail(smtp_user, user.email, msg.as_string())
-        server.quit()
+        mailer.send(msg)
     except Exception as e:
         print("Failed to send email:", e)
 
@@ -421,13 +359,14 @@ def request_2fa():
 
 @auth_bp.route('/twofa/confirm', methods=['POST'])
 def confirm_2fa():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
+    identity = current_identity()
+    user_id = identity.user_id
     user_type = session.get('user_type')
     code = request.json.get('code')
     if not user_id or not user_type or not code:
         return jsonify({"error": "Missing user or code"}), 400
 
-    user = Admin.query.get(user_id) if user_type == 'admin' else Client.query.get(user_id)
+    user = identity.user
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -531,17 +470,13 @@ def delete_profile():
 
 @auth_bp.route('/direct-deposit/info', methods=['GET'])
 def get_direct_deposit_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"Error": "Not logged in"}), 401
-    
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            return jsonify({"Error": "User not Admin"}), 404
+        return jsonify({"Error": "User not Admin"}), 404
 
     from models.business import DirectDeposit
     direct_deposit = None
@@ -569,22 +504,13 @@ def get_direct_deposit_info():
     
 @auth_bp.route('/direct-deposit/update', methods=['POST'])
 def update_direct_deposit_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
-    # If user_type is not in session, determine it by checking if user exists as admin or client
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     data = request.get_json()
     from models.business import DirectDeposit
@@ -618,22 +544,13 @@ def update_direct_deposit_info():
 
 @auth_bp.route('/direct-deposit/delete', methods=['DELETE'])
 def delete_direct_deposit_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
-    # If user_type is not in session, determine it by checking if user exists as admin or client
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     from models.business import DirectDeposit
     direct_deposit = None
@@ -664,34 +581,20 @@ def get_admin_stats():
         return jsonify({"error": "Admin access required"}), 403
     
     try:
-        total_users = Client.query.count() + Admin.query.count()
-        total_admins = Admin.query.count()
-        total_clients = Client.query.count()
-        total_jobs = Booking.query.count()
-        pending_jobs = Booking.query.filter_by(status='pending').count()
-        completed_jobs = Booking.query.filter_by(status='completed').count()
-        
-        completed_bookings = Booking.query.filter_by(status='completed').all()
-        total_revenue = 0.0
-        for booking in completed_bookings:
-            if booking.finances:
-                for finance in booking.finances:
-                    total_revenue += float(getattr(finance, 'amount', 0) or 0)
-        
-        return jsonify({
-            "total_users": total_users,
-            "total_admins": total_admins,
-            "total_clients": total_clients,
-            "total_jobs": total_jobs,
-            "pending_jobs": pending_jobs,
-            "completed_jobs": completed_jobs,
-            "total_revenue": f"{total_revenue:.2f}"
-        }), 200
+        return jsonify(cached_admin_stats()), 200
         
     except Exception as e:
         print(f"Error fetching admin stats: {e}")
         return jsonify({"error": "Failed to fetch statistics"}), 500
 
+@auth_bp.route('/admin/mailer/metrics', methods=['GET'])
+def get_mailer_metrics():
+    """SMTP pool delivery counters and send latency percentiles"""
+    admin_id = require_ceo()
+    if not admin_id:
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(mailer.metrics()), 200
+
 @auth_bp.route('/admin/admins/all', methods=['GET'])
 def get_all_admins():
     """Get all admin users for employee management"""
@@ -957,21 +860,13 @@ def register():
    
 @auth_bp.route('/billing/info', methods=['GET'])
 def get_billing_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     from models.business import Billing
     billing = None
@@ -1005,21 +900,13 @@ def get_billing_info():
 
 @auth_bp.route('/billing/update', methods=['POST'])
 def update_billing_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     data = request.get_json()
     from models.business import Billing
@@ -1063,21 +950,13 @@ def update_billing_info():
 
 @auth_bp.route('/billing/delete', methods=['DELETE'])
 def delete_billing_info():
-    user_id = request.headers.get('X-User-Id') or session.get('user_id')
-    user_type = session.get('user_type')
+    identity = current_identity()
+    user_id = identity.user_id
     if not user_id:
         return jsonify({"message": "Not logged in"}), 401
-    
+    user_type = identity.user_type
     if not user_type:
-        admin_user = Admin.query.get(user_id)
-        if admin_user:
-            user_type = 'admin'
-        else:
-            client_user = Client.query.get(user_id)
-            if client_user:
-                user_type = 'client'
-            else:
-                return jsonify({"message": "User not found"}), 404
+        return jsonify({"message": "User not found"}), 404
 
     from models.business import Billing
     billing = None
@@ -1404,7 +1283,7 @@ def system_reset():
 @auth_bp.route('/office/info', methods=['GET'])
 def get_office_info():
     try:
-        office = SchirmersNotary.query.first()
+        office = company_profile()
         
         if not office:
             return jsonify({
@@ -1459,6 +1338,7 @@ def update_office_info():
             office.available_days_json = data['available_days_json']
             
         db.session.commit()
+        invalidate_company_profile()
         
         updated_data = {
             "id": office.id,
@@ -1605,63 +1485,43 @@ def delete_subscription(sub_id):
 def get_pricing_policy():
     """Get current active pricing policy"""
     try:
-        from models.system import PricingPolicy
-        
-        pricing = PricingPolicy.query.filter_by(is_active=True).order_by(PricingPolicy.id.desc()).first()
-        
-        if not pricing:
-            return jsonify({
-                "pricing_policy": {
-                    "base_notary_fee": "30.00",
-                    "base_travel_fee": "20.00",
-                    "free_travel_miles": "15",
-                    "additional_mile_rate": "1.00",
-                    "additional_signer_fee": "10.00",
-                    "rush_fee_same_day": "15.00",
-                    "rush_fee_emergency": "25.00",
-                    "rush_fee_holiday": "35.00",
-                    "loan_signing_flat_rate": "150.00",
-                    "loan_signing_rush_fee": "25.00",
-                    "ron_base_fee": "30.00",
-                    "ron_rush_fee": "15.00",
-                    "document_printing_per_page": "2.00",
-                    "document_scanning_fee": "5.00",
-                    "waiting_time_fee": "10.00",
-                    "cancellation_fee": "25.00",
-                    "is_active": True
-                }
-            }), 200
-        
-        return jsonify({
-            "pricing_policy": {
-                "id": pricing.id,
-                "base_notary_fee": str(pricing.base_notary_fee),
-                "base_travel_fee": str(pricing.base_travel_fee),
-                "free_travel_miles": str(pricing.free_travel_miles),
-                "additional_mile_rate": str(pricing.additional_mile_rate),
-                "additional_signer_fee": str(pricing.additional_signer_fee),
-                "rush_fee_same_day": str(pricing.rush_fee_same_day),
-                "rush_fee_emergency": str(pricing.rush_fee_emergency),
-                "rush_fee_holiday": str(pricing.rush_fee_holiday),
-                "loan_signing_flat_rate": str(pricing.loan_signing_flat_rate),
-                "loan_signing_rush_fee": str(pricing.loan_signing_rush_fee),
-                "ron_base_fee": str(pricing.ron_base_fee),
-                "ron_rush_fee": str(pricing.ron_rush_fee),
-                "document_printing_per_page": str(pricing.document_printing_per_page),
-                "document_scanning_fee": str(pricing.document_scanning_fee),
-                "waiting_time_fee": str(pricing.waiting_time_fee),
-                "cancellation_fee": str(pricing.cancellation_fee),
-                "is_active": pricing.is_active,
-                "created_at": pricing.created_at.isoformat() if pricing.created_at else None,
-                "updated_at": pricing.updated_at.isoformat() if pricing.updated_at else None
-            }
-        }), 200
-        
+        return jsonify({"pricing_policy": active_policy().serialized}), 200
     except Exception as e:
         print(f"Error fetching pricing policy: {e}")
         traceback.print_exc()
         return jsonify({"error": "Failed to fetch pricing policy"}), 500
 
+@auth_bp.route('/quote', methods=['POST'])
+def quote_bookings_endpoint():
+    """Quote a batch of candidate bookings against the active pricing policy"""
+    data = request.get_json() or {}
+    bookings = data.get('bookings')
+    if not isinstance(bookings, list) or not bookings:
+        return jsonify({"error": "bookings must be a non-empty list"}), 400
+    if len(bookings) > MAX_QUOTE_BATCH:
+        return jsonify({"error": f"At most {MAX_QUOTE_BATCH} bookings per request"}), 400
+
+    # The subscription discount comes from the client's plan, never from the request
+    client = None
+    if data.get('client_id') and require_admin():
+        client = Client.query.get(data.get('client_id'))
+    elif current_identity().user_type == 'client':
+        client = current_identity().user
+    plan = SUBSCRIPTION_PLANS.get(client.premium) if client and client.premium else None
+    discount_percentage = plan["discount_percentage"] if plan else 0
+
+    try:
+        policy = active_policy()
+        return jsonify({
+            "policy_id": policy.id,
+            "discount_percentage": discount_percentage,
+            "quotes": quote_bookings(policy, bookings, discount_percentage)
+        }), 200
+    except Exception as e:
+        print(f"Error computing quotes: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Failed to compute quotes"}), 500
+
 @auth_bp.route('/admin/pricing-policy', methods=['PUT'])
 def update_pricing_policy():
     """Update pricing policy (CEO only)"""
@@ -1697,6 +1557,7 @@ def update_pricing_policy():
         
         db.session.add(new_pricing)
         db.session.commit()
+        invalidate_pricing()
         
         return jsonify({
             "message": "Pricing policy updated successfully",
@@ -1768,6 +1629,7 @@ def activate_pricing_policy(policy_id):
         policy.updated_at = datetime.datetime.utcnow()
         
         db.session.commit()
+        invalidate_pricing()
         
         return jsonify({
             "message": "Pricing policy activated successfully",
@@ -3,8 +3,9 @@ from database.db import db
 from models.accounts import Admin, SchirmersNotary, Client
 from models.bookings import Booking
 import os
-import json
+from bisect import bisect_left
 from datetime import datetime, timedelta
+from utils.company import company_profile, invalidate_company_profile
 
 calendar_bp = Blueprint('calendar', __name__, template_folder='frontend/templates')
 
@@ -16,21 +17,76 @@ def get_admin_calendar_user():
     """Get the specific admin (ID 1) for calendar operations"""
     return Admin.query.get(1)
 
+# Accepted bookings block the calendar for this long
+BOOKING_BLOCK = timedelta(hours=1)
+MAX_SLOT_RANGE_DAYS = 92
+
+class BusyIndex:
+    """Sorted, merged busy intervals answering overlap checks with bisect"""
+
+    def __init__(self, intervals):
+        self.starts = []
+        self.ends = []
+        for busy_start, busy_end in sorted(intervals):
+            if self.ends and busy_start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], busy_end)
+            else:
+                self.starts.append(busy_start)
+                self.ends.append(busy_end)
+
+    def overlaps(self, start, end):
+        # The last interval starting before `end` is the only one that can overlap
+        i = bisect_left(self.starts, end) - 1
+        return i >= 0 and self.ends[i] > start
+
+    def __len__(self):
+        return len(self.starts)
+
+def _naive(value):
+    return value.replace(tzinfo=None) if value.tzinfo else value
+
+def load_busy_intervals(start_date, end_date):
+    """Busy (start, end) datetimes for accepted bookings between two dates, inclusive, in one query"""
+    rows = db.session.query(Booking.date, Booking.time).filter(
+        Booking.status == "accepted",
+        Booking.date >= start_date,
+        Booking.date <= end_date,
+        Booking.time.isnot(None)
+    ).all()
+    intervals = []
+    for booking_date, booking_time in rows:
+        start_dt = datetime.combine(booking_date, booking_time)
+        intervals.append((start_dt, start_dt + BOOKING_BLOCK))
+    return intervals
+
+def day_slots(day, hours, busy, now, slot_minutes=30, duration_minutes=30):
+    """Free slots on one day: every slot_minutes step where a duration_minutes booking fits"""
+    office_start_dt = datetime.combine(day, hours[0])
+    office_end_dt = datetime.combine(day, hours[1])
+    step = timedelta(minutes=slot_minutes)
+    duration = timedelta(minutes=duration_minutes)
+    date_str = day.strftime("%Y-%m-%d")
+
+    slots = []
+    current_slot = office_start_dt
+    while current_slot + duration <= office_end_dt:
+        slot_end = current_slot + duration
+        if current_slot > now and not busy.overlaps(current_slot, slot_end):
+            slots.append({
+                "start_time": current_slot.strftime("%H:%M"),
+                "end_time": slot_end.strftime("%H:%M"),
+                "datetime": current_slot.isoformat(),
+                "date": date_str,
+                "available": True
+            })
+        current_slot += step
+    return slots
+
 def get_local_busy_times(date_str):
     """Get busy times from local bookings for a specific date"""
     try:
         date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        bookings = Booking.query.filter_by(date=date, status="accepted").all()
-        
-        busy_times = []
-        for booking in bookings:
-            if booking.time:
-                start_dt = datetime.combine(booking.date, booking.time)
-                end_dt = start_dt + timedelta(hours=1)
-                busy_times.append((start_dt, end_dt))
-                
-        return busy_times
-        
+        return load_busy_intervals(date, date)
     except Exception as e:
         print(f"Error getting local busy times: {e}")
         return []
@@ -38,89 +94,13 @@ def get_local_busy_times(date_str):
 def generate_available_slots(date_str, busy_times):
     """Generate available time slots based on SchirmersNotary detailed availability settings"""
     try:
-        date = datetime.strptime(date_str, "%Y-%m-%d")
-        
-        company = SchirmersNotary.query.first()
-        if not company:
+        date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        profile = company_profile()
+        hours = profile.hours_for(date) if profile else None
+        if not hours:
             return []
-        
-        day_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        day_name = day_names[date.weekday()]
-        
-        if company.available_days_json:
-            try:
-                detailed_availability = json.loads(company.available_days_json)
-                
-                if day_name not in detailed_availability:
-                    return []
-                
-                day_schedule = detailed_availability[day_name]
-                office_start = day_schedule.get("start")
-                office_end = day_schedule.get("end")
-                
-            except (json.JSONDecodeError, KeyError, TypeError) as e:
-                print(f"Error parsing available_days_json: {e}, falling back to simple availability")
-                office_start = company.office_start
-                office_end = company.office_end
-                available_days = company.available_days
-                available_day_numbers = [int(d.strip()) for d in available_days.split(",") if d.strip()]
-                
-                if date.weekday() not in available_day_numbers:
-                    return []
-        else:
-            office_start = company.office_start or "09:00"
-            office_end = company.office_end or "17:00"
-            available_days = company.available_days or "0,1,2,3,4"
-            available_day_numbers = [int(d.strip()) for d in available_days.split(",") if d.strip()]
-            
-            if date.weekday() not in available_day_numbers:
-                return []
-        
-        try:
-            start_hour, start_min = map(int, office_start.split(":"))
-            end_hour, end_min = map(int, office_end.split(":"))
-        except (ValueError, AttributeError):
-            start_hour, start_min = 9, 0
-            end_hour, end_min = 17, 0
-        
-        office_start_dt = date.replace(hour=start_hour, minute=start_min)
-        office_end_dt = date.replace(hour=end_hour, minute=end_min)
-        
-        available_slots = []
-        current_slot = office_start_dt
-        
-        while current_slot + timedelta(minutes=30) <= office_end_dt:
-            slot_end = current_slot + timedelta(minutes=30)
-            
-            is_busy = False
-            for busy_start, busy_end in busy_times:
-                if hasattr(busy_start, 'tzinfo') and busy_start.tzinfo:
-                    busy_start = busy_start.replace(tzinfo=None)
-                if hasattr(busy_end, 'tzinfo') and busy_end.tzinfo:
-                    busy_end = busy_end.replace(tzinfo=None)
-                    
-                if (current_slot < busy_end and slot_end > busy_start):
-                    is_busy = True
-                    break
-            
-            now = datetime.now()
-            is_past = False
-            if date.date() == now.date() and current_slot <= now:
-                is_past = True
-            
-            if not is_busy and not is_past:
-                available_slots.append({
-                    "start_time": current_slot.strftime("%H:%M"),
-                    "end_time": slot_end.strftime("%H:%M"),
-                    "datetime": current_slot.isoformat(),
-                    "date": date_str,
-                    "available": True
-                })
-            
-            current_slot += timedelta(minutes=30)
-        
-        return available_slots
-        
+        busy = BusyIndex((_naive(b_start), _naive(b_end)) for b_start, b_end in busy_times)
+        return day_slots(date, hours, busy, datetime.now())
     except Exception as e:
         print(f"Error generating available slots: {e}")
         return []
@@ -139,6 +119,50 @@ def get_admin_calendar_status():
         "calendar_access_token_exists": bool(getattr(admin, 'google_access_token', None))
     }), 200
 
+@calendar_bp.route('/slots', methods=['GET'])
+def get_available_slots():
+    """Free booking slots for every day in ?start=&end= (YYYY-MM-DD, inclusive)"""
+    try:
+        start_date = datetime.strptime(request.args.get('start', ''), "%Y-%m-%d").date()
+        end_date = datetime.strptime(request.args.get('end') or request.args.get('start', ''), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+    if end_date < start_date:
+        return jsonify({"error": "end must not be before start"}), 400
+    if (end_date - start_date).days >= MAX_SLOT_RANGE_DAYS:
+        return jsonify({"error": f"Range cannot exceed {MAX_SLOT_RANGE_DAYS} days"}), 400
+    try:
+        slot_minutes = int(request.args.get('slot', 30))
+        duration_minutes = int(request.args.get('duration', slot_minutes))
+    except ValueError:
+        return jsonify({"error": "slot and duration must be whole minutes"}), 400
+    if not 5 <= slot_minutes <= 480 or not 5 <= duration_minutes <= 720:
+        return jsonify({"error": "slot must be 5-480 minutes and duration 5-720 minutes"}), 400
+
+    try:
+        profile = company_profile()
+        busy = BusyIndex(load_busy_intervals(start_date, end_date))
+        now = datetime.now()
+        days = []
+        day = start_date
+        while day <= end_date:
+            hours = profile.hours_for(day) if profile else None
+            days.append({
+                "date": day.strftime("%Y-%m-%d"),
+                "slots": day_slots(day, hours, busy, now, slot_minutes, duration_minutes) if hours else []
+            })
+            day += timedelta(days=1)
+        return jsonify({
+            "start": start_date.strftime("%Y-%m-%d"),
+            "end": end_date.strftime("%Y-%m-%d"),
+            "slot_minutes": slot_minutes,
+            "duration_minutes": duration_minutes,
+            "days": days
+        }), 200
+    except Exception as e:
+        print(f"Error generating slots: {e}")
+        return jsonify({"error": "Failed to generate slots"}), 500
+
 @calendar_bp.route('/local', methods=['GET'])
 def get_local_events():
     """Get all accepted local bookings"""
@@ -195,7 +219,7 @@ def delete_local_event(booking_id):
 @calendar_bp.route('/availability', methods=['GET'])
 def get_company_availability():
     """Get company availability settings"""
-    company = SchirmersNotary.query.first()
+    company = company_profile()
     if not company:
         return jsonify({"error": "No company settings found"}), 404
         
@@ -231,6 +255,7 @@ def set_company_availability():
             
         db.session.add(company)
         db.session.commit()
+        invalidate_company_profile()
         
         return jsonify({"message": "Company availability saved successfully"}), 200
         
@@ -2,13 +2,23 @@ from flask import Blueprint, jsonify, request
 from database.db import db
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import smtplib
+from utils.mailer import mailer
 import os
-from models.accounts import Client
+from models.accounts import Client, Company
 from models.bookings import Booking
+from datetime import date, time
+from sqlalchemy import and_, func, or_, select, true, tuple_
+from utils.pagination import parse_limit, encode_cursor, decode_cursor
+from utils.stats import revenue_total
+from utils.client_import import ClientImportError, import_clients, read_import_rows, resolve_companies
+from routes.auth import require_admin
+from time import perf_counter
 
 clients_bp = Blueprint('clients', __name__)
 
+# Admins see the contacts of clients they have worked with
+VISIBLE_BOOKING_STATUSES = ("accepted", "completed")
+
 def serialize_company(company):
     if not company:
         return None
@@ -18,6 +28,15 @@ def serialize_company(company):
         "address": company.address
     }
 
+def serialize_client(c):
+    """Client as the contact list endpoints and /sync return it"""
+    return {
+        "id": c.id,
+        "name": c.name,
+        "email": c.email,
+        "company": serialize_company(getattr(c, "company", None))
+    }
+
 @clients_bp.route('/search', methods=['GET'])
 def search_client_by_email():
     email = request.args.get('email')
@@ -32,30 +51,76 @@ def search_client_by_email():
 def get_all_contacts():
     contacts = Client.query.order_by(Client.name).all()
     return jsonify({
-        "clients": [
-            {
-                "id": c.id,
-                "name": c.name,
-                "email": c.email,
-                "company": serialize_company(getattr(c, "company", None))
-            } for c in contacts
-        ]
+        "clients": [serialize_client(c) for c in contacts]
     })
 
+def visible_contacts(limit, after=None):
+    """
+    Clients with at least one accepted or completed booking, ordered by (name, id),
+    with their booking count and latest booking date; limit=None returns every row.
+    Returns (items, next_cursor).
+    """
+    visible = and_(Booking.client_id == Client.id, Booking.status.in_(VISIBLE_BOOKING_STATUSES))
+    booking_count = select(func.count(Booking.id)).where(visible).correlate(Client).scalar_subquery()
+    last_booking = select(func.max(Booking.date)).where(visible).correlate(Client).scalar_subquery()
+    query = db.session.query(
+        Client.id,
+        Client.name,
+        Client.email,
+        Company.id.label("company_id"),
+        Company.name.label("company_name"),
+        Company.address.label("company_address"),
+        booking_count.label("booking_count"),
+        last_booking.label("last_booking_date")
+    ).outerjoin(Company, Company.id == Client.company_id).filter(
+        select(Booking.id).where(visible).correlate(Client).exists()
+    )
+
+    cursor = decode_cursor(after)
+    if cursor:
+        try:
+            cursor_name, cursor_id = str(cursor[0]), int(cursor[1])
+        except (IndexError, TypeError):
+            raise ValueError("Invalid cursor")
+        query = query.filter(tuple_(Client.name, Client.id) > tuple_(cursor_name, cursor_id))
+
+    query = query.order_by(Client.name, Client.id)
+    rows = query.all() if limit is None else query.limit(limit + 1).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].name, rows[-1].id)
+    items = [
+        {
+            "id": row.id,
+            "name": row.name,
+            "email": row.email,
+            "company": {
+                "id": row.company_id,
+                "name": row.company_name,
+                "address": row.company_address
+            } if row.company_id else None,
+            "booking_count": row.booking_count,
+            "last_booking_date": row.last_booking_date.strftime("%Y-%m-%d") if row.last_booking_date else None
+        }
+        for row in rows
+    ]
+    return items, next_cursor
+
 @clients_bp.route('/clients', methods=['GET', 'POST'])
 def get_contacts_visible_to_admin():
-    bookings = Booking.query.filter(Booking.status.in_(["accepted", "completed"])).all()
-    client_ids = {b.client_id for b in bookings}
-    visible_contacts = Client.query.filter(Client.id.in_(client_ids)).all()
+    # Only page when asked to, so existing callers still get every contact
+    paged = 'limit' in request.args or 'after' in request.args
+    try:
+        items, next_cursor = visible_contacts(
+            parse_limit(request.args.get('limit')) if paged else None,
+            after=request.args.get('after')
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
     return jsonify({
-        "clients": [
-            {
-                "id": c.id,
-                "name": c.name,
-                "email": c.email,
-                "company": serialize_company(getattr(c, "company", None))
-            } for c in visible_contacts
-        ]
+        "clients": items,
+        "next_cursor": next_cursor
     })
 
 @clients_bp.route('/<int:client_id>', methods=['PUT'])
@@ -72,13 +137,7 @@ def edit_client(client_id):
     company_name = data.get('company_name')
     company_address = data.get('company_address')
     if company_name:
-        from models.accounts import Company
-        company_obj = Company.query.filter_by(name=company_name).first()
-        if not company_obj:
-            company_obj = Company(name=company_name, address=company_address)
-            db.session.add(company_obj)
-            db.session.commit()
-        client.company_id = company_obj.id
+        client.company_id = resolve_companies({company_name: company_address})[company_name].id
 
     db.session.commit()
     return jsonify({
@@ -98,27 +157,101 @@ def get_client(client_id):
     client = Client.query.get(client_id)
     if not client:
         return jsonify({'error': 'Client not found'}), 404
-    return jsonify({
-        'id': client.id,
-        'name': client.name,
-        'email': client.email,
-        'company': serialize_company(getattr(client, "company", None))
-    })
+    return jsonify(serialize_client(client))
+
+def _desc_after(columns, values):
+    """Rows after `values` in ORDER BY columns DESC (NULLS FIRST, the PostgreSQL default); the last column is never NULL"""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value
+    rest = _desc_after(columns[1:], values[1:])
+    if value is None:
+        return or_(and_(column.is_(None), rest), column.isnot(None))
+    return or_(column < value, and_(column == value, rest))
+
+def client_history(client_id, limit, after=None):
+    """
+    One page of a client's bookings, newest first, plus lifetime stats, in a single
+    query: the stats row is outer-joined to the page so it comes back even when the
+    page is empty; limit=None returns every booking. Returns (items, stats, next_cursor).
+    """
+    order_columns = [Booking.date, Booking.time, Booking.id]
+    page = db.session.query(
+        Booking.id, Booking.service, Booking.status, Booking.date, Booking.time, Booking.notes
+    ).filter(Booking.client_id == client_id)
+    cursor = decode_cursor(after)
+    if cursor:
+        try:
+            cursor_values = [
+                date.fromisoformat(cursor[0]) if cursor[0] else None,
+                time.fromisoformat(cursor[1]) if cursor[1] else None,
+                int(cursor[2])
+            ]
+        except (IndexError, TypeError):
+            raise ValueError("Invalid cursor")
+        page = page.filter(_desc_after(order_columns, cursor_values))
+    page = page.order_by(*[c.desc() for c in order_columns])
+    if limit is not None:
+        page = page.limit(limit + 1)
+    page = page.subquery()
+
+    revenue = revenue_total(Booking.client_id == client_id)
+    stats = select(
+        func.count(Booking.id).label("total_bookings"),
+        func.count(Booking.id).filter(Booking.status == "completed").label("completed_bookings"),
+        func.avg(Booking.rating).label("average_rating"),
+        revenue.label("total_revenue")
+    ).where(Booking.client_id == client_id).subquery()
+
+    rows = db.session.query(stats, page).select_from(stats).outerjoin(page, true()).order_by(
+        page.c.date.desc(), page.c.time.desc(), page.c.id.desc()
+    ).all()
+
+    first = rows[0]
+    stats_data = {
+        "total_bookings": first.total_bookings,
+        "completed_bookings": first.completed_bookings,
+        "average_rating": round(float(first.average_rating), 2) if first.average_rating is not None else None,
+        "total_revenue": float(first.total_revenue)
+    }
+    rows = [row for row in rows if row.id is not None]
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            last.date.isoformat() if last.date else None,
+            last.time.isoformat() if last.time else None,
+            last.id
+        )
+    items = [
+        {
+            'id': row.id,
+            'service': row.service,
+            'status': row.status,
+            'date': row.date.strftime('%Y-%m-%d') if row.date else None,
+            'time': row.time.strftime('%H:%M') if row.time else None,
+            'notes': row.notes
+        } for row in rows
+    ]
+    return items, stats_data, next_cursor
 
 @clients_bp.route('/<int:client_id>/history', methods=['GET'])
 def get_client_history(client_id):
-    bookings = Booking.query.filter_by(client_id=client_id).order_by(Booking.date.desc(), Booking.time.desc()).all()
+    # Only page when asked to, so existing callers still get the whole history
+    paged = 'limit' in request.args or 'after' in request.args
+    try:
+        items, stats, next_cursor = client_history(
+            client_id,
+            parse_limit(request.args.get('limit')) if paged else None,
+            after=request.args.get('after')
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
     return jsonify({
-        'history': [
-            {
-                'id': b.id,
-                'service': b.service,
-                'status': b.status,
-                'date': b.date.strftime('%Y-%m-%d') if b.date else None,
-                'time': b.time.strftime('%H:%M') if b.time else None,
-                'notes': b.notes
-            } for b in bookings
-        ]
+        'history': items,
+        'stats': stats,
+        'next_cursor': next_cursor
     })
 
 @clients_bp.route('/create', methods=['POST'])
@@ -132,14 +265,7 @@ def create_client():
     if not name or not email:
         return jsonify({'error': 'Name and email are required.'}), 400
 
-    company_obj = None
-    if company_name:
-        from models.accounts import Company 
-        company_obj = Company.query.filter_by(name=company_name).first()
-        if not company_obj:
-            company_obj = Company(name=company_name, address=company_address)
-            db.session.add(company_obj)
-            db.session.commit()
+    company_obj = resolve_companies({company_name: company_address}).get(company_name)
 
     client = Client(
         name=name,
@@ -155,6 +281,40 @@ def create_client():
         'company_id': client.company_id
     }), 201
 
+@clients_bp.route('/bulk', methods=['POST'])
+def bulk_upsert_clients():
+    """
+    Create or update clients keyed by email from a CSV (with a header row) or JSON lines upload,
+    sent as a multipart 'file' or as the raw body. Columns: email, name, phone, address,
+    premium, company_name, company_address. ?format=csv|jsonl overrides detection.
+    """
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format')
+    if not fmt:
+        hint = ((upload.filename if upload else '') or '') + ' ' + (request.mimetype or '')
+        fmt = 'csv' if 'csv' in hint.lower() else 'jsonl'
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+
+    started = perf_counter()
+    try:
+        results, summary = import_clients(read_import_rows(stream, fmt))
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except ClientImportError as e:
+        print(f"Error importing clients: {e}")
+        return jsonify({"error": "Failed to save the import's companies; no clients were imported"}), 500
+    return jsonify({
+        "summary": summary,
+        "results": results,
+        "took_ms": round((perf_counter() - started) * 1000, 1)
+    }), 200
+
 @clients_bp.route('/<int:client_id>', methods=['DELETE'])
 def delete_client(client_id):
     client = Client.query.get_or_404(client_id)
@@ -166,8 +326,8 @@ def delete_client(client_id):
 def get_clients_by_company(company_name):
     """Get all clients for a specific company"""
     try:
-        clients = Client.query.filter(
-            Client.company.ilike(f'%{company_name}%')
+        clients = Client.query.join(Company).filter(
+            Company.name.ilike(f'%{company_name}%')
         ).all()
         
         clients_data = []
@@ -178,7 +338,7 @@ def get_clients_by_company(company_name):
                 'email': client.email,
                 'phone': client.phone,
                 'address': client.address,
-                'company': client.company
+                'company': serialize_company(client.company)
             })
         
         return jsonify({
@@ -214,26 +374,17 @@ def send_contact_email():
     if client:
         body += f"\n\nLinked Client ID: {client.id}\nClient Name: {client.name}\nClient Email: {client.email}"
 
-    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-    smtp_user = os.environ.get('SMTP_USERNAME')
-    smtp_pass = os.environ.get('SMTP_PASSWORD')
-
-    if not smtp_user or not smtp_pass:
+    if not mailer.is_configured():
         return jsonify({'error': 'Email service not configured'}), 500
 
     msg = MIMEMultipart()
-    msg['From'] = smtp_user
+    msg['From'] = mailer.username or "no-reply@schirmersnotary.com"
     msg['To'] = to_email
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
 
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-        server.sendmail(smtp_user, to_email, msg.as_string())
-        server.quit()
+        mailer.send(msg)
         return jsonify({'message': 'Email sent successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,47 +1,45 @@
-from flask import Blueprint, jsonify, request, session, send_file
+from flask import Blueprint, jsonify, make_response, request, session
 import datetime
+import hashlib
 from database.db import db
-import smtplib
-from email.mime.text import MIMEText
-import os
-import requests
 from models.journal import PDF
-from models.accounts import Client
+from models.accounts import Client, Company
 from models.business import Finance, Mileage
 from models.bookings import Booking
+from sqlalchemy import func, or_, tuple_
+from utils.pagination import DEFAULT_PAGE_SIZE, parse_limit, encode_cursor, decode_cursor
+from utils.notifications import queue_email, queue_push
+from utils.mailer import mailer
+from utils.document_serving import serve_document
+from utils.storage import document_store, store_upload
+from werkzeug.utils import secure_filename
 
 jobs_bp = Blueprint('jobs', __name__)
 
-PDF_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'database', 'pdfs')
-os.makedirs(PDF_FOLDER, exist_ok=True)
-
-import requests
 
 def send_push_notification(token, title, body):
+    """Queue a push notification; delivery happens on the outbound workers"""
     if not token:
         return
-    message = {
-        'to': token,
-        'sound': 'default',
-        'title': title,
-        'body': body,
-    }
     try:
-        requests.post(
-            'https://exp.host/--/api/v2/push/send',
-            json=message,
-            headers={'Content-Type': 'application/json'}
-        )
+        queue_push(token, title, body)
+    except Exception as e:
+        print(f"Failed to queue push notification: {e}")
+
+def notify_admins(title, body):
+    """Queue one batched push notification to every admin with a registered device"""
+    from models.accounts import Admin
+    tokens = [token for (token,) in db.session.query(Admin.push_token).filter(Admin.push_token.isnot(None))]
+    try:
+        queue_push(tokens, title, body)
     except Exception as e:
-        print(f"Failed to send push notification: {e}")
+        print(f"Failed to queue admin push notifications: {e}")
 
 def temp_booking_email(name, email, phone, notes, files):
     from email.mime.multipart import MIMEMultipart
     from email.mime.text import MIMEText
     from email.mime.base import MIMEBase
     from email import encoders
-    import smtplib
-    import os
     
     try:
         subject = "New Appointment Request"
@@ -82,22 +80,12 @@ def temp_booking_email(name, email, phone, notes, files):
                     print(f"Error attaching file {f.filename}: {str(file_err)}")
                     raise
 
-        smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-        smtp_username = os.environ.get('SMTP_USERNAME')
-        smtp_password = os.environ.get('SMTP_PASSWORD')
-
-        if not smtp_username or not smtp_password:
+        if not mailer.is_configured():
             print("SMTP credentials missing")
             raise Exception("Email credentials not configured. Please set SMTP_USERNAME and SMTP_PASSWORD environment variables.")
 
-        print(f"Connecting to {smtp_server}:{smtp_port} as {smtp_username}")
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.sendmail(msg['From'], [msg['To']], msg.as_string())
-            print("Email sent successfully")
+        mailer.send(msg)
+        print("Email sent successfully")
     except Exception as e:
         print(f"Failed to send confirmation email: {str(e)}")
         import traceback
@@ -119,49 +107,119 @@ We will contact you soon with further details.
 Thank you,
 Schirmer's Notary
 """
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = "no-reply@schirmersnotary.com"
-    msg['To'] = to_email
-
-    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-    smtp_username = os.environ.get('SMTP_USERNAME')
-    smtp_password = os.environ.get('SMTP_PASSWORD')
-
-    if not smtp_username or not smtp_password:
-        print("Email credentials not configured")
-        return
-
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.sendmail(msg['From'], [msg['To']], msg.as_string())
+        queue_email(to_email, subject, body)
     except Exception as e:
-        print(f"Failed to send confirmation email: {e}")
+        print(f"Failed to queue confirmation email: {e}")
+
+BOOKING_COLUMNS = {
+    "id": Booking.id,
+    "client_id": Booking.client_id,
+    "service": Booking.service,
+    "urgency": Booking.urgency,
+    "date": Booking.date,
+    "time": Booking.time,
+    "location": Booking.location,
+    "notes": Booking.notes,
+    "journal_id": Booking.journal_id,
+    "status": Booking.status,
+    "rating": Booking.rating,
+    "feedback": Booking.feedback
+}
+
+BOOKING_LIST_FIELDS = ["id", "client_id", "service", "urgency", "date", "time", "location", "notes", "journal_id"]
+BOOKING_DETAIL_FIELDS = BOOKING_LIST_FIELDS + ["status", "rating", "feedback"]
+
+def serialize_booking_row(row, fields):
+    """Serialize a projected booking row, formatting date/time like the full booking views"""
+    item = {}
+    for field in fields:
+        value = getattr(row, field)
+        if field == "date":
+            value = value.strftime("%Y-%m-%d") if value else None
+        elif field == "time":
+            value = value.strftime("%H:%M") if value else None
+        item[field] = value
+    return item
+
+def list_bookings(fields, status=None, limit=DEFAULT_PAGE_SIZE, after=None):
+    """
+    Keyset-paginated booking listing ordered by (date, id).
+    Only the requested columns are selected; limit=None returns every row.
+    Returns (items, next_cursor).
+    """
+    columns = [BOOKING_COLUMNS[f].label(f) for f in fields if f not in ("id", "date")]
+    query = db.session.query(Booking.id.label("id"), Booking.date.label("date"), *columns)
+    if status:
+        query = query.filter(Booking.status == status)
+
+    cursor = decode_cursor(after)
+    if cursor:
+        try:
+            cursor_date, cursor_id = cursor[0], int(cursor[1])
+        except (IndexError, TypeError):
+            raise ValueError("Invalid cursor")
+        if cursor_date is None:
+            # Undated bookings sort last, so only later ids remain
+            query = query.filter(Booking.date.is_(None), Booking.id > cursor_id)
+        else:
+            cursor_date = datetime.date.fromisoformat(cursor_date)
+            query = query.filter(or_(
+                tuple_(Booking.date, Booking.id) > tuple_(cursor_date, cursor_id),
+                Booking.date.is_(None)
+            ))
+
+    query = query.order_by(Booking.date.asc().nullslast(), Booking.id.asc())
+    if limit is None:
+        return [serialize_booking_row(row, fields) for row in query.all()], None
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.date.isoformat() if last.date else None, last.id)
+    return [serialize_booking_row(row, fields) for row in rows], next_cursor
+
+def booking_list_response(status, fields):
+    """
+    Shared view for the per-status listings. Callers that pass ?limit= or ?after=
+    are paged and get the next cursor in the X-Next-Cursor header; callers
+    that pass neither still get the full list.
+    """
+    paged = 'limit' in request.args or 'after' in request.args
+    try:
+        items, next_cursor = list_bookings(
+            fields,
+            status=status,
+            limit=parse_limit(request.args.get('limit')) if paged else None,
+            after=request.args.get('after')
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @jobs_bp.route('/', methods=['GET'])
 def get_all_bookings():
-    bookings = Booking.query.all()
+    status = request.args.get('status')
+    if status and status not in Booking.status.type.enums:
+        return jsonify({"error": "Invalid status"}), 400
+    # Only page when asked to, so existing callers still get every booking
+    paged = 'limit' in request.args or 'after' in request.args
+    try:
+        items, next_cursor = list_bookings(
+            BOOKING_DETAIL_FIELDS,
+            status=status,
+            limit=parse_limit(request.args.get('limit')) if paged else None,
+            after=request.args.get('after')
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
     return jsonify({
-        "jobs": [
-            {
-                "id": b.id,
-                "client_id": b.client_id,
-                "service": b.service,
-                "urgency": b.urgency,
-                "date": b.date.strftime("%Y-%m-%d") if b.date else None,
-                "time": b.time.strftime("%H:%M") if b.time else None,
-                "location": b.location,
-                "notes": b.notes,
-                "journal_id": b.journal_id,
-                "status": b.status,
-                "rating": b.rating,
-                "feedback": b.feedback
-            }
-            for b in bookings
-        ]
+        "jobs": items,
+        "next_cursor": next_cursor
     })
 
 @jobs_bp.route('/request', methods=['POST'])
@@ -226,46 +284,83 @@ def request_booking():
         )
 
     # Notify admins
-    from models.accounts import Admin
-    admins = Admin.query.all()
-    for admin in admins:
-        if admin.push_token:
-            send_push_notification(
-                admin.push_token,
-                "New Booking Request",
-                f"{name} submitted a booking for {service} on {date_str} at {time_str}."
-            )
+    notify_admins(
+        "New Booking Request",
+        f"{name} submitted a booking for {service} on {date_str} at {time_str}."
+    )
     
     return jsonify({
         "message": "Booking request submitted successfully",
         "booking_id": booking.id
     }), 201
 
+BOOKED_SLOT_STATUSES = ('pending', 'accepted')
+BOOKED_SLOT_DEFAULT_DAYS = 30
+BOOKED_SLOT_MAX_DAYS = 366
+
+def booked_slots_etag(start, end):
+    """
+    Validator for the booked-slots window. Counted over every status in the window
+    so rows leaving it (deleted, denied, rescheduled away) change the tag too.
+    Covers the joined clients as well, since the feed includes their names.
+    """
+    count, last_update, last_id, last_client_update = db.session.query(
+        func.count(Booking.id), func.max(Booking.updated_at), func.max(Booking.id), func.max(Client.updated_at)
+    ).outerjoin(Client, Client.id == Booking.client_id).filter(Booking.date >= start, Booking.date <= end).one()
+    marker = ":".join([
+        f"{start}:{end}:{count}",
+        last_update.isoformat() if last_update else "",
+        str(last_id or 0),
+        last_client_update.isoformat() if last_client_update else ""
+    ])
+    return hashlib.sha1(marker.encode()).hexdigest()
+
+def list_booked_slots(start, end):
+    """Pending and accepted bookings between two dates with their client name, in one query"""
+    rows = db.session.query(
+        Booking.date, Booking.time, Booking.service, Booking.status, Client.name
+    ).outerjoin(Client, Client.id == Booking.client_id).filter(
+        Booking.date >= start,
+        Booking.date <= end,
+        Booking.status.in_(BOOKED_SLOT_STATUSES)
+    ).order_by(Booking.date, Booking.time).all()
+    return [
+        {
+            'date': booking_date.isoformat() if booking_date else None,
+            'time': booking_time.strftime('%H:%M') if booking_time else None,
+            'duration': 60,
+            'client_name': client_name or 'Unknown',
+            'service': service,
+            'status': status
+        }
+        for booking_date, booking_time, service, status, client_name in rows
+    ]
+
 @jobs_bp.route('/availability/booked-slots', methods=['GET'])
 def get_booked_slots():
-    """Get all booked time slots for the next 30 days"""
+    """Get booked time slots between ?start= and ?end= (defaults to the next 30 days)"""
     try:
         today = datetime.date.today()
-        end_date = today + datetime.timedelta(days=30)
-        
-        bookings = Booking.query.filter(
-            Booking.date >= today,
-            Booking.date <= end_date,
-            Booking.status.in_(['pending', 'accepted'])
-        ).all()
-        
-        booked_slots = []
-        for booking in bookings:
-            booked_slots.append({
-                'date': booking.date.isoformat() if booking.date else None,
-                'time': booking.time.strftime('%H:%M') if booking.time else None,
-                'duration': 60,
-                'client_name': booking.client.name if booking.client else 'Unknown',
-                'service': booking.service,
-                'status': booking.status
-            })
-        
-        return jsonify({'booked_slots': booked_slots}), 200
+        start = datetime.date.fromisoformat(request.args['start']) if request.args.get('start') else today
+        end = datetime.date.fromisoformat(request.args['end']) if request.args.get('end') \
+            else start + datetime.timedelta(days=BOOKED_SLOT_DEFAULT_DAYS)
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+    if end < start:
+        return jsonify({"error": "end must not be before start"}), 400
+    if (end - start).days > BOOKED_SLOT_MAX_DAYS:
+        return jsonify({"error": f"Range cannot exceed {BOOKED_SLOT_MAX_DAYS} days"}), 400
+
+    try:
+        etag = booked_slots_etag(start, end)
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify({'booked_slots': list_booked_slots(start, end)})
+        response.set_etag(etag, weak=True)
+        # Clients may keep the body but must revalidate before reusing it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         print(f"Error fetching booked slots: {e}")
@@ -371,79 +466,41 @@ def delete_booking(booking_id):
 
 @jobs_bp.route('/pending', methods=['GET'])
 def get_pending_bookings():
-    bookings = Booking.query.filter_by(status="pending").all()
-    return jsonify([{
-        "id": b.id,
-        "client_id": b.client_id,
-        "service": b.service,
-        "urgency": b.urgency,
-        "date": b.date.strftime("%Y-%m-%d"),
-        "time": b.time.strftime("%H:%M"),
-        "location": b.location,
-        "notes": b.notes,
-        "journal_id": b.journal_id
-    } for b in bookings])
+    return booking_list_response("pending", BOOKING_LIST_FIELDS)
 
 @jobs_bp.route('/accepted', methods=['GET'])
 def get_accepted_bookings():
-    bookings = Booking.query.filter_by(status="accepted").all()
-    return jsonify([{
-        "id": b.id,
-        "client_id": b.client_id,
-        "service": b.service,
-        "urgency": b.urgency,
-        "date": b.date.strftime("%Y-%m-%d"),
-        "time": b.time.strftime("%H:%M"),
-        "location": b.location,
-        "notes": b.notes,
-        "journal_id": b.journal_id
-    } for b in bookings])
+    return booking_list_response("accepted", BOOKING_LIST_FIELDS)
 
 @jobs_bp.route('/denied', methods=['GET'])
 def get_denied_bookings():
-    bookings = Booking.query.filter_by(status="denied").all()
-    return jsonify([{
-        "id": b.id,
-        "client_id": b.client_id,
-        "service": b.service,
-        "urgency": b.urgency,
-        "date": b.date.strftime("%Y-%m-%d"),
-        "time": b.time.strftime("%H:%M"),
-        "location": b.location,
-        "notes": b.notes,
-        "journal_id": b.journal_id
-    } for b in bookings])
+    return booking_list_response("denied", BOOKING_LIST_FIELDS)
 
 @jobs_bp.route('/completed', methods=['GET'])
 def get_completed_bookings():
-    bookings = Booking.query.filter_by(status="completed").all()
-    return jsonify([{
-        "id": b.id,
-        "client_id": b.client_id,
-        "service": b.service,
-        "urgency": b.urgency,
-        "date": b.date.strftime("%Y-%m-%d"),
-        "time": b.time.strftime("%H:%M"),
-        "location": b.location,
-        "notes": b.notes,
-        "journal_id": b.journal_id,
-        "rating": b.rating,
-        "feedback": b.feedback
-    } for b in bookings])
+    return booking_list_response("completed", BOOKING_LIST_FIELDS + ["rating", "feedback"])
 
 @jobs_bp.route('/pdfs/upload', methods=['POST'])
 def upload_pdf():
     user_id = request.headers.get("X-User-Id")
-    file = request.files['file']
-    filename = file.filename
-    save_path = os.path.join(PDF_FOLDER, filename)
-    file.save(save_path)
-
-    pdf_record = PDF(user_id=user_id, filename=filename, file_path=save_path)
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"error": "No file provided"}), 400
+    filename = secure_filename(file.filename)
+    stored = store_upload(file)
+
+    pdf_record = PDF(
+        user_id=user_id,
+        filename=filename,
+        file_path=document_store.location(stored.sha256),
+        sha256=stored.sha256,
+        size=stored.size,
+        mime_type=stored.mime_type
+    )
     db.session.add(pdf_record)
     db.session.commit()
 
-    return jsonify({"message": "PDF uploaded and saved."}), 201
+    return jsonify({"message": "PDF uploaded and saved.", "pdf_id": pdf_record.id, "sha256": stored.sha256, "deduplicated": not stored.created}), 201
 
 @jobs_bp.route('/pdfs', methods=['GET'])
 def list_pdfs():
@@ -459,8 +516,9 @@ def list_pdfs():
 @jobs_bp.route('/pdfs/<filename>', methods=['GET'])
 def get_pdf(filename):
     pdf = PDF.query.filter_by(filename=filename).first()
-    if pdf:
-        return send_file(pdf.file_path, mimetype='application/pdf')
+    response = serve_document(pdf) if pdf else None
+    if response:
+        return response
     return jsonify({"error": "PDF not found"}), 404
 
 @jobs_bp.route('/<int:booking_id>/feedback', methods=['POST'])
@@ -486,15 +544,10 @@ def submit_feedback(booking_id):
         booking.feedback = feedback
         db.session.commit()
         
-        from models.accounts import Admin
-        admins = Admin.query.all()
-        for admin in admins:
-            if admin.push_token:
-                send_push_notification(
-                    admin.push_token,
-                    "New Feedback Received",
-                    f"New {rating}★ rating for {booking.service} booking"
-                )
+        notify_admins(
+            "New Feedback Received",
+            f"New {rating}★ rating for {booking.service} booking"
+        )
         
         return jsonify({
             "message": "Feedback submitted successfully",
@@ -523,11 +576,9 @@ def get_company_requests(company_name):
     """Get all requests for a specific company"""
     try:
         # Find all clients with matching company
-        clients = Client.query.filter(
-            Client.company.ilike(f'%{company_name}%')
-        ).all()
-        
-        client_ids = [client.id for client in clients]
+        client_ids = db.session.query(Client.id).join(Company).filter(
+            Company.name.ilike(f'%{company_name}%')
+        )
         
         # Get all bookings for these clients
         bookings = Booking.query.filter(
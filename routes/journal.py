@@ -1,41 +1,132 @@
-from flask import Blueprint, request, jsonify, send_file
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from models.journal import JournalEntry, PDF, JournalSigner
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context, url_for
+import json
+import zipfile
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+from models.journal import JournalEntry, PDF, JournalSigner, DocumentDerivative
 from database.db import db
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
 import os
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from datetime import date, datetime
+from routes.auth import require_admin
+from utils.journal_pdf import iter_merged_pdf, purge_entry_pdfs, render_many, render_to_cache, sweep_render_cache
+from utils.pagination import parse_limit, encode_cursor, decode_cursor
+from utils.document_ingest import pending_count, process_pending
+from utils.document_serving import serve_document, serve_stored
+from utils.storage import collect_released_documents, document_store, release_document, store_upload
+from utils.tasks import SupervisedTask
 
 journal_bp = Blueprint('journal', __name__, template_folder='frontend/templates')
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'database', 'journal_docs')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Thumbnails and text for uploaded documents are built off the request path
+document_ingester = SupervisedTask(
+    "document_ingest",
+    process_pending,
+    int(os.environ.get("DOCUMENT_INGEST_INTERVAL", "15"))
+)
+
+# Deletes stored bytes once no row has referenced them for the grace period
+document_collector = SupervisedTask("document_gc", collect_released_documents, 600)
+
+# Deletes journal PDF renders that have been superseded for a while
+render_cache_sweeper = SupervisedTask("journal_pdf_sweep", sweep_render_cache, 3600)
+
+@journal_bp.record_once
+def start_document_ingester(state):
+    """Start the thumbnail/text extraction, document GC and render cache jobs when the blueprint is registered"""
+    document_ingester.init_app(state.app)
+    document_collector.init_app(state.app)
+    render_cache_sweeper.init_app(state.app)
+
+
+JOURNAL_CHUNK_SIZE = 200
+
+def serialize_journal_entry(entry):
+    return {
+        'id': entry.id,
+        'date': entry.date.strftime('%Y-%m-%d') if entry.date else None,
+        'location': entry.location,
+        'document_type': entry.document_type,
+        'id_verification': entry.id_verification,
+        'notes': entry.notes,
+        'signers': [
+            {
+                'name': signer.name,
+                'address': signer.address,
+                'phone': signer.phone
+            }
+            for signer in entry.signers
+        ]
+    }
+
+def journal_query(start=None, end=None, document_type=None):
+    """Filtered journal query; signers for each page arrive in one extra SELECT ... IN"""
+    query = JournalEntry.query.options(selectinload(JournalEntry.signers))
+    if start:
+        query = query.filter(JournalEntry.date >= start)
+    if end:
+        query = query.filter(JournalEntry.date <= end)
+    if document_type:
+        query = query.filter(JournalEntry.document_type == document_type)
+    return query
+
+def journal_page(query, limit, after=None):
+    """One keyset page ordered by (date, id); returns (items, next_cursor)"""
+    cursor = decode_cursor(after)
+    if cursor:
+        try:
+            cursor_date, cursor_id = date.fromisoformat(cursor[0]), int(cursor[1])
+        except (IndexError, TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        query = query.filter(tuple_(JournalEntry.date, JournalEntry.id) > tuple_(cursor_date, cursor_id))
+    entries = query.order_by(JournalEntry.date, JournalEntry.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1].date.isoformat(), entries[-1].id)
+    return [serialize_journal_entry(entry) for entry in entries], next_cursor
+
+def stream_journal(query):
+    """Yield the whole filtered journal as one JSON array, one chunk in memory at a time"""
+    yield "["
+    first = True
+    after = None
+    while True:
+        items, after = journal_page(query, JOURNAL_CHUNK_SIZE, after)
+        # Entries are already serialized; don't let the identity map grow with the journal
+        db.session.expunge_all()
+        for item in items:
+            yield ("" if first else ",") + json.dumps(item)
+            first = False
+        if not after:
+            break
+    yield "]"
 
 @journal_bp.route('/', methods=['GET'])
 def get_journal_entries():
-    entries = JournalEntry.query.all()
-    result = []
-    for entry in entries:
-        result.append({
-            'id': entry.id,
-            'date': entry.date.strftime("%Y-%m-%d"),
-            'location': entry.location,
-            'document_type': entry.document_type,
-            'id_verification': entry.id_verification,
-            'notes': entry.notes,
-            'signers': [
-                {
-                    'name': signer.name,
-                    'address': signer.address,
-                    'phone': signer.phone
-                }
-                for signer in entry.signers
-            ]
-        })
-    return jsonify(result)
+    """
+    Journal entries filtered by ?start=&end= (YYYY-MM-DD) and ?document_type=.
+    With ?limit= a single page is returned and the next cursor goes in X-Next-Cursor;
+    without it the full journal is streamed.
+    """
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+    query = journal_query(start, end, request.args.get('document_type'))
+
+    if not request.args.get('limit') and not request.args.get('after'):
+        return Response(stream_with_context(stream_journal(query)), mimetype='application/json')
+
+    try:
+        items, next_cursor = journal_page(query, parse_limit(request.args.get('limit')), request.args.get('after'))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @journal_bp.route('/new', methods=['POST'])
 def new_entry():
@@ -70,78 +161,89 @@ def new_entry():
 def get_entry(entry_id):
     entry = JournalEntry.query.get(entry_id)
     if entry:
-        return jsonify(entry={
-            'id': entry.id,
-            'date': entry.date.strftime('%Y-%m-%d') if entry.date else None,
-            'location': entry.location,
-            'document_type': entry.document_type,
-            'id_verification': entry.id_verification,
-            'notes': entry.notes,
-            'signers': [
-                {
-                    'name': signer.name,
-                    'address': signer.address,
-                    'phone': signer.phone
-                }
-                for signer in entry.signers
-            ]
-        })
+        return jsonify(entry=serialize_journal_entry(entry))
     else:
         return jsonify(error="Not found"), 404
 
 @journal_bp.route('/<int:entry_id>/pdf', methods=['GET'])
 def generate_pdf(entry_id):
     entry = JournalEntry.query.get_or_404(entry_id)
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-    x_margin = inch
-    y = height - inch
-
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(x_margin, y, f"Journal Entry #{entry.id}")
-    y -= 30
-
-    p.setFont("Helvetica", 12)
-    p.drawString(x_margin, y, f"Date: {entry.date.strftime('%Y-%m-%d') if entry.date else 'N/A'}")
-    y -= 20
-    p.drawString(x_margin, y, f"Location: {entry.location or 'N/A'}")
-    y -= 20
-    p.drawString(x_margin, y, f"Document Type: {entry.document_type}")
-    y -= 20
-    p.drawString(x_margin, y, f"ID Verified: {'Yes' if entry.id_verification else 'No'}")
-    y -= 20
-
-    # List all signers
-    if entry.signers:
-        for idx, signer in enumerate(entry.signers, start=1):
-            p.drawString(x_margin, y, f"Signer {idx}: {signer.name}")
-            y -= 20
-            p.drawString(x_margin + 20, y, f"Address: {signer.address or 'N/A'}")
-            y -= 20
-            p.drawString(x_margin + 20, y, f"Phone: {signer.phone or 'N/A'}")
-            y -= 20
-    else:
-        p.drawString(x_margin, y, "No signers listed.")
-        y -= 20
-
-    notes = entry.notes or ''
-    textobject = p.beginText(x_margin, y)
-    textobject.textLines(f"Notes:\n{notes}")
-    p.drawText(textobject)
-
-    p.showPage()
-    p.save()
-
-    buffer.seek(0)
+    path = render_to_cache(serialize_journal_entry(entry))
     return send_file(
-        buffer,
+        path,
         as_attachment=True,
         download_name=f'Journal_{entry.id}.pdf',
         mimetype='application/pdf'
     )
 
+class _StreamBuffer:
+    """Write-only sink that lets zipfile stream into a response generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_export_pages(query):
+    """Rendered (entry, pdf path) pairs for every entry matched by query, one page of renders at a time"""
+    after = None
+    while True:
+        items, after = journal_page(query, JOURNAL_CHUNK_SIZE, after)
+        db.session.expunge_all()
+        yield from zip(items, render_many(items))
+        if not after:
+            break
+
+def stream_export_zip(query):
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for entry, path in iter_export_pages(query):
+            archive.write(path, arcname=f"Journal_{entry['date']}_{entry['id']}.pdf")
+            yield buffer.drain()
+    yield buffer.drain()
+
+def stream_export_pdf(query):
+    # Pages are copied into the combined document and sent as each entry is appended
+    return iter_merged_pdf(path for _, path in iter_export_pages(query))
+
+@journal_bp.route('/export', methods=['GET'])
+def export_journal():
+    """Bulk export of journal entries between ?start= and ?end= as a ZIP of PDFs or one combined PDF (?format=pdf)"""
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    try:
+        start = date.fromisoformat(request.args.get('start', ''))
+        end = date.fromisoformat(request.args.get('end', ''))
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+    if end < start:
+        return jsonify({"error": "end must not be before start"}), 400
+    export_format = request.args.get('format', 'zip')
+    if export_format not in ('zip', 'pdf'):
+        return jsonify({"error": "format must be zip or pdf"}), 400
+
+    query = journal_query(start, end, request.args.get('document_type'))
+    filename = f"Journal_{start.isoformat()}_{end.isoformat()}.{export_format}"
+    if export_format == 'zip':
+        body, mimetype = stream_export_zip(query), 'application/zip'
+    else:
+        body, mimetype = stream_export_pdf(query), 'application/pdf'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @journal_bp.route('/<int:entry_id>/upload', methods=['POST'])
 def upload_document(entry_id):
     entry = JournalEntry.query.get(entry_id)
@@ -156,34 +258,94 @@ def upload_document(entry_id):
         return jsonify({"error": "No selected file"}), 400
 
     filename = secure_filename(file.filename)
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(save_path)
+    stored = store_upload(file)
 
-    pdf_record = PDF(filename=filename, file_path=save_path, journal_id=entry.id)
+    pdf_record = PDF(
+        filename=filename,
+        file_path=document_store.location(stored.sha256),
+        journal_id=entry.id,
+        sha256=stored.sha256,
+        size=stored.size,
+        mime_type=stored.mime_type
+    )
     db.session.add(pdf_record)
     db.session.commit()
 
-    return jsonify({"message": "Document uploaded", "pdf_id": pdf_record.id, "file_path": save_path})
+    return jsonify({
+        "message": "Document uploaded",
+        "pdf_id": pdf_record.id,
+        "file_path": pdf_record.file_path,
+        "sha256": stored.sha256,
+        "size": stored.size,
+        "mime_type": stored.mime_type,
+        "deduplicated": not stored.created
+    })
 
 @journal_bp.route('/<int:entry_id>/pdfs', methods=['GET'])
 def get_entry_pdfs(entry_id):
     entry = JournalEntry.query.get(entry_id)
     if not entry:
         return jsonify({"error": "Journal entry not found"}), 404
-    pdfs = PDF.query.filter_by(journal_id=entry.id).all()
+    # Derivative columns only; the extracted text can be large and has its own endpoint
+    rows = db.session.query(
+        PDF, DocumentDerivative.status, DocumentDerivative.thumbnail_sha256, DocumentDerivative.page_count
+    ).outerjoin(DocumentDerivative, DocumentDerivative.sha256 == PDF.sha256).filter(PDF.journal_id == entry.id).all()
     return jsonify({
         "pdfs": [
-            {"id": pdf.id, "filename": pdf.filename, "file_path": pdf.file_path}
-            for pdf in pdfs
+            {
+                "id": pdf.id,
+                "filename": pdf.filename,
+                "file_path": pdf.file_path,
+                "size": pdf.size,
+                "sha256": pdf.sha256,
+                "mime_type": pdf.mime_type,
+                "page_count": page_count,
+                "preview_status": status or ("pending" if pdf.sha256 else "unavailable"),
+                "thumbnail_url": url_for('journal.get_pdf_thumbnail', pdf_id=pdf.id) if thumbnail_sha256 else None,
+                "text_url": url_for('journal.get_pdf_text', pdf_id=pdf.id) if status == "done" else None
+            }
+            for pdf, status, thumbnail_sha256, page_count in rows
         ]
     })
 
 @journal_bp.route('/pdf/<int:pdf_id>', methods=['GET'])
 def get_pdf(pdf_id):
     pdf = PDF.query.get(pdf_id)
-    if not pdf or not os.path.exists(pdf.file_path):
+    if not pdf:
         return jsonify({"error": "PDF not found"}), 404
-    return send_file(pdf.file_path, as_attachment=True)
+    response = serve_document(pdf, as_attachment=True)
+    if not response:
+        return jsonify({"error": "PDF not found"}), 404
+    return response
+
+def _pdf_derivative(pdf_id):
+    pdf = PDF.query.get(pdf_id)
+    if not pdf or not pdf.sha256:
+        return None
+    return DocumentDerivative.query.get(pdf.sha256)
+
+@journal_bp.route('/pdf/<int:pdf_id>/thumbnail', methods=['GET'])
+def get_pdf_thumbnail(pdf_id):
+    derivative = _pdf_derivative(pdf_id)
+    if not derivative or not derivative.thumbnail_sha256:
+        return jsonify({"error": "Thumbnail not available"}), 404
+    response = serve_stored(derivative.thumbnail_sha256, f"{pdf_id}-thumbnail.jpg", "image/jpeg")
+    if not response:
+        return jsonify({"error": "Thumbnail not available"}), 404
+    return response
+
+@journal_bp.route('/pdf/<int:pdf_id>/text', methods=['GET'])
+def get_pdf_text(pdf_id):
+    derivative = _pdf_derivative(pdf_id)
+    if not derivative or derivative.status != "done":
+        return jsonify({"error": "Text not available"}), 404
+    return jsonify({"pdf_id": pdf_id, "page_count": derivative.page_count, "text": derivative.text or ""})
+
+@journal_bp.route('/admin/ingest', methods=['GET'])
+def ingest_status():
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({**document_ingester.status(), "pending": pending_count()}), 200
 
 @journal_bp.route('/<int:entry_id>', methods=['DELETE'])
 def delete_entry(entry_id):
@@ -193,11 +355,12 @@ def delete_entry(entry_id):
 
     PDFs = PDF.query.filter_by(journal_id=entry.id).all()
     for pdf in PDFs:
-        if os.path.exists(pdf.file_path):
-            os.remove(pdf.file_path)
+        # Bytes are only queued here; they are deleted after commit once nothing references them
+        release_document(pdf)
         db.session.delete(pdf)
 
     JournalSigner.query.filter_by(journal_id=entry.id).delete()
     db.session.delete(entry)
     db.session.commit()
+    purge_entry_pdfs(entry_id)
     return jsonify({"message": "Journal entry and associated documents deleted"}), 200
\ No newline at end of file
@@ -5,6 +5,16 @@ from datetime import datetime, timedelta
 
 mileage_bp = Blueprint('mileage', __name__)
 
+def serialize_mileage(m):
+    return {
+        "id": m.id,
+        "date": m.date.strftime("%Y-%m-%d"),
+        "time": m.time,
+        "distance": m.distance,
+        "notes": m.notes,
+        "title": m.title,
+    }
+
 @mileage_bp.route('/add', methods=['POST'])
 def add_mileage():
     data = request.get_json()
@@ -29,17 +39,7 @@ def get_mileage():
     try:
         entries = Mileage.query.order_by(Mileage.date.desc()).all()
         return jsonify({
-            "entries": [
-                {
-                    "id": m.id,
-                    "date": m.date.strftime("%Y-%m-%d"),
-                    "time": m.time,
-                    "distance": m.distance,
-                    "notes": m.notes,
-                    "title": m.title,
-                }
-                for m in entries
-            ]
+            "entries": [serialize_mileage(m) for m in entries]
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,76 @@
+import os
+import time
+from flask import Blueprint, jsonify, request
+from routes.auth import require_admin
+from utils.pagination import parse_limit
+from utils.search import SEARCH_LOADERS, rebuild_search_index, search
+from utils.tasks import SupervisedTask
+
+search_bp = Blueprint('search', __name__)
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_RESULTS = 100
+
+# First run backfills the index; later runs repair drift from bulk updates
+search_rebuilder = SupervisedTask(
+    "search_rebuild",
+    rebuild_search_index,
+    int(os.environ.get("SEARCH_REBUILD_INTERVAL", "86400"))
+)
+
+@search_bp.record_once
+def start_search_rebuilder(state):
+    """Start the search index rebuild job when the blueprint is registered"""
+    search_rebuilder.init_app(state.app)
+
+@search_bp.route('/', methods=['GET'])
+def search_everything():
+    """
+    Ranked prefix search over clients, bookings and journal entries.
+    ?q=<text>&types=clients,bookings,journal&limit=
+    """
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+    types = [t for t in (request.args.get('types') or '').split(',') if t]
+    unknown = [t for t in types if t not in SEARCH_LOADERS]
+    if unknown:
+        return jsonify({"error": f"Unknown types: {', '.join(unknown)}"}), 400
+
+    try:
+        started = time.perf_counter()
+        rows = search(q, parse_limit(request.args.get('limit'), SEARCH_PAGE_SIZE, MAX_SEARCH_RESULTS), types)
+        return jsonify({
+            "query": q,
+            "results": [
+                {
+                    "type": row.entity,
+                    "id": row.entity_id,
+                    "title": row.title,
+                    "subtitle": row.subtitle,
+                    "score": round(float(row.rank), 4)
+                }
+                for row in rows
+            ],
+            "took_ms": round((time.perf_counter() - started) * 1000, 1)
+        }), 200
+    except Exception as e:
+        print(f"Error searching: {e}")
+        return jsonify({"error": "Search failed"}), 500
+
+@search_bp.route('/admin/status', methods=['GET'])
+def search_index_status():
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify(search_rebuilder.status()), 200
+
+@search_bp.route('/admin/rebuild', methods=['POST'])
+def rebuild_search():
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+    # The leader's supervised task does the rebuild, so two never run at once
+    search_rebuilder.request_run()
+    return jsonify(search_rebuilder.shared_status()), 202
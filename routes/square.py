@@ -1,52 +1,72 @@
 import os
-import threading
 import time
 import logging
+from datetime import datetime, timedelta, timezone
 import requests
 import json
 from flask import Blueprint, request, jsonify, render_template_string
-from square import Square
+from routes.auth import require_ceo
+from utils.tasks import SupervisedTask
+from utils.square_client import square_api
+from utils.square_cache import square_cache
 
 
 
 square_bp = Blueprint('square', __name__)
 logger = logging.getLogger("square_poll")
 
-client = Square(
-    token = os.environ.get("SQUARE_ACCESS_TOKEN", "")
-)
-
-def square_base_url():
-    return "https://connect.squareup.com"
-
-def square_headers():
-    token = os.environ.get("SQUARE_ACCESS_TOKEN", "")
-    return {
-        "Square-Version": os.environ.get("SQUARE_API_VERSION", "2025-09-24"),
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
+SYNC_WATERMARK_KEY = "square_customer_sync_watermark"
+# Re-read customers updated shortly before a run started: Square's search index
+# lags writes, and our clock may differ from Square's
+SYNC_OVERLAP_SECONDS = int(os.environ.get("SQUARE_CUSTOMER_SYNC_OVERLAP", "120"))
+
+def iter_square_customer_pages(updated_since=None, page_size=100):
+    """
+    Yield Square customers one page at a time so a sync never buffers the whole list.
+    With updated_since (RFC 3339) only customers changed at or after it are returned.
+    """
+    if updated_since:
+        body = {
+            "limit": page_size,
+            "query": {
+                "filter": {"updated_at": {"start_at": updated_since}},
+                "sort": {"field": "DEFAULT", "order": "ASC"}
+            }
+        }
+    else:
+        body = {"limit": page_size}
 
-def fetch_all_square_customers():
-    customers = []
-    url = f"{square_base_url()}/v2/customers"
-    params = {}
-    try:
-        while True:
-            r = requests.get(url, headers=square_headers(), params=params, timeout=15)
-            r.raise_for_status()
-            body = r.json()
-            page_customers = body.get("customers") or []
-            customers.extend(page_customers)
-            cursor = body.get("cursor")
-            if not cursor:
-                break
-            params["cursor"] = cursor
-    except requests.HTTPError as he:
-        logger.exception("Square customers fetch failed: %s", he)
-    except Exception:
-        logger.exception("Unexpected error fetching Square customers")
-    return customers
+    while True:
+        if updated_since:
+            # Search is read-only, so it is safe to retry
+            r = square_api.post("/v2/customers/search", json=body, retry=True)
+        else:
+            r = square_api.get("/v2/customers", params=body)
+        page = r.json()
+        yield page.get("customers") or []
+        cursor = page.get("cursor")
+        if not cursor:
+            break
+        body["cursor"] = cursor
+
+def load_sync_watermark():
+    from models.system import SystemSetting
+    setting = SystemSetting.query.filter_by(key=SYNC_WATERMARK_KEY).first()
+    return setting.value if setting and setting.value else None
+
+def save_sync_watermark(value):
+    from database.db import db
+    from models.system import SystemSetting
+    setting = SystemSetting.query.filter_by(key=SYNC_WATERMARK_KEY).first()
+    if not setting:
+        setting = SystemSetting(
+            key=SYNC_WATERMARK_KEY,
+            type="string",
+            description="Start time (less an overlap) of the last completed Square customer sync"
+        )
+        db.session.add(setting)
+    setting.value = value
+    db.session.commit()
 
 def find_local_user_for_customer(customer):
     try:
@@ -127,31 +147,190 @@ def link_customer_to_local_user(customer):
             pass
     return False
 
-def customer_polling_worker(interval_seconds=300):
-    logger.info("Starting Square customer polling worker (interval=%s seconds)", interval_seconds)
-    while True:
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+def normalize_name(name):
+    return " ".join((name or "").lower().split())
+
+def build_client_index():
+    """Load every local client once, keyed by Square id, normalized email and unambiguous full name"""
+    from database.db import db
+    from models.accounts import Client
+
+    rows = db.session.query(Client.id, Client.email, Client.name, Client.square_customer_id).all()
+    by_square_id, by_email, by_name = {}, {}, {}
+    for row in rows:
+        if row.square_customer_id:
+            by_square_id[row.square_customer_id] = row
+        if row.email:
+            by_email[normalize_email(row.email)] = row
+        name = normalize_name(row.name)
+        if name:
+            # None marks names shared by several clients, which are never auto-linked
+            by_name[name] = None if name in by_name else row
+    return by_square_id, by_email, by_name
+
+def reconcile_square_customers(customers, index=None):
+    """
+    Match a batch of Square customers against local clients in memory and
+    apply every new link in a single UPDATE. Returns a report of counts and timings.
+    Pass a prebuilt index to reconcile several pages against one client load.
+    """
+    from database.db import db
+    from models.accounts import Client
+    from sqlalchemy import case
+
+    started = time.perf_counter()
+    by_square_id, by_email, by_name = index or build_client_index()
+    indexed = time.perf_counter()
+
+    matched = unmatched = 0
+    links = {}
+    for customer in customers:
+        square_id = customer.get("id")
+        if not square_id:
+            continue
+        if square_id in by_square_id:
+            matched += 1
+            continue
+        fullname = normalize_name(f"{customer.get('given_name') or ''} {customer.get('family_name') or ''}")
+        found = by_email.get(normalize_email(customer.get("email_address"))) or (by_name.get(fullname) if fullname else None)
+        if not found or found.id in links:
+            unmatched += 1
+            logger.debug("No local match found for Square customer %s (%s)", square_id, customer.get("email_address"))
+            continue
+        matched += 1
+        if found.square_customer_id != square_id:
+            links[found.id] = square_id
+    diffed = time.perf_counter()
+
+    if links:
         try:
-            customers = fetch_all_square_customers()
-            logger.debug("Fetched %d Square customers", len(customers))
-            for c in customers:
-                try:
-                    link_customer_to_local_user(c)
-                except Exception:
-                    logger.exception("Error processing customer: %s", c.get("id"))
+            db.session.execute(
+                Client.__table__.update()
+                .where(Client.id.in_(list(links)))
+                .values(square_customer_id=case(links, value=Client.id))
+            )
+            db.session.commit()
         except Exception:
-            logger.exception("Polling loop error")
-        time.sleep(interval_seconds)
+            logger.exception("Failed to apply Square customer links")
+            db.session.rollback()
+            links = {}
+        else:
+            for client_id, square_id in links.items():
+                by_square_id[square_id] = client_id
+    finished = time.perf_counter()
+
+    report = {
+        "customers": len(customers),
+        "matched": matched,
+        "linked": len(links),
+        "unmatched": unmatched,
+        "timings_ms": {
+            "index": round((indexed - started) * 1000, 1),
+            "diff": round((diffed - indexed) * 1000, 1),
+            "apply": round((finished - diffed) * 1000, 1),
+            "total": round((finished - started) * 1000, 1)
+        }
+    }
+    logger.debug("Square reconciliation batch: %s", report)
+    return report
+
+def sync_square_customers(mode=None):
+    """
+    Stream Square customers page by page into the reconciler.
+    Incremental mode only asks Square for customers updated since the stored
+    watermark. Once the whole run has completed, the watermark moves to the run's
+    start time less SYNC_OVERLAP_SECONDS. Customers that change during a run,
+    or reach the search index late, are picked up by the next run.
+    """
+    mode = mode or os.environ.get("SQUARE_CUSTOMER_SYNC_MODE", "incremental")
+    started = time.perf_counter()
+    next_watermark = (datetime.now(timezone.utc) - timedelta(seconds=SYNC_OVERLAP_SECONDS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    watermark = load_sync_watermark() if mode == "incremental" else None
+    index = build_client_index()
+
+    totals = {"customers": 0, "matched": 0, "linked": 0, "unmatched": 0}
+    pages = 0
+    for page in iter_square_customer_pages(updated_since=watermark):
+        pages += 1
+        report = reconcile_square_customers(page, index=index)
+        for key in totals:
+            totals[key] += report[key]
+
+    # Never move backwards, e.g. after a run that started before the stored one
+    if watermark is None or next_watermark > watermark:
+        save_sync_watermark(next_watermark)
+    else:
+        next_watermark = watermark
+
+    report = {
+        "mode": mode,
+        "since": watermark,
+        "watermark": next_watermark,
+        "pages": pages,
+        **totals,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    logger.info("Square customer sync: %s", report)
+    return report
 
-@square_bp.before_app_request
-def start_background_polling():
+def poll_interval():
     try:
-        interval = int(os.environ.get("SQUARE_CUSTOMER_POLL_INTERVAL", "300"))
+        return int(os.environ.get("SQUARE_CUSTOMER_POLL_INTERVAL", "300"))
     except Exception:
-        interval = 300
-    t = threading.Thread(target=customer_polling_worker, args=(interval,), daemon=True)
-    t.start()
-    logger.info("Square customer polling thread started")
-    return None
+        return 300
+
+square_poller = SupervisedTask("square_customer_poller", sync_square_customers, poll_interval())
+
+@square_bp.record_once
+def start_background_polling(state):
+    """Start the single Square customer poller when the blueprint is registered"""
+    enabled = os.environ.get("SQUARE_CUSTOMER_POLLING", "true").lower() != "false"
+    square_poller.init_app(state.app, autostart=enabled)
+
+@square_bp.route('/admin/poller', methods=['GET'])
+def poller_status():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    return jsonify(square_poller.shared_status()), 200
+
+@square_bp.route('/admin/poller/start', methods=['POST'])
+def poller_start():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    square_poller.set_enabled(True)
+    # Make sure at least this worker is competing for leadership
+    square_poller.start()
+    return jsonify(square_poller.shared_status()), 200
+
+@square_bp.route('/admin/poller/stop', methods=['POST'])
+def poller_stop():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    # Threads stay up and keep leadership; whichever worker leads skips its runs
+    square_poller.set_enabled(False)
+    return jsonify(square_poller.shared_status()), 200
+
+@square_bp.route('/admin/api-metrics', methods=['GET'])
+def square_api_metrics():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    return jsonify(square_api.metrics()), 200
+
+@square_bp.route('/admin/cache', methods=['GET'])
+def square_cache_stats():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    return jsonify(square_cache.stats()), 200
+
+@square_bp.route('/admin/cache/clear', methods=['POST'])
+def clear_square_cache():
+    if not require_ceo():
+        return jsonify({"error": "CEO access required"}), 403
+    square_cache.invalidate()
+    return jsonify({"message": "Square cache cleared"}), 200
 
 @square_bp.route('/payment-form')
 def payment_form():
@@ -399,6 +578,14 @@ def square_webhook_receiver():
     except Exception:
         return jsonify({"error": "invalid json"}), 400
 
+    event_type = payload.get("type") or ""
+    if event_type.startswith("catalog."):
+        square_cache.invalidate("catalog:")
+        return jsonify({"message": "catalog cache invalidated"}), 200
+    if event_type.startswith("customer.group") or event_type.startswith("customer_group"):
+        group_id = ((payload.get("data") or {}).get("id"))
+        square_cache.invalidate(f"group:{group_id}" if group_id else "group:")
+
     data = payload.get("data", {}) or {}
     obj = data.get("object", {}) or {}
     customer = obj.get("customer") or obj.get("customer_created") or payload.get("customer") or {}
@@ -425,17 +612,15 @@ def square_webhook_receiver():
 def create_customer():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/customers"
         params = {
             "given_name": data.get("name"),
             "email_address": data.get("email"),
             "phone_number": data.get("phone"),
             "reference_id": data.get("user_id"),
             "note": data.get("note"),
-            "idompotency_key": data.get("idempotency")
+            "idempotency_key": data.get("idempotency")
         }
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/customers", json=params, idempotent=True)
         return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -448,10 +633,8 @@ def list_customers():
 def search_customers():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/customers/search"
         params = {"query": {"filter": {"email_address": {"exact": data.get('email')}}}}
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/customers/search", json=params, retry=True)
         return jsonify(r.json()), 200
 
     except Exception as e:
@@ -461,9 +644,7 @@ def search_customers():
 def retrieve_customer():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/customers{data.get('customer_id')}"
-        r = requests.get(url, headers=square_headers(), timeout=15)
-        r.raise_for_status()
+        r = square_api.get("/v2/customers/{customer_id}", path_params={"customer_id": data.get('customer_id')})
         return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -472,7 +653,6 @@ def retrieve_customer():
 def create_card():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/cards"
         params={
             "card":{
                 "cardholder_name": data.get('cardholder_name'),
@@ -485,8 +665,8 @@ def create_card():
             "idempotency_key": data.get('idempotency_key'),
             "source_id": data.get('source_id')
         }
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/cards", json=params, idempotent=True)
+        return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -494,10 +674,8 @@ def create_card():
 def list_cards():
     customer_id = request.args.get('customer_id')
     try:
-        url = f"{square_base_url()}/v2/cards"
         params = {"customer_id": customer_id}
-        r = requests.get(url, headers=square_headers(), params=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.get("/v2/cards", params=params)
         return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -505,12 +683,9 @@ def list_cards():
 @square_bp.route('/list-subscriptions', methods=['GET'])
 def list_subscriptions():
     try:
-        url = f"{square_base_url()}/v2/catalog/list"
         params = {"types": "subscription_PLAN"}
         
-        r = requests.get(url, headers=square_headers(), params=params, timeout=15)
-        r.raise_for_status()
-        return jsonify(r.json()), 200
+        return jsonify(square_cache.fetch("catalog:SUBSCRIPTION_PLAN", "/v2/catalog/list", params=params)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -519,8 +694,6 @@ def edit_subscription():
     data = request.get_json() or {}
 
     try:
-        url = f"{square_base_url()}/v2/catalog/object"
-
         params = {
             "idempotency_key": data.get("idempotency_key"),
             "object": {
@@ -543,8 +716,8 @@ def edit_subscription():
             }
         }
 
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/catalog/object", json=params, idempotent=True)
+        square_cache.invalidate("catalog:")
         return jsonify(r.json()), r.status_code
 
     except requests.exceptions.HTTPError as e:
@@ -564,7 +737,6 @@ def edit_subscription():
 def create_subscription():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/catalog/object"
         params = {
             "idempotency_key": data.get("idempotency_key"),
             "object": {
@@ -599,8 +771,8 @@ def create_subscription():
                   },
               },
         }
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/catalog/object", json=params, idempotent=True)
+        square_cache.invalidate("catalog:")
         return jsonify(r.json()), 200
     except requests.exceptions.HTTPError as e:
         try:
@@ -619,10 +791,9 @@ def create_subscription():
 def enroll_customer():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/subscriptions"
         params ={}
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/subscriptions", json=params, idempotent=True)
+        return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -630,13 +801,17 @@ def enroll_customer():
 def cancel_subscription():
     data = request.get_json() or {}
     try:
-        result = client.subscriptions.cancel_subscription(
-            subscription_id=data.get('subscription_id')
+        r = square_api.post(
+            "/v2/subscriptions/{subscription_id}/cancel",
+            path_params={"subscription_id": data.get('subscription_id')}
         )
-        if result.is_success():
-            return jsonify(result.body), 200
-        else:
-            return jsonify({"errors": result.errors}), 400
+        return jsonify(r.json()), 200
+    except requests.exceptions.HTTPError as e:
+        try:
+            errors = e.response.json().get("errors")
+        except Exception:
+            errors = e.response.text
+        return jsonify({"errors": errors}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -644,10 +819,8 @@ def cancel_subscription():
 def search_subscriptions():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/subscriptions/search"
         params = {"query": {"filter": {"customer_ids": [data.get('customer_ids')]}}}
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/subscriptions/search", json=params, retry=True)
         print(f"Subscription Info:", json.dumps(r.json(), indent=2))
         return jsonify(r.json()), 200
     except Exception as e:
@@ -657,9 +830,8 @@ def search_subscriptions():
 def delete_catalog():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/catalog/object/{data.get('object_id')}"
-        r = requests.delete(url, headers=square_headers(), timeout=15)
-        r.raise_for_status()
+        r = square_api.delete("/v2/catalog/object/{object_id}", path_params={"object_id": data.get('object_id')})
+        square_cache.invalidate("catalog:")
         return jsonify(r.json()), 200
     except requests.exceptions.HTTPError as e:
         try:
@@ -681,11 +853,8 @@ def disable_subscription():
 @square_bp.route('/list-service', methods=['GET'])
 def list_services():
     try:
-        url = f"{square_base_url()}/v2/catalog/list"
         params = {"types": "ITEM"}
-        r = request.get(url, headers=square_headers(), params=params, timeout=15)
-        r.raise_for_status()
-        return jsonify(r.json()), 200
+        return jsonify(square_cache.fetch("catalog:ITEM", "/v2/catalog/list", params=params)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -693,10 +862,11 @@ def list_services():
 def retrieve_group():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/customers/groups/{data.get('group_id')}"
-        r = requests.get(url, headers=square_headers(), timeout=15)
-        r.raise_for_status()
-        return jsonify(r.json()), 200
+        group_id = data.get('group_id')
+        if not group_id:
+            return jsonify({"error": "group_id is required"}), 400
+        group = square_cache.fetch(f"group:{group_id}", "/v2/customers/groups/{group_id}", path_params={"group_id": group_id})
+        return jsonify(group), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -704,9 +874,10 @@ def retrieve_group():
 def enroll_group():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/customers/{data.get('customer_id')}/groups/{data.get('group_id')}"
-        r = requests.put(url, headers=square_headers(), timeout=15)
-        r.raise_for_status()
+        r = square_api.put(
+            "/v2/customers/{customer_id}/groups/{group_id}",
+            path_params={"customer_id": data.get('customer_id'), "group_id": data.get('group_id')}
+        )
         return jsonify(r.json()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -714,11 +885,8 @@ def enroll_group():
 @square_bp.route('/list-discount', methods=['GET'])
 def list_discounts():
     try:
-        url =f"{square_base_url()}/v2/catalog/list"
         params = {"types": "discount"}
-        r = requests.get(url, headers=square_headers(), params=params, timeout=15)
-        r.raise_for_status()
-        return jsonify(r.json()), 200
+        return jsonify(square_cache.fetch("catalog:DISCOUNT", "/v2/catalog/list", params=params)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -726,8 +894,6 @@ def list_discounts():
 def create_order():
     data = request.get_json() or {}
     try:
-        url = f'{square_base_url()}/v2/orders'
-
         line_items_data = data.get("line_items", [])
         if not line_items_data and data.get("itemName"):
             line_items_data =[{
@@ -738,13 +904,13 @@ def create_order():
                     "currency": "USD"
                 }
             }]
-            line_items = []
-            for item in line_items_data:
-                line_items.append({
-                    "name": item.get("name"),
-                    "quantity": item.get("quantity"),
-                    "base_price_money": item.get("base_price_money")
-                })
+        line_items = []
+        for item in line_items_data:
+            line_items.append({
+                "name": item.get("name"),
+                "quantity": item.get("quantity"),
+                "base_price_money": item.get("base_price_money")
+            })
 
         params = {
             "order": {
@@ -767,8 +933,7 @@ def create_order():
             }
         }
 
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/orders", json=params, idempotent=True)
 
         return jsonify(r.json()), 200
     except Exception as e:
@@ -778,7 +943,6 @@ def create_order():
 def create_invoice():
     data = request.get_json() or {}
     try:
-        url = f"{square_base_url()}/v2/invoices"
         params = {
             "idempotency_key": data.get("idempotency_key"),
             "invoice": {
@@ -805,8 +969,7 @@ def create_invoice():
             }
         }
 
-        r = requests.post(url, headers=square_headers(), json=params, timeout=15)
-        r.raise_for_status()
+        r = square_api.post("/v2/invoices", json=params, idempotent=True)
 
         return jsonify(r.json()), 200
     except Exception as e:
@@ -0,0 +1,137 @@
+import datetime
+import os
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+from database.db import db
+from models.accounts import Client
+from models.bookings import Booking
+from models.business import Finance, Mileage
+from models.journal import JournalEntry
+from models.system import ChangeLog, SystemSetting
+from routes.auth import require_admin
+from routes.clients import serialize_client
+from routes.jobs import BOOKING_DETAIL_FIELDS, serialize_booking_row
+from routes.journal import serialize_journal_entry
+from routes.mileage import serialize_mileage
+from utils.changefeed import TRACKED_MODELS
+from utils.pagination import encode_cursor, decode_cursor, parse_limit
+from utils.tasks import SupervisedTask
+
+sync_bp = Blueprint('sync', __name__)
+
+SYNC_PAGE_SIZE = 1000
+PRUNED_THROUGH_KEY = "change_log_pruned_through_txid"
+
+# entity -> (query factory, serializer); payloads match the full list endpoints
+SYNC_LOADERS = {
+    "bookings": (lambda: Booking.query, lambda b: serialize_booking_row(b, BOOKING_DETAIL_FIELDS)),
+    "clients": (lambda: Client.query.options(joinedload(Client.company)), serialize_client),
+    "finances": (lambda: Finance.query, lambda f: f.to_dict()),
+    "mileage": (lambda: Mileage.query, serialize_mileage),
+    "journal": (lambda: JournalEntry.query.options(selectinload(JournalEntry.signers)), serialize_journal_entry)
+}
+ENTITY_MODELS = {entity: model for model, entity in TRACKED_MODELS.items()}
+
+def pruned_through():
+    setting = SystemSetting.query.filter_by(key=PRUNED_THROUGH_KEY).first()
+    return int(setting.value) if setting and setting.value else 0
+
+def oldest_running_txid():
+    """Every transaction with a lower txid has committed or rolled back, so its change log rows are final"""
+    return db.session.query(func.txid_snapshot_xmin(func.txid_current_snapshot())).scalar()
+
+def prune_change_log():
+    """Drop whole transactions past the retention window and remember how far we pruned"""
+    days = int(os.environ.get("SYNC_LOG_RETENTION_DAYS", "30"))
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    last_txid = db.session.query(func.max(ChangeLog.txid)).filter(ChangeLog.changed_at < cutoff).scalar()
+    if not last_txid:
+        return {"pruned": 0}
+    pruned = ChangeLog.query.filter(ChangeLog.txid <= last_txid).delete(synchronize_session=False)
+    setting = SystemSetting.query.filter_by(key=PRUNED_THROUGH_KEY).first()
+    if not setting:
+        setting = SystemSetting(
+            key=PRUNED_THROUGH_KEY,
+            type="string",
+            description="Highest change_log txid removed by retention; older sync tokens must resync"
+        )
+        db.session.add(setting)
+    setting.value = str(last_txid)
+    db.session.commit()
+    return {"pruned": pruned, "through": last_txid}
+
+change_log_pruner = SupervisedTask("change_log_pruner", prune_change_log, 3600)
+
+@sync_bp.record_once
+def start_change_log_pruner(state):
+    """Start the change log retention job when the blueprint is registered"""
+    change_log_pruner.init_app(state.app)
+
+def collect_changes(since, limit):
+    """
+    Changes after token (txid, id) `since`, newest op per row.
+    Entries are read in commit-safe order: only transactions older than the
+    oldest one still running are served, so nothing can later appear behind a
+    token. A long-running transaction holds the feed back until it finishes.
+    Returns (changes by entity, last (txid, id) served, has_more).
+    """
+    entries = db.session.query(ChangeLog.txid, ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op).filter(
+        tuple_(ChangeLog.txid, ChangeLog.id) > tuple_(*since),
+        ChangeLog.txid < oldest_running_txid()
+    ).order_by(ChangeLog.txid, ChangeLog.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    last = (entries[-1].txid, entries[-1].id) if entries else since
+
+    latest = {}
+    for entry in entries:
+        latest[(entry.entity, entry.entity_id)] = entry.op
+
+    changes = {}
+    for entity, (query_factory, serialize) in SYNC_LOADERS.items():
+        upsert_ids = [i for (e, i), op in latest.items() if e == entity and op == "upsert"]
+        deletes = [i for (e, i), op in latest.items() if e == entity and op == "delete"]
+        upserts = []
+        if upsert_ids:
+            model = ENTITY_MODELS[entity]
+            rows = query_factory().filter(model.id.in_(upsert_ids)).all()
+            upserts = [serialize(row) for row in rows]
+            # Rows deleted after the window was read surface as tombstones
+            found = {row.id for row in rows}
+            deletes.extend(i for i in upsert_ids if i not in found)
+        if upserts or deletes:
+            changes[entity] = {"upserts": upserts, "deletes": sorted(deletes)}
+    return changes, last, has_more
+
+@sync_bp.route('/', methods=['GET'])
+def sync_changes():
+    """Inserts, updates and tombstones since ?since=<token>; omit since to get a starting token"""
+    if not require_admin():
+        return jsonify({"error": "Admin access required"}), 403
+
+    since = request.args.get('since')
+    if not since:
+        # Bootstrap: the app loads the full lists once, then syncs from this token.
+        # Transactions still running may or may not be in those lists, so they are sent again
+        return jsonify({"changes": {}, "next_token": encode_cursor(oldest_running_txid(), 0), "has_more": False, "reset": True}), 200
+
+    try:
+        values = decode_cursor(since)
+        since_token = (int(values[0]), int(values[1]))
+    except (ValueError, TypeError, IndexError):
+        return jsonify({"error": "Invalid sync token"}), 400
+    if since_token[0] <= pruned_through():
+        return jsonify({"error": "Sync token expired, reload and resync", "reset": True}), 410
+
+    try:
+        changes, last, has_more = collect_changes(since_token, parse_limit(request.args.get('limit'), SYNC_PAGE_SIZE, SYNC_PAGE_SIZE))
+        return jsonify({
+            "changes": changes,
+            "next_token": encode_cursor(*last),
+            "has_more": has_more,
+            "reset": False
+        }), 200
+    except Exception as e:
+        print(f"Error collecting sync changes: {e}")
+        return jsonify({"error": "Failed to collect changes"}), 500
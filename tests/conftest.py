@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database.db import db
+# Every model module, so relationships between them can be configured
+import models.accounts
+import models.bookings
+import models.business
+import models.journal
+import models.system
+
+
+@pytest.fixture
+def sqlite_app(tmp_path):
+    """
+    Flask app bound to a throwaway SQLite database. Tests create the tables
+    they need with db.metadata.create_all(db.engine, tables=[...]); tables with
+    PostgreSQL-only column types cannot be created here.
+    """
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'test.sqlite3'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,108 @@
+import csv
+import io
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from database.db import db
+from models.accounts import Admin, Client, Company
+import routes.clients as clients_routes
+import utils.client_import as client_import
+
+ROWS = 10000
+
+
+@pytest.fixture
+def api(sqlite_app):
+    sqlite_app.config["SECRET_KEY"] = "test"
+    sqlite_app.register_blueprint(clients_routes.clients_bp, url_prefix="/clients")
+    db.metadata.create_all(db.engine, tables=[Admin.__table__, Company.__table__, Client.__table__])
+    test_client = sqlite_app.test_client()
+    with test_client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_type"] = "admin"
+    return test_client
+
+
+def _csv(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=["email", "name", "phone", "address", "premium", "company_name", "company_address"])
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+
+def _row(i, **overrides):
+    row = {
+        "email": f"client{i}@example.com",
+        "name": f"Client {i}",
+        "phone": f"555-{i:04d}",
+        "address": f"{i} Main St",
+        "premium": "Business" if i % 10 == 0 else "",
+        "company_name": f"Company {i % 50}",
+        "company_address": f"{i % 50} Market St"
+    }
+    row.update(overrides)
+    return row
+
+
+def _upload(api, body):
+    return api.post("/clients/bulk?format=csv", data=body, content_type="text/csv")
+
+
+def test_ten_thousand_row_import_end_to_end(api):
+    body = _csv([_row(i) for i in range(ROWS)])
+
+    response = _upload(api, body)
+
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    assert data["summary"] == {"created": ROWS, "updated": 0, "unchanged": 0, "error": 0}
+    assert Client.query.count() == ROWS
+    assert Company.query.count() == 50
+
+    # Re-uploading is a no-op apart from the rows that changed
+    rows = [_row(i) for i in range(ROWS)]
+    for i in range(0, ROWS, 100):
+        rows[i]["phone"] = "555-CHANGED"
+    data = _upload(api, _csv(rows)).get_json()
+
+    assert data["summary"] == {"created": 0, "updated": ROWS // 100, "unchanged": ROWS - ROWS // 100, "error": 0}
+    assert Client.query.filter_by(phone="555-CHANGED").count() == ROWS // 100
+
+
+def test_overlong_values_fail_only_their_row(api):
+    rows = [
+        _row(0),
+        _row(1, name="x" * 121),
+        _row(2, phone="1" * 21),
+        _row(3, address="a" * 256),
+        _row(4, email="e" * 110 + "@example.com"),
+        _row(5, company_name="c" * 121),
+        _row(6, company_address="a" * 256),
+        _row(7)
+    ]
+
+    data = _upload(api, _csv(rows)).get_json()
+
+    assert data["summary"] == {"created": 2, "updated": 0, "unchanged": 0, "error": 6}
+    errors = {r["row"]: r["error"] for r in data["results"] if r["status"] == "error"}
+    assert errors[2] == "name must be at most 120 characters"
+    assert errors[3] == "phone must be at most 20 characters"
+    assert errors[6] == "company_name must be at most 120 characters"
+    assert {c.email for c in Client.query} == {"client0@example.com", "client7@example.com"}
+
+
+def test_company_failure_is_reported_and_writes_nothing(api, monkeypatch):
+    def broken(names):
+        db.session.add(Company(name="Half written"))
+        db.session.flush()
+        raise OperationalError("INSERT INTO company", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(client_import, "resolve_companies", broken)
+    response = _upload(api, _csv([_row(i) for i in range(10)]))
+
+    assert response.status_code == 500
+    assert "no clients were imported" in response.get_json()["error"]
+    assert Client.query.count() == 0
+    assert Company.query.count() == 0
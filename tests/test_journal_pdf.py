@@ -0,0 +1,67 @@
+import os
+import time
+from io import BytesIO
+
+import pytest
+from PyPDF2 import PdfReader
+
+import utils.journal_pdf as journal_pdf
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # The env var is what spawned render workers read
+    monkeypatch.setenv("JOURNAL_PDF_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(journal_pdf, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(journal_pdf, "_pool", None)
+    yield tmp_path
+    if journal_pdf._pool is not None:
+        journal_pdf._pool.shutdown()
+
+
+def _entry(entry_id, notes="", signers=1):
+    return {
+        "id": entry_id,
+        "date": "2026-01-02",
+        "location": "Office",
+        "document_type": "Deed",
+        "id_verification": True,
+        "notes": notes,
+        "signers": [{"name": f"Signer {i}", "address": "1 Main St", "phone": "555"} for i in range(signers)]
+    }
+
+
+def test_merged_pdf_streams_every_page_in_order(cache_dir):
+    entries = [_entry(1), _entry(2, notes="line\n" * 120), _entry(3, signers=3)]
+    paths = journal_pdf.render_many(entries)
+    expected_pages = sum(len(PdfReader(path).pages) for path in paths)
+    assert expected_pages > 3
+
+    chunks = list(journal_pdf.iter_merged_pdf(iter(paths)))
+
+    assert len(chunks) == len(paths) + 1
+    merged = PdfReader(BytesIO(b"".join(chunks)))
+    assert len(merged.pages) == expected_pages
+    first_lines = [page.extract_text().splitlines()[0] for page in merged.pages]
+    assert first_lines[0] == "Journal Entry #1"
+    assert "Journal Entry #2 (continued)" in first_lines
+    assert first_lines[-1] == "Journal Entry #3"
+
+
+def test_new_render_leaves_the_previous_one_for_the_sweep(cache_dir):
+    old = journal_pdf.render_to_cache(_entry(7, notes="before"))
+    new = journal_pdf.render_to_cache(_entry(7, notes="after"))
+
+    assert old != new and os.path.exists(old) and os.path.exists(new)
+    assert journal_pdf.sweep_render_cache()["removed"] == 0
+
+    # Superseded long enough ago: the older version goes, the current one stays
+    an_hour_ago = time.time() - journal_pdf.STALE_RENDER_SECONDS - 1
+    os.utime(old, (an_hour_ago - 60, an_hour_ago - 60))
+    os.utime(new, (an_hour_ago, an_hour_ago))
+    abandoned = cache_dir / "9-abc.pdf.123.tmp"
+    abandoned.write_bytes(b"partial")
+    os.utime(abandoned, (an_hour_ago, an_hour_ago))
+
+    assert journal_pdf.sweep_render_cache()["removed"] == 2
+    assert os.path.exists(new) and not os.path.exists(old) and not abandoned.exists()
@@ -0,0 +1,294 @@
+import json
+import os
+import socketserver
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import smtplib
+from email.mime.text import MIMEText
+
+import pytest
+
+import utils.notifications as notifications
+import utils.push as push
+from utils.mailer import SMTPPool
+from utils.outbound import OutboundQueue, PermanentFailure
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib without TLS or auth"""
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 localhost test SMTP")
+        envelope = {}
+        while True:
+            line = self.rfile.readline().decode().rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif command == "MAIL":
+                envelope = {"from": line.split(":", 1)[1].strip("<> "), "to": []}
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipient = line.split(":", 1)[1].strip("<> ")
+                if recipient.startswith("reject"):
+                    self.reply("550 No such user")
+                    continue
+                envelope["to"].append(recipient)
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline().decode()
+                    if data in (".\r\n", ""):
+                        break
+                    lines.append(data)
+                self.server.messages.append({**envelope, "data": "".join(lines)})
+                self.reply("250 OK queued")
+            elif command in ("NOOP", "RSET"):
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages = []
+
+
+class _ExpoHandler(BaseHTTPRequestHandler):
+    """Fake Expo push API: accepts every token except ones starting with 'dead'"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, body))
+        if self.path == "/send":
+            data = [
+                {"status": "error", "message": "not registered", "details": {"error": "DeviceNotRegistered"}}
+                if message["to"].startswith("dead") else
+                {"status": "ok", "id": f"ticket-{message['to']}"}
+                for message in body
+            ]
+        elif self.path == "/receipts":
+            data = {ticket_id: {"status": "ok"} for ticket_id in body["ids"]}
+        else:
+            self.send_response(400)
+            self.end_headers()
+            return
+        payload = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = OutboundQueue(spool_path=str(tmp_path / "spool.sqlite3"), workers=2, base_delay=0.05, poll_interval=0.05)
+    queue.register("email", notifications.deliver_email)
+    queue.register("push", push.deliver_push_batch)
+    queue.register("push_receipts", push.check_push_receipts)
+    monkeypatch.setattr(push, "outbound_queue", queue)
+    yield queue
+    queue.stop()
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = _serve(_SMTPServer())
+    monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(server.server_address[1]))
+    monkeypatch.setenv("SMTP_USE_TLS", "false")
+    pool = SMTPPool(size=2, timeout=5)
+    monkeypatch.setattr(notifications, "mailer", pool)
+    yield server
+    pool.close_all()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def expo_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ExpoHandler)
+    server.requests = []
+    _serve(server)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(push, "push_client", push.PushClient(push_url=f"{base}/send", receipts_url=f"{base}/receipts", timeout=5))
+    monkeypatch.setattr(push, "RECEIPT_DELAY_SECONDS", 0)
+    monkeypatch.setattr(push, "prune_tokens", lambda tokens: len(set(tokens)))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _counts(queue):
+    return queue.status()["counts"]
+
+
+def test_emails_are_delivered_through_local_smtp(queue, smtp_server):
+    for i in range(5):
+        queue.enqueue("email", {"to": f"client{i}@example.com", "subject": "Booking confirmed", "body": f"Booking {i}"})
+
+    assert _wait_for(lambda: len(smtp_server.messages) == 5 and not _counts(queue))
+    assert sorted(m["to"][0] for m in smtp_server.messages) == [f"client{i}@example.com" for i in range(5)]
+    assert all("Subject: Booking confirmed" in m["data"] for m in smtp_server.messages)
+
+
+def test_refused_recipient_is_not_retried_as_a_dropped_connection(smtp_server):
+    pool = notifications.mailer
+    msg = MIMEText("Hi")
+    msg["From"], msg["To"], msg["Subject"] = "no-reply@example.com", "rejected@example.com", "Hi"
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        pool.send(msg)
+    assert pool.counters["reconnects"] == 0
+    assert pool.counters["connects"] == 1
+
+    msg.replace_header("To", "client@example.com")
+    pool.send(msg)
+    assert pool.counters["connects"] == 1
+
+
+def test_unreachable_smtp_is_retried_until_dead(queue, monkeypatch):
+    monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", "1")
+    monkeypatch.setenv("SMTP_USE_TLS", "false")
+    monkeypatch.setattr(notifications, "mailer", SMTPPool(size=1, timeout=1))
+    queue.max_attempts = 3
+    message_id = queue.enqueue("email", {"to": "client@example.com", "subject": "Hi", "body": "Hi"})
+
+    assert _wait_for(lambda: _counts(queue) == {"dead": 1})
+    attempts, = queue._connection().execute("SELECT attempts FROM outbound WHERE id = ?", (message_id,)).fetchone()
+    assert attempts == 3
+
+
+def test_push_batches_and_receipts_go_to_fake_expo(queue, expo_server):
+    tokens = [f"ExponentPushToken[{i}]" for i in range(150)] + ["dead-token"]
+    message_ids = push.queue_push_batch(tokens, "Reminder", "Your signing is tomorrow")
+
+    assert len(message_ids) == 2
+    assert _wait_for(lambda: not _counts(queue) and sum(path == "/receipts" for path, _ in expo_server.requests) == 2)
+    sent = [message for path, body in expo_server.requests if path == "/send" for message in body]
+    assert sorted(m["to"] for m in sent) == sorted(tokens)
+    assert push.push_client.stats()["errors"] == 1
+
+
+def test_permanent_failures_are_not_retried(queue):
+    calls = []
+
+    def reject(payload):
+        calls.append(payload)
+        raise PermanentFailure("bad address")
+
+    queue.register("reject", reject)
+    queue.enqueue("reject", {})
+
+    assert _wait_for(lambda: _counts(queue) == {"dead": 1})
+    assert len(calls) == 1
+
+
+def test_live_lease_is_not_taken_over(queue):
+    queue.register("noop", lambda payload: None)
+    message_id = queue.enqueue("noop", {}, delay=3600)
+    # Claim by hand instead of racing the workers
+    queue.stop()
+    conn = queue._connection()
+    # Another process is mid-delivery on this message
+    conn.execute(
+        "UPDATE outbound SET status = 'sending', claimed_by = 'other:1', claimed_at = ? WHERE id = ?",
+        (time.time(), message_id)
+    )
+    assert queue._claim() is None
+
+    conn.execute("UPDATE outbound SET claimed_at = ? WHERE id = ?", (time.time() - queue.lease_seconds - 1, message_id))
+    assert queue._claim()[0] == message_id
+    claimed_by, = conn.execute("SELECT claimed_by FROM outbound WHERE id = ?", (message_id,)).fetchone()
+    assert claimed_by == queue._claimant
+
+
+def test_restart_does_not_requeue_other_processes_messages(tmp_path):
+    spool = str(tmp_path / "spool.sqlite3")
+    first = OutboundQueue(spool_path=spool, workers=1)
+    first.register("noop", lambda payload: None)
+    message_id = first.enqueue("noop", {}, delay=3600)
+    first.stop()
+    first._connection().execute(
+        "UPDATE outbound SET status = 'sending', claimed_by = 'other:1', claimed_at = ? WHERE id = ?",
+        (time.time(), message_id)
+    )
+
+    second = OutboundQueue(spool_path=spool, workers=1)
+    second.register("noop", lambda payload: None)
+    second.start()
+    try:
+        assert second.status()["counts"] == {"sending": 1}
+    finally:
+        second.stop()
+
+
+def test_forked_child_starts_its_own_workers(queue):
+    queue.start()
+    inherited = list(queue._threads)
+    # What a gunicorn --preload worker sees: the parent's thread list and connection
+    queue._owner_pid = os.getpid() + 1
+    queue.start()
+
+    assert queue._threads and not set(queue._threads) & set(inherited)
+    assert queue._owner_pid == os.getpid()
+
+
+def test_worker_survives_a_failed_spool_update(queue, monkeypatch):
+    delivered = []
+    queue.register("noop", lambda payload: delivered.append(payload["n"]))
+    finish = queue._finish
+    failures = []
+
+    def flaky_finish(*args, **kwargs):
+        if not failures:
+            failures.append(args)
+            raise sqlite3.OperationalError("database is locked")
+        return finish(*args, **kwargs)
+
+    monkeypatch.setattr(queue, "_finish", flaky_finish)
+    queue.workers = 1
+    queue.enqueue("noop", {"n": 1})
+    queue.enqueue("noop", {"n": 2})
+
+    assert _wait_for(lambda: sorted(delivered) == [1, 2])
+    assert all(t.is_alive() for t in queue._threads)
+    # The message whose update failed stays leased until the lease runs out
+    assert _counts(queue) == {"sending": 1}
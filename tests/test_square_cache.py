@@ -0,0 +1,64 @@
+import pytest
+
+import utils.square_cache as square_cache_module
+from utils.square_cache import SquareReadCache
+
+
+class _Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def square(monkeypatch):
+    """Fake Square catalog whose items can be changed between reads"""
+    catalog = {"/v2/catalog/object/ITEM": {"name": "Deed"}, "/v2/catalog/object/OTHER": {"name": "Will"}}
+    calls = []
+
+    def get(path, **kwargs):
+        calls.append(path)
+        return _Response(dict(catalog[path]))
+
+    monkeypatch.setattr(square_cache_module.square_api, "get", get)
+    return catalog, calls
+
+
+def test_invalidate_evicts_disk_hits_in_the_invalidating_worker(tmp_path, square):
+    catalog, calls = square
+    writer = SquareReadCache(ttl=600, disk_dir=str(tmp_path))
+    reader = SquareReadCache(ttl=600, disk_dir=str(tmp_path))
+
+    writer.fetch("catalog:ITEM", "/v2/catalog/object/ITEM")
+    writer.fetch("catalog:OTHER", "/v2/catalog/object/OTHER")
+    # Served from the disk tier, so the reader holds no validator for these keys
+    assert reader.fetch("catalog:ITEM", "/v2/catalog/object/ITEM") == {"name": "Deed"}
+    assert reader.fetch("catalog:OTHER", "/v2/catalog/object/OTHER") == {"name": "Will"}
+    assert len(calls) == 2
+
+    catalog["/v2/catalog/object/ITEM"] = {"name": "Deed (updated)"}
+    reader.invalidate("catalog:ITEM")
+
+    assert reader.fetch("catalog:ITEM", "/v2/catalog/object/ITEM") == {"name": "Deed (updated)"}
+    assert writer.fetch("catalog:ITEM", "/v2/catalog/object/ITEM") == {"name": "Deed (updated)"}
+    # Other prefixes stay cached
+    assert reader.fetch("catalog:OTHER", "/v2/catalog/object/OTHER") == {"name": "Will"}
+    assert calls.count("/v2/catalog/object/OTHER") == 1
+
+
+def test_failed_generation_write_still_invalidates_locally(tmp_path, square):
+    catalog, calls = square
+    cache = SquareReadCache(ttl=600, disk_dir=str(tmp_path))
+    cache.fetch("catalog:ITEM", "/v2/catalog/object/ITEM")
+    # A directory where the marker file should be makes the write fail
+    (tmp_path / SquareReadCache.GENERATION_FILE).mkdir()
+
+    catalog["/v2/catalog/object/ITEM"] = {"name": "Deed (updated)"}
+    cache.invalidate("catalog:")
+
+    assert cache.fetch("catalog:ITEM", "/v2/catalog/object/ITEM") == {"name": "Deed (updated)"}
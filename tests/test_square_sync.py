@@ -0,0 +1,155 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from database.db import db
+from models.accounts import Client, Company
+from models.system import SystemSetting
+import routes.square as square
+
+
+def _rfc3339(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _parse(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class _SquareHandler(BaseHTTPRequestHandler):
+    """Fake Square customers API: list and search with cursor paging and an updated_at filter"""
+
+    def log_message(self, *args):
+        pass
+
+    def _page(self, customers, limit, cursor):
+        offset = int(cursor or 0)
+        page = {"customers": customers[offset:offset + limit]}
+        if offset + limit < len(customers):
+            page["cursor"] = str(offset + limit)
+        payload = json.dumps(page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.server.requests.append(("GET", url.path, query))
+        self._page(list(self.server.customers), int(query.get("limit", 100)), query.get("cursor"))
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(("POST", self.path, body))
+        start_at = body["query"]["filter"]["updated_at"]["start_at"]
+        customers = sorted(
+            (c for c in self.server.customers if _parse(c["updated_at"]) >= _parse(start_at)),
+            key=lambda c: c["updated_at"]
+        )
+        self._page(customers, body["limit"], body.get("cursor"))
+
+
+@pytest.fixture
+def square_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SquareHandler)
+    server.customers = []
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("SQUARE_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv("SQUARE_ACCESS_TOKEN", "test-token")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clients(sqlite_app):
+    db.metadata.create_all(db.engine, tables=[Company.__table__, Client.__table__, SystemSetting.__table__])
+    db.session.add_all([
+        Client(name=f"Client {i}", email=f"client{i}@example.com")
+        for i in range(250)
+    ])
+    db.session.commit()
+
+
+def _customer(i, updated_at):
+    return {
+        "id": f"SQ{i}",
+        "email_address": f"Client{i}@Example.com",
+        "given_name": "Client",
+        "family_name": str(i),
+        "updated_at": _rfc3339(updated_at)
+    }
+
+
+def _linked():
+    return {c.email: c.square_customer_id for c in Client.query.filter(Client.square_customer_id.isnot(None))}
+
+
+def test_full_sync_pages_through_every_customer(clients, square_server):
+    old = datetime.now(timezone.utc) - timedelta(days=30)
+    square_server.customers = [_customer(i, old) for i in range(250)]
+
+    report = square.sync_square_customers(mode="full")
+
+    assert report["pages"] == 3
+    assert report["customers"] == 250 and report["linked"] == 250
+    assert _linked()["client42@example.com"] == "SQ42"
+    assert all(method == "GET" for method, _, _ in square_server.requests)
+
+
+def test_watermark_is_run_start_less_overlap(clients, square_server):
+    old = datetime.now(timezone.utc) - timedelta(days=30)
+    square_server.customers = [_customer(i, old) for i in range(3)]
+
+    before = datetime.now(timezone.utc)
+    report = square.sync_square_customers(mode="full")
+    after = datetime.now(timezone.utc)
+
+    watermark = _parse(square.load_sync_watermark())
+    assert report["watermark"] == square.load_sync_watermark()
+    overlap = timedelta(seconds=square.SYNC_OVERLAP_SECONDS)
+    assert before - overlap - timedelta(seconds=1) <= watermark <= after - overlap
+
+
+def test_incremental_sync_picks_up_late_indexed_customers(clients, square_server):
+    now = datetime.now(timezone.utc)
+    square_server.customers = [_customer(0, now - timedelta(days=3)), _customer(1, now - timedelta(seconds=2))]
+    square.sync_square_customers(mode="full")
+    square_server.requests.clear()
+
+    # Updated before the last customer the first run saw, but only indexed by Square afterwards
+    square_server.customers.append(_customer(2, now - timedelta(seconds=5)))
+    report = square.sync_square_customers(mode="incremental")
+
+    method, path, body = square_server.requests[0]
+    assert (method, path) == ("POST", "/v2/customers/search")
+    assert body["query"]["filter"]["updated_at"]["start_at"] == report["since"]
+    assert report["customers"] == 2
+    assert _linked()["client2@example.com"] == "SQ2"
+
+
+def test_failed_run_keeps_the_previous_watermark(clients, square_server, monkeypatch):
+    square.save_sync_watermark("2020-01-01T00:00:00Z")
+    monkeypatch.setattr(square.square_api, "max_retries", 0)
+    monkeypatch.setenv("SQUARE_BASE_URL", "http://127.0.0.1:1")
+
+    with pytest.raises(Exception):
+        square.sync_square_customers(mode="incremental")
+    assert square.load_sync_watermark() == "2020-01-01T00:00:00Z"
+
+
+def test_watermark_never_moves_backwards(clients, square_server):
+    future = _rfc3339(datetime.now(timezone.utc) + timedelta(hours=1))
+    square.save_sync_watermark(future)
+
+    report = square.sync_square_customers(mode="incremental")
+
+    assert report["watermark"] == future
+    assert square.load_sync_watermark() == future
@@ -0,0 +1,109 @@
+import datetime
+import os
+
+import pytest
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from database.db import db
+from models.accounts import Client
+from models.system import ChangeLog
+from utils.pagination import decode_cursor, encode_cursor
+
+# The feed relies on PostgreSQL transaction ids, so these tests need a real server
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL (PostgreSQL) is not set")
+
+
+@pytest.fixture
+def api():
+    import routes.sync as sync
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SECRET_KEY"] = "test"
+    db.init_app(app)
+    app.register_blueprint(sync.sync_bp, url_prefix="/sync")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = 1
+            session["user_type"] = "admin"
+        yield client
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def _sync(api, token):
+    response = api.get("/sync/", query_string={"since": token})
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()
+    db.session.commit()
+    return data
+
+
+def _client_names(data):
+    return sorted(c["name"] for c in data["changes"].get("clients", {}).get("upserts", []))
+
+
+def test_slow_transaction_is_not_skipped(api):
+    token = api.get("/sync/").get_json()["next_token"]
+
+    slow = Session(db.engine)
+    slow.add(Client(name="Slow", email="slow@example.com"))
+    slow.flush()
+
+    db.session.add(Client(name="Fast", email="fast@example.com"))
+    db.session.commit()
+
+    # The slow transaction took its change_log row first and is still open
+    data = _sync(api, token)
+    assert _client_names(data) == []
+    assert data["next_token"] == token
+
+    slow.commit()
+    slow.close()
+    data = _sync(api, token)
+    assert _client_names(data) == ["Fast", "Slow"]
+
+    assert _client_names(_sync(api, data["next_token"])) == []
+
+
+def test_pages_follow_transaction_order(api):
+    token = api.get("/sync/").get_json()["next_token"]
+    for i in range(5):
+        db.session.add(Client(name=f"Client {i}", email=f"client{i}@example.com"))
+        db.session.commit()
+
+    names = []
+    while True:
+        data = api.get("/sync/", query_string={"since": token, "limit": 2}).get_json()
+        db.session.commit()
+        names.extend(_client_names(data))
+        token = data["next_token"]
+        if not data["has_more"]:
+            break
+    assert names == [f"Client {i}" for i in range(5)]
+    txids = [txid for txid, in db.session.query(ChangeLog.txid).order_by(ChangeLog.id)]
+    assert decode_cursor(token)[0] == max(txids)
+
+
+def test_old_and_pruned_tokens_must_resync(api):
+    import routes.sync as sync
+
+    token = api.get("/sync/").get_json()["next_token"]
+    db.session.add(Client(name="Old", email="old@example.com"))
+    db.session.commit()
+    ChangeLog.query.update({"changed_at": datetime.datetime.utcnow() - datetime.timedelta(days=365)})
+    db.session.commit()
+
+    assert sync.prune_change_log()["pruned"] == 1
+    assert api.get("/sync/", query_string={"since": token}).status_code == 410
+    fresh = api.get("/sync/").get_json()["next_token"]
+    assert api.get("/sync/", query_string={"since": fresh}).status_code == 200
+    assert api.get("/sync/", query_string={"since": encode_cursor(42)}).status_code == 400
+    assert api.get("/sync/", query_string={"since": "not-a-token"}).status_code == 400
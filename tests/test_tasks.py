@@ -0,0 +1,29 @@
+import threading
+
+from database.db import db
+from models.system import SystemSetting
+from utils.tasks import SupervisedTask
+
+
+def test_requested_run_happens_on_the_leader_not_the_caller(sqlite_app):
+    db.metadata.create_all(db.engine, tables=[SystemSetting.__table__])
+    runs = []
+    ran = threading.Event()
+
+    def run():
+        runs.append(threading.current_thread().name)
+        ran.set()
+
+    task = SupervisedTask("rebuild", run, interval=3600, poll_interval=0.05)
+    task.init_app(sqlite_app)
+    try:
+        assert ran.wait(5)
+        ran.clear()
+        # The scheduled run is an hour away; only the request triggers this one
+        task.request_run()
+        assert ran.wait(5)
+    finally:
+        task.stop()
+
+    assert runs == ["task-rebuild", "task-rebuild"]
+    assert not task.shared_status()["run_requested"]
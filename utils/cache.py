@@ -0,0 +1,90 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+
+    def get_or_set(self, key, loader, ttl=None):
+        """Return the cached value for key, calling loader() to fill it on a miss"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def invalidate_prefix(self, prefix):
+        """Drop every key that starts with prefix"""
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# (cache, model classes) pairs cleared whenever a commit writes one of the models
+_commit_invalidations = []
+
+def invalidate_on_commit(cache, *models):
+    """Clear cache after any commit that inserts, updates or deletes an instance of models"""
+    _commit_invalidations.append((cache, tuple(models)))
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session, flush_context):
+    if not _commit_invalidations:
+        return
+    touched = list(session.new) + list(session.dirty) + list(session.deleted)
+    pending = session.info.setdefault("pending_cache_invalidations", set())
+    for cache, models in _commit_invalidations:
+        if any(isinstance(obj, models) for obj in touched):
+            pending.add(cache)
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session):
+    for cache in session.info.pop("pending_cache_invalidations", ()):
+        cache.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("pending_cache_invalidations", None)
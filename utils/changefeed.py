@@ -0,0 +1,60 @@
+import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models.accounts import Client
+from models.bookings import Booking
+from models.business import Finance, Mileage
+from models.journal import JournalEntry, JournalSigner
+from models.system import ChangeLog
+
+# Model -> entity name used in the change log and the /sync payload
+TRACKED_MODELS = {
+    Booking: "bookings",
+    Client: "clients",
+    Finance: "finances",
+    Mileage: "mileage",
+    JournalEntry: "journal"
+}
+
+def _change_key(obj):
+    """(entity, id) a flushed object should be logged under, or None if it is not tracked"""
+    entity = TRACKED_MODELS.get(type(obj))
+    if entity:
+        return entity, obj.id
+    # Signers are serialized inside their journal entry
+    if isinstance(obj, JournalSigner) and obj.journal_id:
+        return "journal", obj.journal_id
+    return None
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    """
+    Append one change_log row per tracked object written in this flush, inside the
+    same transaction, so a rolled-back write never shows up in the feed.
+    Bulk query.update()/delete() bypass the session and are not recorded.
+    """
+    changes = {}
+    for obj in list(session.new) + [o for o in session.dirty if session.is_modified(o)]:
+        key = _change_key(obj)
+        if key and key[1] is not None:
+            changes.setdefault(key, "upsert")
+    for obj in session.deleted:
+        key = _change_key(obj)
+        if not key or key[1] is None:
+            continue
+        if isinstance(obj, JournalSigner):
+            # Removing a signer only changes its journal entry
+            changes.setdefault(key, "upsert")
+        else:
+            changes[key] = "delete"
+    if not changes:
+        return
+
+    now = datetime.datetime.utcnow()
+    session.connection().execute(
+        ChangeLog.__table__.insert(),
+        [
+            {"entity": entity, "entity_id": entity_id, "op": op, "changed_at": now}
+            for (entity, entity_id), op in changes.items()
+        ]
+    )
@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+from database.db import db
+from models.accounts import Client, Company
+
+IMPORT_CHUNK_SIZE = 500
+MAX_IMPORT_ROWS = 50000
+# Columns a row may set on a client; email is the upsert key
+CLIENT_IMPORT_FIELDS = ["name", "phone", "address", "premium"]
+# Longest value each column accepts, checked per row so one bad cell cannot fail a chunk
+FIELD_LENGTHS = {
+    "email": Client.email.type.length,
+    "name": Client.name.type.length,
+    "phone": Client.phone.type.length,
+    "address": Client.address.type.length,
+    "company_name": Company.name.type.length,
+    "company_address": Company.address.type.length
+}
+
+class ClientImportError(Exception):
+    """The import could not be started, e.g. its companies failed to save; nothing was written"""
+
+def resolve_companies(names):
+    """
+    Map company names to Company rows with one IN query, inserting the missing ones
+    in a single flush. `names` maps name -> address used if the company is new.
+    Does not commit.
+    """
+    names = {name: address for name, address in names.items() if name}
+    if not names:
+        return {}
+    companies = {c.name: c for c in Company.query.filter(Company.name.in_(list(names)))}
+    missing = [Company(name=name, address=address) for name, address in names.items() if name not in companies]
+    if missing:
+        db.session.add_all(missing)
+        db.session.flush()
+        companies.update((c.name, c) for c in missing)
+    return companies
+
+def read_import_rows(stream, fmt):
+    """Yield dict rows from a CSV (header row required) or JSON lines upload"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for row in csv.DictReader(text):
+            yield {(k or "").strip().lower(): v for k, v in row.items()}
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield row if isinstance(row, dict) else None
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+def _validate(row):
+    """(cleaned row, None) or (None, error message)"""
+    if row is None:
+        return None, "Row is not a JSON object"
+    cleaned = {field: _clean(row.get(field)) for field in ["email", "company_name", "company_address"] + CLIENT_IMPORT_FIELDS}
+    if not cleaned["email"] or "@" not in cleaned["email"]:
+        return None, "A valid email is required"
+    if cleaned["premium"] and cleaned["premium"] not in Client.premium.type.enums:
+        return None, f"Unknown premium tier {cleaned['premium']!r}"
+    for field, length in FIELD_LENGTHS.items():
+        if cleaned[field] and len(cleaned[field]) > length:
+            return None, f"{field} must be at most {length} characters"
+    return cleaned, None
+
+def _upsert_chunk(chunk, company_ids, report):
+    """Create or update the clients for one chunk of (row number, cleaned row); does not commit"""
+    existing = {c.email: c for c in Client.query.filter(Client.email.in_([row["email"] for _, row in chunk]))}
+    touched = []
+    for row_number, row in chunk:
+        client = existing.get(row["email"])
+        company_id = company_ids.get(row["company_name"])
+        if client is None:
+            if not row["name"]:
+                report[row_number] = {"row": row_number, "email": row["email"], "status": "error", "error": "Name is required for new clients"}
+                continue
+            client = Client(email=row["email"])
+            db.session.add(client)
+            existing[row["email"]] = client
+            status = "created"
+        else:
+            status = "unchanged"
+        for field in CLIENT_IMPORT_FIELDS:
+            # Blank cells leave the current value alone
+            if row[field] is not None and getattr(client, field) != row[field]:
+                setattr(client, field, row[field])
+                status = "updated" if status == "unchanged" else status
+        if company_id is not None and client.company_id != company_id:
+            client.company_id = company_id
+            status = "updated" if status == "unchanged" else status
+        touched.append((row_number, row["email"], client, status))
+    # One batched INSERT/UPDATE round per chunk; ids are assigned here
+    db.session.flush()
+    for row_number, email, client, status in touched:
+        report[row_number] = {"row": row_number, "email": email, "status": status, "id": client.id}
+
+def import_clients(rows):
+    """
+    Upsert clients keyed by email from an iterable of raw dict rows.
+    Companies are resolved once up front; clients are written and committed in
+    chunks, so a failing chunk only loses its own rows.
+    Returns (per-row report, summary counts). Raises ClientImportError if the
+    companies cannot be saved.
+    """
+    report = {}
+    valid = []
+    for row_number, raw in enumerate(rows, start=1):
+        if row_number > MAX_IMPORT_ROWS:
+            raise ValueError(f"Imports are limited to {MAX_IMPORT_ROWS} rows")
+        row, error = _validate(raw)
+        if error:
+            report[row_number] = {"row": row_number, "email": (raw or {}).get("email"), "status": "error", "error": error}
+        else:
+            valid.append((row_number, row))
+
+    company_addresses = {}
+    for _, row in valid:
+        company_addresses.setdefault(row["company_name"], row["company_address"])
+    try:
+        # Keep plain ids: the Company objects expire at every commit below
+        company_ids = {name: c.id for name, c in resolve_companies(company_addresses).items()}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise ClientImportError(f"Failed to save companies: {e}") from e
+
+    for i in range(0, len(valid), IMPORT_CHUNK_SIZE):
+        chunk = valid[i:i + IMPORT_CHUNK_SIZE]
+        try:
+            _upsert_chunk(chunk, company_ids, report)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error importing clients (rows {chunk[0][0]}-{chunk[-1][0]}): {e}")
+            for row_number, row in chunk:
+                if report.get(row_number, {}).get("status") != "error":
+                    report[row_number] = {"row": row_number, "email": row["email"], "status": "error", "error": "Chunk failed to save"}
+
+    results = [report[n] for n in sorted(report)]
+    summary = {status: 0 for status in ("created", "updated", "unchanged", "error")}
+    for result in results:
+        summary[result["status"]] += 1
+    return results, summary
@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import time
+from models.accounts import SchirmersNotary
+from utils.cache import TTLCache, invalidate_on_commit
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+company_cache = TTLCache(ttl=int(os.environ.get("COMPANY_CACHE_TTL", "300")))
+invalidate_on_commit(company_cache, SchirmersNotary)
+
+def _parse_hours(office_start, office_end):
+    try:
+        start_hour, start_min = map(int, office_start.split(":"))
+        end_hour, end_min = map(int, office_end.split(":"))
+        return time(start_hour, start_min), time(end_hour, end_min)
+    except (ValueError, AttributeError):
+        return time(9, 0), time(17, 0)
+
+def parse_schedule(company):
+    """Map weekday number (Mon=0) to (start, end) office hours from SchirmersNotary settings"""
+    if not company:
+        return {}
+    if company.available_days_json:
+        try:
+            detailed_availability = json.loads(company.available_days_json)
+            return {
+                i: _parse_hours(detailed_availability[name].get("start"), detailed_availability[name].get("end"))
+                for i, name in enumerate(DAY_NAMES)
+                if name in detailed_availability
+            }
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+            print(f"Error parsing available_days_json: {e}, falling back to simple availability")
+            office_start = company.office_start
+            office_end = company.office_end
+            available_days = company.available_days
+    else:
+        office_start = company.office_start or "09:00"
+        office_end = company.office_end or "17:00"
+        available_days = company.available_days or "0,1,2,3,4"
+
+    hours = _parse_hours(office_start, office_end)
+    try:
+        day_numbers = [int(d.strip()) for d in (available_days or "").split(",") if d.strip()]
+    except ValueError:
+        print(f"Invalid available_days setting: {available_days}")
+        return {}
+    return {day: hours for day in day_numbers}
+
+class CompanyProfile:
+    """Detached, read-only copy of the SchirmersNotary row with its schedule already parsed"""
+
+    def __init__(self, company):
+        self.id = company.id
+        self.ceo_admin_id = company.ceo_admin_id
+        self.address = company.address
+        self.phone = company.phone
+        self.email = company.email
+        self.office_start = company.office_start
+        self.office_end = company.office_end
+        self.available_days = company.available_days
+        self.available_days_json = company.available_days_json
+        self.schedule = parse_schedule(company)
+
+    def hours_for(self, day):
+        """(start, end) office hours for a date, or None when the office is closed"""
+        return self.schedule.get(day.weekday())
+
+def company_profile():
+    """Cached CompanyProfile, or None when no company settings exist yet"""
+    def load():
+        company = SchirmersNotary.query.first()
+        return CompanyProfile(company) if company else None
+    return company_cache.get_or_set("profile", load)
+
+def invalidate_company_profile():
+    company_cache.invalidate()
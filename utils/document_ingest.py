@@ -0,0 +1,154 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+from PyPDF2 import PdfReader
+from sqlalchemy import func
+from database.db import db
+from models.journal import PDF, DocumentDerivative
+from utils.storage import document_store
+
+try:
+    # Optional: renders the real first page instead of its largest embedded image
+    import fitz
+except ImportError:
+    fitz = None
+
+logger = logging.getLogger("document_ingest")
+
+INGEST_BATCH_SIZE = int(os.environ.get("DOCUMENT_INGEST_BATCH", "20"))
+# Stop picking up new batches after this long so one run never hogs the task thread
+INGEST_TIME_BUDGET = float(os.environ.get("DOCUMENT_INGEST_TIME_BUDGET", "50"))
+MAX_ATTEMPTS = 3
+THUMBNAIL_SIZE = (320, 320)
+MAX_TEXT_CHARS = 200000
+
+_pool = None
+
+def _thumbnail_bytes(image):
+    image = image.convert("RGB")
+    image.thumbnail(THUMBNAIL_SIZE)
+    out = BytesIO()
+    image.save(out, "JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+def _first_page_image(data, reader):
+    if fitz is not None:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            pix = doc[0].get_pixmap(dpi=48)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    # Scans are usually one full-page image per page, so the largest one is the page
+    images = reader.pages[0].images
+    if not images:
+        return None
+    largest = max(images, key=lambda img: len(img.data))
+    return Image.open(BytesIO(largest.data))
+
+def _pdf_derivatives(data):
+    reader = PdfReader(BytesIO(data))
+    parts = []
+    length = 0
+    for page in reader.pages:
+        if length >= MAX_TEXT_CHARS:
+            break
+        text = page.extract_text() or ""
+        parts.append(text)
+        length += len(text)
+    image = _first_page_image(data, reader) if reader.pages else None
+    return image, "\n".join(parts)[:MAX_TEXT_CHARS].strip(), len(reader.pages)
+
+def extract_derivatives(sha256, mime_type):
+    """
+    Build the thumbnail and text for one stored document. Runs in a worker process,
+    so it only touches the document store and returns plain data.
+    """
+    try:
+        with document_store.open(sha256) as f:
+            data = f.read()
+        if mime_type == "application/pdf":
+            image, text, page_count = _pdf_derivatives(data)
+        elif mime_type and mime_type.startswith("image/"):
+            image = Image.open(BytesIO(data))
+            text, page_count = "", getattr(image, "n_frames", 1)
+        else:
+            return {"sha256": sha256, "status": "done", "thumbnail_sha256": None, "text": "", "page_count": None, "error": None}
+        thumbnail_sha256 = None
+        if image is not None:
+            thumbnail_sha256 = document_store.put(BytesIO(_thumbnail_bytes(image)), "thumbnail.jpg", "image/jpeg").sha256
+        return {"sha256": sha256, "status": "done", "thumbnail_sha256": thumbnail_sha256, "text": text, "page_count": page_count, "error": None}
+    except Exception as e:
+        return {"sha256": sha256, "status": "failed", "thumbnail_sha256": None, "text": None, "page_count": None, "error": str(e)[:255]}
+
+def ingest_pool():
+    global _pool
+    if _pool is None:
+        workers = int(os.environ.get("DOCUMENT_INGEST_WORKERS", "0")) or None
+        # Spawn rather than fork: this runs in a web worker that already has threads
+        # (outbound, pollers, SMTP) whose locks a forked child could inherit held
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _settled_hashes():
+    """Documents that need no more work: finished, or out of retries"""
+    return db.session.query(DocumentDerivative.sha256).filter(
+        (DocumentDerivative.status == "done") | (DocumentDerivative.attempts >= MAX_ATTEMPTS)
+    )
+
+def pending_documents(limit, skip=()):
+    """
+    (sha256, mime_type) of stored documents with no finished derivatives, newest
+    upload first so fresh documents get previews while the backlog drains.
+    """
+    query = db.session.query(PDF.sha256, func.min(PDF.mime_type)).filter(
+        PDF.sha256.isnot(None),
+        PDF.sha256.notin_(_settled_hashes())
+    )
+    if skip:
+        query = query.filter(PDF.sha256.notin_(skip))
+    return query.group_by(PDF.sha256).order_by(func.max(PDF.id).desc()).limit(limit).all()
+
+def pending_count():
+    return db.session.query(func.count(func.distinct(PDF.sha256))).filter(
+        PDF.sha256.isnot(None),
+        PDF.sha256.notin_(_settled_hashes())
+    ).scalar()
+
+def save_derivatives(results):
+    existing = {
+        d.sha256: d for d in DocumentDerivative.query.filter(
+            DocumentDerivative.sha256.in_([r["sha256"] for r in results])
+        )
+    }
+    for result in results:
+        derivative = existing.get(result["sha256"])
+        if not derivative:
+            derivative = DocumentDerivative(sha256=result["sha256"], attempts=0)
+            db.session.add(derivative)
+        derivative.attempts += 1
+        for field in ("status", "thumbnail_sha256", "text", "page_count", "error"):
+            setattr(derivative, field, result[field])
+        if result["status"] == "failed":
+            logger.warning("Derivatives for %s failed (attempt %s): %s", result["sha256"], derivative.attempts, result["error"])
+    db.session.commit()
+
+def process_pending():
+    """
+    Work through documents without derivatives a batch at a time. Each batch is
+    committed on its own, so an interrupted run picks up where it stopped.
+    """
+    started = time.monotonic()
+    # Failures wait for the next run instead of being retried straight away
+    attempted = set()
+    failed = 0
+    while time.monotonic() - started < INGEST_TIME_BUDGET:
+        batch = pending_documents(INGEST_BATCH_SIZE, skip=attempted)
+        if not batch:
+            break
+        results = list(ingest_pool().map(extract_derivatives, *zip(*batch)))
+        save_derivatives(results)
+        attempted.update(r["sha256"] for r in results)
+        failed += sum(1 for r in results if r["status"] == "failed")
+    return {"processed": len(attempted), "failed": failed}
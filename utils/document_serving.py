@@ -0,0 +1,141 @@
+import os
+from datetime import datetime, timezone
+from flask import Response, request, send_file
+from werkzeug.wsgi import wrap_file
+from utils.storage import document_store
+
+# "", "x-sendfile" (Apache/lighttpd) or "x-accel-redirect" (nginx)
+SENDFILE_MODE = os.environ.get("DOCUMENT_SENDFILE", "").lower()
+# nginx `internal` location that maps onto the document store root
+ACCEL_PREFIX = os.environ.get("DOCUMENT_ACCEL_PREFIX", "/_protected_documents").rstrip("/")
+READ_BUFFER = 64 * 1024
+# A stored document's bytes never change, so clients may reuse them for a while
+CACHE_CONTROL = "private, max-age=3600"
+
+def _bounded_reader(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(READ_BUFFER, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def _server_clamps_file_wrapper():
+    # gunicorn's file_wrapper uses os.sendfile and stops at Content-Length
+    return request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")
+
+def _accel_location(path):
+    root = getattr(document_store, "root", None)
+    if not root or os.path.commonpath([root, os.path.abspath(path)]) != root:
+        return None
+    return f"{ACCEL_PREFIX}/{os.path.relpath(path, root)}"
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return bool(since and last_modified <= since)
+
+def _requested_range(size, etag, last_modified):
+    """(start, stop) for a satisfiable Range header, None to send everything, or False when unsatisfiable"""
+    # Multipart byteranges are not worth it for documents; send the whole file instead
+    if not request.range or len(request.range.ranges) != 1:
+        return None
+    # If-Range: only honour the range when the client's copy is still current
+    if_range = request.if_range
+    if if_range.etag and if_range.etag != etag:
+        return None
+    if if_range.date and if_range.date < last_modified:
+        return None
+    byte_range = request.range.range_for_length(size)
+    return byte_range if byte_range else False
+
+def serve_document(pdf, as_attachment=False):
+    """Send the file behind a PDF row; returns None when a local file is missing"""
+    return serve_stored(
+        pdf.sha256,
+        pdf.filename,
+        pdf.mime_type or "application/pdf",
+        as_attachment=as_attachment,
+        legacy_path=pdf.file_path
+    )
+
+def serve_stored(sha256, filename, mimetype, as_attachment=False, legacy_path=None):
+    """
+    Send a stored object with ETag (its content hash), Last-Modified and Range support.
+    Local files are offloaded to the front-end server when DOCUMENT_SENDFILE is set,
+    otherwise handed to the WSGI server's file_wrapper so gunicorn can use os.sendfile.
+    legacy_path serves files saved before the document store existed.
+    Returns None when a local file is missing.
+    """
+    if sha256:
+        path = document_store.local_path(sha256)
+        stream = None if path else document_store.open(sha256)
+    else:
+        path, stream = legacy_path, None
+    if path and not os.path.exists(path):
+        return None
+    if not sha256 or not path:
+        # Legacy files and non-local backends: let werkzeug derive the validators
+        return send_file(
+            path or stream,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=filename,
+            etag=sha256 or True,
+            conditional=True,
+            max_age=3600
+        )
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = sha256
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    disposition = "attachment" if as_attachment else "inline"
+
+    def base_response(status, body=None):
+        response = Response(body, status=status, mimetype=mimetype, direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Disposition"] = f'{disposition}; filename="{filename}"'
+        return response
+
+    if _not_modified(etag, last_modified):
+        return base_response(304)
+
+    if SENDFILE_MODE in ("x-sendfile", "x-accel-redirect"):
+        # The front-end server reads the file itself and handles Range on its own
+        response = base_response(200)
+        if SENDFILE_MODE == "x-sendfile":
+            response.headers["X-Sendfile"] = os.path.abspath(path)
+            return response
+        location = _accel_location(path)
+        if location:
+            response.headers["X-Accel-Redirect"] = location
+            return response
+
+    byte_range = _requested_range(size, etag, last_modified)
+    if byte_range is False:
+        response = base_response(416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+        return response
+
+    start, stop = byte_range or (0, size)
+    length = stop - start
+    f = open(path, "rb")
+    f.seek(start)
+    if stop == size or _server_clamps_file_wrapper():
+        body = wrap_file(request.environ, f, READ_BUFFER)
+    else:
+        body = _bounded_reader(f, length)
+
+    response = base_response(206 if byte_range else 200, body)
+    response.content_length = length
+    if byte_range:
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    return response
@@ -0,0 +1,85 @@
+from flask import g, request, session
+from models.accounts import Admin, Client, SchirmersNotary
+
+class Identity:
+    """
+    The caller of the current request. Resolved once per request and kept on
+    flask.g so handlers and the auth guards share the same lookups.
+    The user row and the CEO check are loaded on first use and then memoized
+    for the rest of the request.
+    """
+
+    def __init__(self, user_id, user_type):
+        self.user_id = user_id
+        self._user_type = user_type
+        self._user = None
+        self._loaded = False
+        self._is_ceo = None
+
+    @property
+    def authenticated(self):
+        return bool(self.user_id)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.user_id:
+            return
+        if self._user_type == 'admin':
+            self._user = Admin.query.get(self.user_id)
+        elif self._user_type == 'client':
+            self._user = Client.query.get(self.user_id)
+        elif self._user_type is None:
+            # No type in the session (header-only callers): admins take precedence
+            self._user = Admin.query.get(self.user_id)
+            if self._user:
+                self._user_type = 'admin'
+            else:
+                self._user = Client.query.get(self.user_id)
+                if self._user:
+                    self._user_type = 'client'
+
+    @property
+    def user(self):
+        """The Admin or Client row for this caller, or None"""
+        self._load()
+        return self._user
+
+    @property
+    def user_type(self):
+        """'admin' or 'client'; looks the user up only when the session did not say"""
+        if self._user_type is None:
+            self._load()
+        return self._user_type
+
+    @property
+    def is_admin(self):
+        return self.user_type == 'admin'
+
+    @property
+    def is_ceo(self):
+        if self._is_ceo is None:
+            self._is_ceo = False
+            if self.is_admin:
+                # Read from the database, not the cached company profile: a CEO
+                # handover must take effect at once on every worker
+                ceo_admin_id = SchirmersNotary.query.with_entities(SchirmersNotary.ceo_admin_id).limit(1).scalar()
+                self._is_ceo = ceo_admin_id is not None and ceo_admin_id == int(self.user_id)
+        return self._is_ceo
+
+def load_identity():
+    """before_request hook: attach the caller's Identity to flask.g"""
+    g.identity = Identity(
+        request.headers.get('X-User-Id') or session.get('user_id'),
+        session.get('user_type')
+    )
+
+def current_identity():
+    """Identity for the current request, created on demand outside the hook"""
+    if 'identity' not in g:
+        load_identity()
+    return g.identity
+
+def register_identity_loader(app):
+    app.before_request(load_identity)
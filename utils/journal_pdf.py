@@ -0,0 +1,274 @@
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+# Bump when the layout changes so previously cached renders are not reused
+RENDERER_VERSION = "2"
+CACHE_DIR = os.environ.get(
+    "JOURNAL_PDF_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), '..', 'database', 'journal_pdf_cache')
+)
+os.makedirs(CACHE_DIR, exist_ok=True)
+# Superseded renders are kept this long so requests already serving them can finish
+STALE_RENDER_SECONDS = int(os.environ.get("JOURNAL_PDF_STALE_SECONDS", "3600"))
+
+_pool = None
+
+class _PageWriter:
+    """Draws lines top-down, wrapping long text and starting a new page when one fills up"""
+
+    def __init__(self, c, continuation_title):
+        self.c = c
+        self.width, self.height = letter
+        self.margin = inch
+        self.continuation_title = continuation_title
+        self.y = self.height - self.margin
+
+    def _new_page(self):
+        self.c.showPage()
+        self.y = self.height - self.margin
+        self.c.setFont("Helvetica-Oblique", 10)
+        self.c.drawString(self.margin, self.y, self.continuation_title)
+        self.y -= 24
+
+    def line(self, text, font="Helvetica", size=12, indent=0, gap=20):
+        if self.y < self.margin:
+            self._new_page()
+        self.c.setFont(font, size)
+        self.c.drawString(self.margin + indent, self.y, text)
+        self.y -= gap
+
+    def paragraph(self, text, font="Helvetica", size=12, indent=0, gap=16):
+        """Write text wrapped to the page width, keeping its own line breaks"""
+        max_width = self.width - 2 * self.margin - indent
+        for raw_line in (text or "").splitlines() or [""]:
+            for wrapped in simpleSplit(raw_line, font, size, max_width) or [""]:
+                self.line(wrapped, font, size, indent, gap)
+
+def draw_entry(c, entry):
+    """Lay out one serialized journal entry, spilling onto as many pages as it needs"""
+    writer = _PageWriter(c, f"Journal Entry #{entry['id']} (continued)")
+    writer.line(f"Journal Entry #{entry['id']}", font="Helvetica-Bold", size=14, gap=30)
+    writer.paragraph(f"Date: {entry.get('date') or 'N/A'}", gap=20)
+    writer.paragraph(f"Location: {entry.get('location') or 'N/A'}", gap=20)
+    writer.paragraph(f"Document Type: {entry.get('document_type')}", gap=20)
+    writer.line(f"ID Verified: {'Yes' if entry.get('id_verification') else 'No'}")
+
+    signers = entry.get('signers') or []
+    if signers:
+        for idx, signer in enumerate(signers, start=1):
+            writer.paragraph(f"Signer {idx}: {signer.get('name')}", gap=20)
+            writer.paragraph(f"Address: {signer.get('address') or 'N/A'}", indent=20, gap=20)
+            writer.paragraph(f"Phone: {signer.get('phone') or 'N/A'}", indent=20, gap=20)
+    else:
+        writer.line("No signers listed.")
+
+    writer.line("Notes:", gap=16)
+    writer.paragraph(entry.get('notes') or '')
+    c.showPage()
+
+def render_entry_pdf(entry):
+    """Render one serialized journal entry to PDF bytes"""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    draw_entry(c, entry)
+    c.save()
+    return buffer.getvalue()
+
+def content_hash(entry):
+    payload = json.dumps(entry, sort_keys=True, default=str)
+    return hashlib.sha256(f"{RENDERER_VERSION}:{payload}".encode()).hexdigest()
+
+def cached_pdf_path(entry):
+    return os.path.join(CACHE_DIR, f"{entry['id']}-{content_hash(entry)}.pdf")
+
+def purge_entry_pdfs(entry_id, keep=None):
+    """Remove cached renders of an entry, optionally keeping the current one"""
+    for path in glob.glob(os.path.join(CACHE_DIR, f"{entry_id}-*.pdf")):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def render_to_cache(entry):
+    """
+    Return the cached PDF path for a serialized entry, rendering it first if this
+    exact content has not been rendered yet. Safe to run in a worker process.
+    Older renders of the entry are left for sweep_render_cache, since another
+    request may still be reading them.
+    """
+    path = cached_pdf_path(entry)
+    if os.path.exists(path):
+        return path
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(render_entry_pdf(entry))
+    os.replace(tmp, path)
+    return path
+
+def sweep_render_cache(max_age=None):
+    """
+    Delete renders superseded by a newer render of the same entry at least
+    max_age seconds ago, and temp files abandoned by crashed renders.
+    """
+    max_age = STALE_RENDER_SECONDS if max_age is None else max_age
+    cutoff = time.time() - max_age
+    renders = defaultdict(list)
+    removed = 0
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if name.endswith(".tmp"):
+            if mtime < cutoff:
+                removed += _remove(path)
+        elif name.endswith(".pdf"):
+            renders[name.split("-", 1)[0]].append((mtime, path))
+    for versions in renders.values():
+        versions.sort()
+        newest_mtime = versions[-1][0]
+        # Older versions have been stale since the newest one was written
+        if newest_mtime < cutoff:
+            removed += sum(_remove(path) for _, path in versions[:-1])
+    return {"entries": len(renders), "removed": removed}
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+def render_pool():
+    global _pool
+    if _pool is None:
+        workers = int(os.environ.get("JOURNAL_EXPORT_WORKERS", "0")) or None
+        # Forking a web worker that runs background threads can copy held locks into the child
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def render_many(entries):
+    """Cached PDF paths for many serialized entries, in order, rendering misses in the process pool"""
+    paths = [cached_pdf_path(entry) for entry in entries]
+    missing = [entry for entry, path in zip(entries, paths) if not os.path.exists(path)]
+    if missing:
+        list(render_pool().map(render_to_cache, missing, chunksize=8))
+    return paths
+
+class _MergedPdfWriter:
+    """
+    Appends the pages of existing PDFs to one document, writing every copied
+    object out straight away. Only the xref offsets and the page object numbers
+    stay in memory, so the output can be drained and streamed while it grows.
+    """
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self):
+        self.buffer = BytesIO()
+        self.position = 0
+        # Index is the object number; the catalog and page tree are written last
+        self.offsets = [0, None, None]
+        self.page_refs = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+
+    def _allocate(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, number, obj):
+        out = BytesIO()
+        out.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(out, None)
+        out.write(b"\nendobj\n")
+        self.offsets[number] = self.position
+        self._write(out.getvalue())
+
+    def _copy(self, obj, reader, numbers):
+        """Copy of a source object with its references renumbered, writing referenced objects first"""
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in numbers:
+                numbers[key] = self._allocate()
+                self._write_object(numbers[key], self._copy(reader.get_object(obj), reader, numbers))
+            return IndirectObject(numbers[key], 0, None)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            copy.update({key: self._copy(value, reader, numbers) for key, value in dict.items(obj)})
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._copy(value, reader, numbers) for key, value in dict.items(obj)})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, reader, numbers) for value in list.__iter__(obj))
+        return obj
+
+    def add_page(self, page, reader, numbers):
+        """Copy one page (inherited attributes are already flattened onto it by PdfReader)"""
+        ref = page.indirect_reference
+        key = (ref.idnum, ref.generation)
+        number = numbers.setdefault(key, self._allocate())
+        copy = DictionaryObject({
+            key: self._copy(value, reader, numbers)
+            for key, value in dict.items(page)
+            if key != "/Parent"
+        })
+        copy[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+        self._write_object(number, copy)
+        self.page_refs.append(IndirectObject(number, 0, None))
+
+    def finish(self):
+        self._write_object(self.PAGES, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(self.page_refs),
+            NameObject("/Count"): NumberObject(len(self.page_refs))
+        }))
+        self._write_object(self.CATALOG, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.PAGES, 0, None)
+        }))
+        xref_at = self.position
+        self._write(f"xref\n0 {len(self.offsets)}\n0000000000 65535 f \n".encode())
+        self._write("".join(f"{offset:010d} 00000 n \n" for offset in self.offsets[1:]).encode())
+        trailer = BytesIO()
+        DictionaryObject({
+            NameObject("/Size"): NumberObject(len(self.offsets)),
+            NameObject("/Root"): IndirectObject(self.CATALOG, 0, None)
+        }).write_to_stream(trailer, None)
+        self._write(b"trailer\n" + trailer.getvalue() + f"\nstartxref\n{xref_at}\n%%EOF\n".encode())
+
+    def drain(self):
+        data = self.buffer.getvalue()
+        self.buffer = BytesIO()
+        return data
+
+def iter_merged_pdf(paths):
+    """Concatenate PDF files into one document, yielding its bytes as each file is appended"""
+    writer = _MergedPdfWriter()
+    for path in paths:
+        reader = PdfReader(path)
+        numbers = {}
+        for page in reader.pages:
+            writer.add_page(page, reader, numbers)
+        yield writer.drain()
+    writer.finish()
+    yield writer.drain()
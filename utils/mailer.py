@@ -0,0 +1,174 @@
+import logging
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("mailer")
+
+class MailerNotConfigured(Exception):
+    """SMTP credentials are missing from the environment"""
+
+def smtp_settings():
+    return {
+        "server": os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+        "port": int(os.environ.get('SMTP_PORT', '587')),
+        "username": os.environ.get('SMTP_USERNAME'),
+        "password": os.environ.get('SMTP_PASSWORD'),
+        # Local SMTP stand-ins usually speak plain SMTP without auth
+        "use_tls": os.environ.get('SMTP_USE_TLS', 'true').lower() != 'false'
+    }
+
+class SMTPPool:
+    """
+    Small pool of authenticated SMTP connections shared by every sender.
+    Idle connections are health-checked with NOOP before reuse and are
+    replaced transparently when the server has dropped them.
+    """
+
+    def __init__(self, size=3, health_check_after=30, max_idle=240, timeout=30):
+        self.size = size
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._latencies = deque(maxlen=500)
+        self.counters = {"sent": 0, "failed": 0, "connects": 0, "reconnects": 0}
+
+    def is_configured(self):
+        settings = smtp_settings()
+        return not settings["use_tls"] or bool(settings["username"] and settings["password"])
+
+    @property
+    def username(self):
+        return smtp_settings()["username"]
+
+    def _connect(self):
+        settings = smtp_settings()
+        if not self.is_configured():
+            raise MailerNotConfigured("Email credentials not configured. Please set SMTP_USERNAME and SMTP_PASSWORD environment variables.")
+        conn = smtplib.SMTP(settings["server"], settings["port"], timeout=self.timeout)
+        if settings["use_tls"]:
+            conn.starttls()
+            conn.login(settings["username"], settings["password"])
+        with self._lock:
+            self.counters["connects"] += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _healthy(self, conn, idle_for):
+        if idle_for > self.max_idle:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            return conn.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if self._healthy(conn, time.monotonic() - last_used):
+                return conn
+            self._close(conn)
+        return self._connect()
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def send(self, msg, from_addr=None, to_addrs=None):
+        """
+        Send an email.message.Message through a pooled connection.
+        Retries once on a fresh connection if the pooled one was dropped.
+        """
+        from_addr = from_addr or msg['From']
+        to_addrs = to_addrs or [msg['To']]
+        payload = msg.as_string()
+        started = time.perf_counter()
+
+        self._slots.acquire()
+        try:
+            for attempt in range(2):
+                conn = self._checkout()
+                try:
+                    conn.sendmail(from_addr, to_addrs, payload)
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                    # SMTPException subclasses OSError: a refusal must not be retried
+                    # as a dropped connection. 421 means the server is closing it.
+                    if getattr(e, "smtp_code", None) == 421:
+                        self._close(conn)
+                    else:
+                        self._checkin(conn)
+                    raise
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    self._close(conn)
+                    if attempt:
+                        raise
+                    logger.info("Pooled SMTP connection dropped (%s), reconnecting", e)
+                    with self._lock:
+                        self.counters["reconnects"] += 1
+                    continue
+                except Exception:
+                    self._checkin(conn)
+                    raise
+                self._checkin(conn)
+                break
+        except Exception:
+            with self._lock:
+                self.counters["failed"] += 1
+            raise
+        finally:
+            self._slots.release()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.counters["sent"] += 1
+            self._latencies.append(elapsed_ms)
+        logger.debug("Sent email to %s in %.1f ms", to_addrs, elapsed_ms)
+        return elapsed_ms
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+            idle = len(self._idle)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+        return {
+            **counters,
+            "idle_connections": idle,
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)}
+        }
+
+mailer = SMTPPool(size=int(os.environ.get("SMTP_POOL_SIZE", "3")))
+
+def send(msg, from_addr=None, to_addrs=None):
+    """Send a message through the shared SMTP pool and return its latency in ms"""
+    return mailer.send(msg, from_addr, to_addrs)
@@ -0,0 +1,31 @@
+from email.mime.text import MIMEText
+from utils.mailer import mailer, MailerNotConfigured
+from utils.outbound import outbound_queue, PermanentFailure
+from utils.push import queue_push_batch
+
+DEFAULT_SENDER = "no-reply@schirmersnotary.com"
+
+def deliver_email(payload):
+    """Outbound handler: send one plain-text email through the SMTP pool"""
+    msg = MIMEText(payload["body"])
+    msg['Subject'] = payload["subject"]
+    msg['From'] = payload.get("sender") or DEFAULT_SENDER
+    msg['To'] = payload["to"]
+    try:
+        mailer.send(msg)
+    except MailerNotConfigured as e:
+        raise PermanentFailure(str(e))
+
+outbound_queue.register("email", deliver_email)
+
+def queue_email(to_email, subject, body, sender=DEFAULT_SENDER):
+    """Spool an email for background delivery"""
+    if not to_email:
+        return None
+    return outbound_queue.enqueue("email", {"to": to_email, "subject": subject, "body": body, "sender": sender})
+
+def queue_push(tokens, title, body, data=None):
+    """Spool an Expo push notification for one token or a list of tokens"""
+    if isinstance(tokens, str):
+        tokens = [tokens]
+    return queue_push_batch(tokens or [], title, body, data)
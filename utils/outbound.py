@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("outbound")
+
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'outbound_spool.sqlite3')
+
+class PermanentFailure(Exception):
+    """Raised by a handler when retrying the message can never succeed"""
+
+class OutboundQueue:
+    """
+    Durable in-process queue for outbound side effects (email, push).
+    Messages are spooled to SQLite before being acknowledged so they survive
+    restarts, and are delivered by worker threads with exponential backoff.
+    A claimed message is leased to its worker for lease_seconds; only expired
+    leases are taken over, so processes sharing the spool never resend each
+    other's in-flight messages.
+    """
+
+    def __init__(self, spool_path=DEFAULT_SPOOL_PATH, workers=2, max_attempts=6,
+                 base_delay=2.0, max_delay=600.0, poll_interval=1.0, lease_seconds=300):
+        self.spool_path = spool_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.app = None
+        self._handlers = {}
+        self._reset_process_state()
+
+    def _reset_process_state(self):
+        self._owner_pid = os.getpid()
+        self._conn = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def _forget_inherited_state(self):
+        """
+        A forked child (gunicorn --preload) inherits the parent's connection and
+        thread list but none of the threads; start over instead of reusing them.
+        """
+        if self._owner_pid != os.getpid():
+            self._reset_process_state()
+
+    @property
+    def _claimant(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app):
+        """Bind to a Flask app so handlers run inside its app context, then start the workers"""
+        self.app = app
+        self.start()
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+            conn = sqlite3.connect(self.spool_path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbound (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    claimed_by TEXT,
+                    claimed_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_outbound_due ON outbound (status, next_attempt)")
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, kind, payload, delay=0):
+        """Spool a message for background delivery (optionally after delay seconds) and return its id"""
+        if kind not in self._handlers:
+            raise ValueError(f"No outbound handler registered for {kind!r}")
+        self._forget_inherited_state()
+        now = time.time()
+        with self._lock:
+            cur = self._connection().execute(
+                "INSERT INTO outbound (kind, payload, next_attempt, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), now + delay, now)
+            )
+            message_id = cur.lastrowid
+        self.start()
+        self._wakeup.set()
+        return message_id
+
+    def start(self):
+        self._forget_inherited_state()
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"outbound-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        logger.info("Outbound queue started with %d workers (spool=%s)", self.workers, self.spool_path)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _claim(self):
+        """
+        Lease the next due message to this process. Messages whose lease expired
+        (their process died mid-delivery) are due again.
+        """
+        now = time.time()
+        due = "((status = 'queued' AND next_attempt <= ?) OR (status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)))"
+        params = (now, now - self.lease_seconds)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                f"SELECT id, kind, payload, attempts FROM outbound WHERE {due} ORDER BY next_attempt LIMIT 1",
+                params
+            ).fetchone()
+            if not row:
+                return None
+            # Conditional on still being due, so only one process wins the lease
+            claimed = conn.execute(
+                f"UPDATE outbound SET status = 'sending', claimed_by = ?, claimed_at = ? WHERE id = ? AND {due}",
+                (self._claimant, now, row[0]) + params
+            ).rowcount
+            return row if claimed else None
+
+    def _finish(self, message_id, attempts, error=None, permanent=False):
+        with self._lock:
+            conn = self._connection()
+            if error is None:
+                conn.execute("DELETE FROM outbound WHERE id = ?", (message_id,))
+                return
+            # Leave the row alone if the lease expired and another process took it over
+            owned = "id = ? AND status = 'sending' AND claimed_by = ?"
+            if permanent or attempts >= self.max_attempts:
+                conn.execute(
+                    f"UPDATE outbound SET status = 'dead', attempts = ?, last_error = ?, claimed_by = NULL, claimed_at = NULL WHERE {owned}",
+                    (attempts, error, message_id, self._claimant)
+                )
+            else:
+                delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+                delay *= random.uniform(0.5, 1.5)
+                conn.execute(
+                    "UPDATE outbound SET status = 'queued', attempts = ?, last_error = ?, next_attempt = ?, "
+                    f"claimed_by = NULL, claimed_at = NULL WHERE {owned}",
+                    (attempts, error, time.time() + delay, message_id, self._claimant)
+                )
+
+    def _deliver(self, kind, payload):
+        handler = self._handlers[kind]
+        if self.app is not None:
+            with self.app.app_context():
+                return handler(payload)
+        return handler(payload)
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except Exception:
+                logger.exception("Outbound spool read failed")
+                row = None
+            if not row:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            message_id, kind, payload, attempts = row
+            attempts += 1
+            outcome = {}
+            try:
+                self._deliver(kind, json.loads(payload))
+            except PermanentFailure as e:
+                logger.error("Outbound %s message %s dropped: %s", kind, message_id, e)
+                outcome = {"error": str(e), "permanent": True}
+            except Exception as e:
+                logger.warning("Outbound %s message %s failed (attempt %d): %s", kind, message_id, attempts, e)
+                outcome = {"error": str(e)}
+            try:
+                self._finish(message_id, attempts, **outcome)
+            except Exception:
+                # The lease expires and another claim retries the message; keep this worker alive
+                logger.exception("Outbound spool update failed for %s message %s", kind, message_id)
+
+    def status(self):
+        self._forget_inherited_state()
+        with self._lock:
+            rows = self._connection().execute("SELECT status, COUNT(*) FROM outbound GROUP BY status").fetchall()
+        return {
+            "workers": len(self._threads),
+            "counts": {status: count for status, count in rows}
+        }
+
+outbound_queue = OutboundQueue(
+    spool_path=os.environ.get("OUTBOUND_SPOOL_PATH", DEFAULT_SPOOL_PATH),
+    workers=int(os.environ.get("OUTBOUND_WORKERS", "2"))
+)
@@ -0,0 +1,187 @@
+import os
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, ROUND_HALF_UP
+from models.system import PricingPolicy
+from utils.cache import TTLCache, invalidate_on_commit
+
+FEE_FIELDS = [
+    "base_notary_fee",
+    "base_travel_fee",
+    "free_travel_miles",
+    "additional_mile_rate",
+    "additional_signer_fee",
+    "rush_fee_same_day",
+    "rush_fee_emergency",
+    "rush_fee_holiday",
+    "loan_signing_flat_rate",
+    "loan_signing_rush_fee",
+    "ron_base_fee",
+    "ron_rush_fee",
+    "document_printing_per_page",
+    "document_scanning_fee",
+    "waiting_time_fee",
+    "cancellation_fee"
+]
+
+# Served when no policy has been saved yet
+DEFAULT_PRICING = {
+    "base_notary_fee": "30.00",
+    "base_travel_fee": "20.00",
+    "free_travel_miles": "15",
+    "additional_mile_rate": "1.00",
+    "additional_signer_fee": "10.00",
+    "rush_fee_same_day": "15.00",
+    "rush_fee_emergency": "25.00",
+    "rush_fee_holiday": "35.00",
+    "loan_signing_flat_rate": "150.00",
+    "loan_signing_rush_fee": "25.00",
+    "ron_base_fee": "30.00",
+    "ron_rush_fee": "15.00",
+    "document_printing_per_page": "2.00",
+    "document_scanning_fee": "5.00",
+    "waiting_time_fee": "10.00",
+    "cancellation_fee": "25.00",
+    "is_active": True
+}
+
+SERVICE_TYPES = ("general", "loan_signing", "ron")
+RUSH_TYPES = ("same_day", "emergency", "holiday")
+MAX_QUOTE_BATCH = 200
+CENT = Decimal("0.01")
+
+# Snapshots are keyed by (id, updated_at) and every lookup re-reads those two
+# columns, so an activation or edit committed by any worker takes effect on the
+# next quote everywhere. The TTL only bounds how long superseded snapshots linger.
+pricing_cache = TTLCache(ttl=int(os.environ.get("PRICING_CACHE_TTL", "300")))
+# The commit hook cannot see bulk query.update() calls, so the pricing
+# endpoints also call invalidate_pricing() after they commit
+invalidate_on_commit(pricing_cache, PricingPolicy)
+
+class CachedPolicy:
+    """An immutable snapshot of a pricing policy: its API form plus Decimal fees for quoting"""
+
+    def __init__(self, serialized):
+        self.id = serialized.get("id")
+        self.serialized = serialized
+        self.fees = {field: Decimal(serialized[field]) for field in FEE_FIELDS}
+
+def serialize_policy(policy):
+    data = {"id": policy.id}
+    data.update({field: str(getattr(policy, field)) for field in FEE_FIELDS})
+    data.update({
+        "is_active": policy.is_active,
+        "created_at": policy.created_at.isoformat() if policy.created_at else None,
+        "updated_at": policy.updated_at.isoformat() if policy.updated_at else None
+    })
+    return data
+
+def get_policy(policy_id, updated_at=None):
+    """Cached snapshot of one policy by id and version, or None if it does not exist"""
+    def load():
+        policy = PricingPolicy.query.get(policy_id)
+        return CachedPolicy(serialize_policy(policy)) if policy else None
+    return pricing_cache.get_or_set(("policy", policy_id, updated_at), load)
+
+def active_policy():
+    """Snapshot of the active policy, falling back to DEFAULT_PRICING"""
+    row = PricingPolicy.query.with_entities(PricingPolicy.id, PricingPolicy.updated_at)\
+        .filter_by(is_active=True).order_by(PricingPolicy.id.desc()).first()
+    if row is not None:
+        cached = get_policy(row.id, row.updated_at)
+        if cached:
+            return cached
+    return CachedPolicy(dict(DEFAULT_PRICING))
+
+def invalidate_pricing():
+    pricing_cache.invalidate()
+
+def _decimal(value, name, default):
+    if value is None or value == "":
+        return Decimal(default)
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a number")
+    # NaN and Infinity parse fine but break every comparison and quantize below
+    if not number.is_finite():
+        raise ValueError(f"{name} must be a finite number")
+    if number < 0:
+        raise ValueError(f"{name} cannot be negative")
+    return number
+
+def quote_booking(policy, candidate, discount_percentage=0):
+    """
+    Price one candidate booking against a policy snapshot.
+    candidate keys: service_type, miles, signers, rush, printed_pages, scanning, waiting_minutes
+    """
+    fees = policy.fees
+    service_type = candidate.get("service_type") or "general"
+    if service_type not in SERVICE_TYPES:
+        raise ValueError(f"service_type must be one of {', '.join(SERVICE_TYPES)}")
+    rush = candidate.get("rush") or None
+    if rush is not None and rush not in RUSH_TYPES:
+        raise ValueError(f"rush must be one of {', '.join(RUSH_TYPES)}")
+
+    miles = _decimal(candidate.get("miles"), "miles", 0)
+    signers = _decimal(candidate.get("signers"), "signers", 1)
+    printed_pages = _decimal(candidate.get("printed_pages"), "printed_pages", 0)
+    waiting_minutes = _decimal(candidate.get("waiting_minutes"), "waiting_minutes", 0)
+
+    if service_type == "loan_signing":
+        base = fees["loan_signing_flat_rate"]
+        rush_fee = fees["loan_signing_rush_fee"] if rush else Decimal(0)
+    elif service_type == "ron":
+        base = fees["ron_base_fee"]
+        rush_fee = fees["ron_rush_fee"] if rush else Decimal(0)
+    else:
+        base = fees["base_notary_fee"]
+        rush_fee = fees[f"rush_fee_{rush}"] if rush else Decimal(0)
+
+    # Remote online notarizations never travel
+    if service_type == "ron":
+        travel = Decimal(0)
+    else:
+        extra_miles = max(Decimal(0), miles - fees["free_travel_miles"])
+        travel = fees["base_travel_fee"] + extra_miles * fees["additional_mile_rate"]
+
+    signer_fee = max(Decimal(0), signers - 1) * fees["additional_signer_fee"]
+    extras = printed_pages * fees["document_printing_per_page"]
+    if candidate.get("scanning"):
+        extras += fees["document_scanning_fee"]
+    # waiting_time_fee is charged per started 15 minutes
+    extras += (waiting_minutes / 15).to_integral_value(rounding=ROUND_CEILING) * fees["waiting_time_fee"]
+
+    subtotal = base + travel + signer_fee + rush_fee + extras
+    discount = subtotal * Decimal(str(discount_percentage or 0)) / 100
+    total = subtotal - discount
+
+    def money(value):
+        return str(value.quantize(CENT, rounding=ROUND_HALF_UP))
+
+    return {
+        "service_type": service_type,
+        "base": money(base),
+        "travel": money(travel),
+        "signers": money(signer_fee),
+        "rush": money(rush_fee),
+        "extras": money(extras),
+        "subtotal": money(subtotal),
+        "discount": money(discount),
+        "total": money(total)
+    }
+
+def quote_bookings(policy, candidates, discount_percentage=0):
+    """Price a batch of candidates; invalid rows get an error entry instead of failing the batch"""
+    quotes = []
+    for index, candidate in enumerate(candidates):
+        try:
+            if not isinstance(candidate, dict):
+                raise ValueError("each booking must be an object")
+            quote = quote_booking(policy, candidate, discount_percentage)
+            quote["index"] = index
+        except ValueError as e:
+            quote = {"index": index, "error": str(e)}
+        except ArithmeticError:
+            # e.g. amounts too large to quantize; one bad row must not fail the batch
+            quote = {"index": index, "error": "amounts are out of range"}
+        quotes.append(quote)
+    return quotes
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from utils.outbound import outbound_queue, PermanentFailure
+
+logger = logging.getLogger("push")
+
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+EXPO_RECEIPTS_URL = os.environ.get('EXPO_RECEIPTS_URL', 'https://exp.host/--/api/v2/push/getReceipts')
+# Expo accepts at most 100 messages per send call
+MAX_BATCH_SIZE = 100
+# Expo recommends waiting before receipts are fetched
+RECEIPT_DELAY_SECONDS = int(os.environ.get('EXPO_RECEIPT_DELAY', '900'))
+
+class PushClient:
+    """Expo push sender sharing one keep-alive session across the outbound workers"""
+
+    def __init__(self, push_url=EXPO_PUSH_URL, receipts_url=EXPO_RECEIPTS_URL, pool_size=4, timeout=15):
+        self.push_url = push_url
+        self.receipts_url = receipts_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+        self.recent_tickets = deque(maxlen=500)
+        self.counters = {"batches": 0, "messages": 0, "ok": 0, "errors": 0, "pruned_tokens": 0}
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                session.headers.update({
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'Content-Type': 'application/json'
+                })
+                self._session = session
+            return self._session
+
+    def _post(self, url, body):
+        response = self.session.post(url, json=body, timeout=self.timeout)
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise PermanentFailure(f"Expo rejected request: {response.status_code} {response.text}")
+        response.raise_for_status()
+        return response.json()
+
+    def send(self, messages):
+        """Send up to MAX_BATCH_SIZE messages in one call and return their tickets in order"""
+        if len(messages) > MAX_BATCH_SIZE:
+            raise ValueError(f"Expo batches are limited to {MAX_BATCH_SIZE} messages")
+        tickets = self._post(self.push_url, messages).get("data") or []
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["messages"] += len(messages)
+            for message, ticket in zip(messages, tickets):
+                self.counters["ok" if ticket.get("status") == "ok" else "errors"] += 1
+                self.recent_tickets.append({"to": message["to"], **ticket})
+        return tickets
+
+    def get_receipts(self, ticket_ids):
+        return self._post(self.receipts_url, {"ids": ticket_ids}).get("data") or {}
+
+    def record_pruned(self, count):
+        with self._lock:
+            self.counters["pruned_tokens"] += count
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "recent_tickets": list(self.recent_tickets)[-20:]}
+
+push_client = PushClient()
+
+def build_messages(tokens, title, body, data=None):
+    """One message per distinct token, preserving order"""
+    messages = []
+    seen = set()
+    for token in tokens:
+        if not token or token in seen:
+            continue
+        seen.add(token)
+        message = {'to': token, 'sound': 'default', 'title': title, 'body': body}
+        if data:
+            message['data'] = data
+        messages.append(message)
+    return messages
+
+def is_device_not_registered(result):
+    return (result.get("details") or {}).get("error") == "DeviceNotRegistered"
+
+def prune_tokens(tokens):
+    """Clear push tokens Expo reported as DeviceNotRegistered from admins and clients"""
+    tokens = list(set(tokens))
+    if not tokens:
+        return 0
+    from database.db import db
+    from models.accounts import Admin, Client
+    pruned = 0
+    try:
+        for model in (Admin, Client):
+            pruned += model.query.filter(model.push_token.in_(tokens)).update(
+                {"push_token": None}, synchronize_session=False
+            )
+        db.session.commit()
+    except Exception:
+        # Never fail (and so re-send) a delivered batch because pruning failed
+        db.session.rollback()
+        logger.exception("Failed to prune unregistered push tokens")
+        return 0
+    push_client.record_pruned(pruned)
+    logger.info("Pruned %d unregistered push tokens", pruned)
+    return pruned
+
+def deliver_push_batch(payload):
+    """Outbound handler: send one batch and schedule a receipt check for accepted tickets"""
+    messages = payload["messages"]
+    tickets = push_client.send(messages)
+
+    dead_tokens = []
+    pending = {}
+    for message, ticket in zip(messages, tickets):
+        if ticket.get("status") == "ok" and ticket.get("id"):
+            pending[ticket["id"]] = message["to"]
+        elif is_device_not_registered(ticket):
+            dead_tokens.append(message["to"])
+        else:
+            logger.warning("Push ticket error for %s: %s", message["to"], ticket.get("message"))
+
+    prune_tokens(dead_tokens)
+    if pending:
+        outbound_queue.enqueue("push_receipts", {"tickets": pending}, delay=RECEIPT_DELAY_SECONDS)
+    return tickets
+
+def check_push_receipts(payload):
+    """Outbound handler: fetch receipts for sent tickets and prune dead tokens"""
+    tickets = payload["tickets"]
+    receipts = push_client.get_receipts(list(tickets))
+    dead_tokens = [
+        tickets[ticket_id]
+        for ticket_id, receipt in receipts.items()
+        if receipt.get("status") == "error" and is_device_not_registered(receipt)
+    ]
+    prune_tokens(dead_tokens)
+
+outbound_queue.register("push", deliver_push_batch)
+outbound_queue.register("push_receipts", check_push_receipts)
+
+def queue_push_batch(tokens, title, body, data=None):
+    """Spool push notifications for the given tokens, one outbound message per Expo batch"""
+    messages = build_messages(tokens, title, body, data)
+    return [
+        outbound_queue.enqueue("push", {"messages": messages[i:i + MAX_BATCH_SIZE]})
+        for i in range(0, len(messages), MAX_BATCH_SIZE)
+    ]
@@ -0,0 +1,219 @@
+import datetime
+import logging
+import re
+from collections import defaultdict
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+from database.db import db
+from models.accounts import Client, Company
+from models.bookings import Booking
+from models.journal import JournalEntry, JournalSigner
+from models.system import SearchDocument
+
+logger = logging.getLogger("search")
+
+# 'simple' keeps names and emails as typed instead of stemming them as English
+SEARCH_CONFIG = "simple"
+MAX_QUERY_TERMS = 8
+REINDEX_BATCH_SIZE = 500
+
+SEARCH_MODELS = {
+    Client: "clients",
+    Booking: "bookings",
+    JournalEntry: "journal"
+}
+
+UPSERT_SQL = text(f"""
+    INSERT INTO search_documents (entity, entity_id, title, subtitle, search_vector, updated_at)
+    VALUES (
+        :entity, :entity_id, :title, :subtitle,
+        setweight(to_tsvector('{SEARCH_CONFIG}', :a), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', :b), 'B') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', :c), 'C'),
+        :now
+    )
+    ON CONFLICT (entity, entity_id) DO UPDATE SET
+        title = EXCLUDED.title,
+        subtitle = EXCLUDED.subtitle,
+        search_vector = EXCLUDED.search_vector,
+        updated_at = EXCLUDED.updated_at
+""")
+
+def search_text(*values):
+    """
+    Text to index for some field values. Emails, phones and hyphenated words are
+    also broken into their parts so a prefix of any part matches.
+    """
+    words = []
+    for value in values:
+        if not value:
+            continue
+        value = str(value).lower()
+        words.append(value)
+        parts = re.findall(r"\w+", value)
+        if len(parts) > 1:
+            words.extend(parts)
+        digits = re.sub(r"\D", "", value)
+        if len(digits) >= 7 and digits != value:
+            words.append(digits)
+    return " ".join(words)
+
+def build_tsquery(q):
+    """Prefix-match every word of a user query, or None if it has no searchable words"""
+    terms = re.findall(r"\w+", (q or "").lower())[:MAX_QUERY_TERMS]
+    return " & ".join(f"{term}:*" for term in terms) or None
+
+def _client_documents(conn, ids):
+    rows = conn.execute(
+        select(Client.id, Client.name, Client.email, Client.phone, Company.name.label("company"))
+        .outerjoin(Company, Company.id == Client.company_id)
+        .where(Client.id.in_(ids))
+    )
+    for r in rows:
+        yield {
+            "entity_id": r.id,
+            "title": r.name,
+            "subtitle": r.company or r.email,
+            "a": search_text(r.name),
+            "b": search_text(r.email, r.phone, r.company),
+            "c": ""
+        }
+
+def _booking_documents(conn, ids):
+    rows = conn.execute(
+        select(Booking.id, Booking.service, Booking.location, Booking.notes, Booking.date)
+        .where(Booking.id.in_(ids))
+    )
+    for r in rows:
+        yield {
+            "entity_id": r.id,
+            "title": f"{r.service} on {r.date}" if r.date else r.service,
+            "subtitle": r.location,
+            "a": search_text(r.service),
+            "b": search_text(r.location),
+            "c": search_text(r.notes)
+        }
+
+def _journal_documents(conn, ids):
+    signers = defaultdict(list)
+    for journal_id, name in conn.execute(
+        select(JournalSigner.journal_id, JournalSigner.name).where(JournalSigner.journal_id.in_(ids))
+    ):
+        signers[journal_id].append(name)
+    rows = conn.execute(
+        select(JournalEntry.id, JournalEntry.document_type, JournalEntry.location, JournalEntry.date)
+        .where(JournalEntry.id.in_(ids))
+    )
+    for r in rows:
+        names = signers.get(r.id, [])
+        yield {
+            "entity_id": r.id,
+            "title": f"{r.document_type} on {r.date}",
+            "subtitle": ", ".join(names)[:255] or None,
+            "a": search_text(*names),
+            "b": search_text(r.document_type, r.location),
+            "c": ""
+        }
+
+# entity -> (source model, document builder)
+SEARCH_LOADERS = {
+    "clients": (Client, _client_documents),
+    "bookings": (Booking, _booking_documents),
+    "journal": (JournalEntry, _journal_documents)
+}
+
+def reindex(conn, keys):
+    """Refresh the search documents for (entity, id) keys; rows that no longer exist are dropped"""
+    by_entity = defaultdict(set)
+    for entity, entity_id in keys:
+        by_entity[entity].add(entity_id)
+    company_ids = by_entity.pop("company", None)
+    if company_ids:
+        # Clients carry their company's name in their document
+        by_entity["clients"].update(conn.execute(
+            select(Client.id).where(Client.company_id.in_(company_ids))
+        ).scalars())
+
+    now = datetime.datetime.utcnow()
+    for entity, ids in by_entity.items():
+        _, build = SEARCH_LOADERS[entity]
+        documents = [{**doc, "entity": entity, "now": now} for doc in build(conn, ids)]
+        if documents:
+            conn.execute(UPSERT_SQL, documents)
+        gone = ids - {doc["entity_id"] for doc in documents}
+        if gone:
+            conn.execute(SearchDocument.__table__.delete().where(
+                SearchDocument.entity == entity,
+                SearchDocument.entity_id.in_(gone)
+            ))
+
+def rebuild_search_index():
+    """
+    Reindex everything in batches. Backfills a new index and repairs anything the
+    commit hooks could not see, such as bulk query.update()/delete().
+    """
+    counts = {}
+    for entity, (model, _) in SEARCH_LOADERS.items():
+        ids = set(db.session.execute(select(model.id)).scalars())
+        ids.update(db.session.execute(
+            select(SearchDocument.entity_id).where(SearchDocument.entity == entity)
+        ).scalars())
+        ordered = sorted(ids)
+        for i in range(0, len(ordered), REINDEX_BATCH_SIZE):
+            with db.engine.begin() as conn:
+                reindex(conn, [(entity, entity_id) for entity_id in ordered[i:i + REINDEX_BATCH_SIZE]])
+        counts[entity] = len(ordered)
+    db.session.commit()
+    return counts
+
+def search(q, limit, entities=None):
+    """Ranked matches for a free-text query: [(entity, id, title, subtitle, rank)]"""
+    query_text = build_tsquery(q)
+    if not query_text:
+        return []
+    tsquery = func.to_tsquery(SEARCH_CONFIG, query_text)
+    rank = func.ts_rank(SearchDocument.search_vector, tsquery)
+    query = db.session.query(
+        SearchDocument.entity,
+        SearchDocument.entity_id,
+        SearchDocument.title,
+        SearchDocument.subtitle,
+        rank.label("rank")
+    ).filter(SearchDocument.search_vector.op("@@")(tsquery))
+    if entities:
+        query = query.filter(SearchDocument.entity.in_(entities))
+    return query.order_by(rank.desc(), SearchDocument.updated_at.desc()).limit(limit).all()
+
+def _search_keys(obj):
+    entity = SEARCH_MODELS.get(type(obj))
+    if entity:
+        return [(entity, obj.id)]
+    if isinstance(obj, Company):
+        return [("company", obj.id)]
+    # Signer names are indexed on their journal entry
+    if isinstance(obj, JournalSigner) and obj.journal_id:
+        return [("journal", obj.journal_id)]
+    return []
+
+@event.listens_for(Session, "after_flush")
+def _collect_search_changes(session, flush_context):
+    touched = list(session.new) + [o for o in session.dirty if session.is_modified(o)] + list(session.deleted)
+    keys = [key for obj in touched for key in _search_keys(obj) if key[1] is not None]
+    if keys:
+        session.info.setdefault("pending_search_reindex", set()).update(keys)
+
+@event.listens_for(Session, "after_commit")
+def _apply_search_changes(session):
+    keys = session.info.pop("pending_search_reindex", None)
+    if not keys:
+        return
+    try:
+        with db.engine.begin() as conn:
+            reindex(conn, keys)
+    except Exception:
+        # The write itself is committed; the nightly rebuild repairs the index
+        logger.exception("Search reindex failed for %s documents", len(keys))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_search_changes(session):
+    session.info.pop("pending_search_reindex", None)
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+from utils.cache import TTLCache
+from utils.square_client import square_api
+
+logger = logging.getLogger("square_cache")
+
+class SquareReadCache:
+    """
+    Read-through cache for slow-changing Square reads (catalog items, discounts,
+    subscription plans, customer groups). Fresh entries are served from memory,
+    then from an optional on-disk tier shared by every worker on the host.
+    Expired entries are revalidated with If-None-Match so an unchanged object
+    costs a 304 instead of a full payload.
+    """
+
+    GENERATION_FILE = "generation"
+
+    def __init__(self, ttl=900, disk_dir=None):
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.memory = TTLCache(ttl)
+        # key -> {"etag", "body"}; kept past expiry so the next fetch can revalidate
+        self._validators = {}
+        self._lock = threading.Lock()
+        # None until the marker is first read; 0 while no worker has invalidated yet
+        self._generation = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "revalidated": 0, "fetches": 0, "invalidations": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _disk_path(self, key):
+        # The file name is the escaped key, so any worker can find entries by prefix
+        return os.path.join(self.disk_dir, quote(key, safe="") + ".json")
+
+    def _disk_keys(self):
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return []
+        return [unquote(name[:-len(".json")]) for name in names if name.endswith(".json")]
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:
+            logger.warning("Could not write Square cache entry %s", key, exc_info=True)
+
+    def _sync_generation(self):
+        """Drop this worker's memory tier if another worker invalidated the disk tier"""
+        if not self.disk_dir:
+            return
+        try:
+            generation = os.stat(os.path.join(self.disk_dir, self.GENERATION_FILE)).st_mtime_ns
+        except OSError:
+            generation = 0
+        if generation != self._generation:
+            if self._generation is not None:
+                self.memory.invalidate()
+                with self._lock:
+                    self._validators.clear()
+            self._generation = generation
+
+    def fetch(self, key, path, path_params=None, params=None):
+        """Return the JSON body of GET path, served from cache while fresh"""
+        self._sync_generation()
+        missing = object()
+        body = self.memory.get(key, missing)
+        if body is not missing:
+            self._count("memory_hits")
+            return body
+
+        entry = self._read_disk(key)
+        if entry and entry.get("expires_at", 0) > time.time():
+            self._count("disk_hits")
+            self.memory.set(key, entry["body"], entry["expires_at"] - time.time())
+            return entry["body"]
+
+        with self._lock:
+            stale = self._validators.get(key) or entry
+        headers = {"If-None-Match": stale["etag"]} if stale and stale.get("etag") else None
+
+        self._count("fetches")
+        r = square_api.get(path, path_params=path_params, params=params, headers=headers)
+        if r.status_code == 304 and stale:
+            self._count("revalidated")
+            body, etag = stale["body"], stale["etag"]
+        else:
+            body, etag = r.json(), r.headers.get("ETag")
+
+        self.memory.set(key, body)
+        with self._lock:
+            self._validators[key] = {"etag": etag, "body": body}
+        self._write_disk(key, {"etag": etag, "body": body, "expires_at": time.time() + self.ttl})
+        return body
+
+    def invalidate(self, prefix=None):
+        """Drop every entry whose key starts with prefix, or everything when prefix is None"""
+        with self._lock:
+            keys = [k for k in self._validators if prefix is None or k.startswith(prefix)]
+            for key in keys:
+                del self._validators[key]
+            self.counters["invalidations"] += 1
+        # By prefix, not by our validators: disk hits are in memory without one
+        if prefix is None:
+            self.memory.invalidate()
+        else:
+            self.memory.invalidate_prefix(prefix)
+
+        if self.disk_dir:
+            # Match on disk rather than on our own keys: another worker may have written the entry
+            for key in self._disk_keys():
+                if prefix is None or key.startswith(prefix):
+                    try:
+                        os.remove(self._disk_path(key))
+                    except OSError:
+                        pass
+            # Touch the generation marker so other workers drop their memory tier too
+            marker = os.path.join(self.disk_dir, self.GENERATION_FILE)
+            try:
+                with open(marker, "w") as f:
+                    f.write(str(time.time()))
+                self._generation = os.stat(marker).st_mtime_ns
+            except OSError:
+                logger.warning("Could not update the Square cache generation; other workers keep their memory tier until it expires", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            tracked = len(self._validators)
+        served = counters["memory_hits"] + counters["disk_hits"] + counters["revalidated"]
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["fetches"]
+        return {
+            **counters,
+            "tracked_keys": tracked,
+            "ttl_seconds": self.ttl,
+            "disk_tier": bool(self.disk_dir),
+            # Revalidated 304s count as hits: no payload came over the wire
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0
+        }
+
+square_cache = SquareReadCache(
+    ttl=int(os.environ.get("SQUARE_CACHE_TTL", "900")),
+    disk_dir=os.environ.get("SQUARE_CACHE_DIR") or None
+)
@@ -0,0 +1,162 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("square_api")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+class SquareTransport:
+    """
+    Single HTTP transport for the Square API: one keep-alive session pool,
+    idempotency keys for writes, jittered retries on 429/5xx and
+    per-endpoint latency histograms.
+    """
+
+    def __init__(self, pool_size=10, timeout=15, max_retries=3, backoff=0.5, max_backoff=8.0):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session = None
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    @property
+    def base_url(self):
+        return os.environ.get("SQUARE_BASE_URL", "https://connect.squareup.com")
+
+    def headers(self):
+        token = os.environ.get("SQUARE_ACCESS_TOKEN", "")
+        return {
+            "Square-Version": os.environ.get("SQUARE_API_VERSION", "2025-09-24"),
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _record(self, endpoint, status, elapsed_ms):
+        with self._lock:
+            hist = self._histograms.setdefault(endpoint, {
+                "count": 0,
+                "errors": 0,
+                "retries": 0,
+                "total_ms": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            })
+            hist["count"] += 1
+            hist["total_ms"] += elapsed_ms
+            if status is None or status >= 400:
+                hist["errors"] += 1
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    hist["buckets"][i] += 1
+                    break
+            else:
+                hist["buckets"][-1] += 1
+
+    def _record_retry(self, endpoint):
+        with self._lock:
+            if endpoint in self._histograms:
+                self._histograms[endpoint]["retries"] += 1
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def request(self, method, path, path_params=None, params=None, json=None, headers=None, idempotent=False, retry=None, timeout=None):
+        """
+        Call a Square endpoint and return the response, raising requests.HTTPError on failure.
+        path is a template such as "/v2/customers/{customer_id}" so latency is grouped per endpoint.
+        idempotent=True fills in an idempotency_key when the caller did not supply one,
+        which also makes the write safe to retry. headers are merged over the defaults.
+        """
+        method = method.upper()
+        endpoint = f"{method} {path}"
+        url = self.base_url + path.format(**(path_params or {}))
+        if idempotent:
+            json = dict(json or {})
+            if not json.get("idempotency_key"):
+                json["idempotency_key"] = str(uuid.uuid4())
+        if retry is None:
+            retry = method in ("GET", "PUT", "DELETE") or idempotent
+
+        request_headers = self.headers()
+        if headers:
+            request_headers.update(headers)
+
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, headers=request_headers, params=params, json=json,
+                    timeout=timeout or self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, None, (time.perf_counter() - started) * 1000)
+                if attempt + 1 >= attempts:
+                    raise
+                self._record_retry(endpoint)
+                time.sleep(self._delay(attempt))
+                continue
+
+            self._record(endpoint, response.status_code, (time.perf_counter() - started) * 1000)
+            if response.status_code in RETRY_STATUSES and attempt + 1 < attempts:
+                logger.info("Square %s returned %s, retrying", endpoint, response.status_code)
+                self._record_retry(endpoint)
+                time.sleep(self._delay(attempt, response))
+                continue
+            response.raise_for_status()
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def metrics(self):
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": h["count"],
+                    "errors": h["errors"],
+                    "retries": h["retries"],
+                    "avg_ms": round(h["total_ms"] / h["count"], 1) if h["count"] else None,
+                    "histogram": dict(zip(labels, h["buckets"]))
+                }
+                for endpoint, h in self._histograms.items()
+            }
+
+square_api = SquareTransport(pool_size=int(os.environ.get("SQUARE_HTTP_POOL_SIZE", "10")))
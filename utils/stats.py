@@ -0,0 +1,50 @@
+import os
+from sqlalchemy import func, select
+from database.db import db
+from models.accounts import Admin, Client
+from models.bookings import Booking
+from models.business import Finance
+from utils.cache import TTLCache, invalidate_on_commit
+
+stats_cache = TTLCache(ttl=int(os.environ.get("ADMIN_STATS_CACHE_TTL", "30")))
+invalidate_on_commit(stats_cache, Admin, Client, Booking, Finance)
+
+def revenue_total(*criteria):
+    """
+    Revenue as every dashboard reports it: profit entries booked against completed
+    jobs, as a scalar subquery. Extra criteria narrow it, e.g. to one client.
+    """
+    return (
+        select(func.coalesce(func.sum(Finance.amount), 0))
+        .join(Booking, Finance.booking_id == Booking.id)
+        .where(Booking.status == "completed", Finance.type == "profit", *criteria)
+        .scalar_subquery()
+    )
+
+def compute_admin_stats():
+    """Compute every Master Controls counter and the completed-job revenue in one query"""
+    total_clients = select(func.count(Client.id)).scalar_subquery()
+    total_admins = select(func.count(Admin.id)).scalar_subquery()
+    total_revenue = revenue_total()
+    row = db.session.query(
+        total_clients.label("total_clients"),
+        total_admins.label("total_admins"),
+        func.count(Booking.id).label("total_jobs"),
+        func.count(Booking.id).filter(Booking.status == "pending").label("pending_jobs"),
+        func.count(Booking.id).filter(Booking.status == "completed").label("completed_jobs"),
+        total_revenue.label("total_revenue")
+    ).select_from(Booking).one()
+
+    return {
+        "total_users": row.total_clients + row.total_admins,
+        "total_admins": row.total_admins,
+        "total_clients": row.total_clients,
+        "total_jobs": row.total_jobs,
+        "pending_jobs": row.pending_jobs,
+        "completed_jobs": row.completed_jobs,
+        "total_revenue": f"{float(row.total_revenue or 0):.2f}"
+    }
+
+def cached_admin_stats():
+    """Cached admin stats; booking, finance and account writes clear the cache on commit"""
+    return stats_cache.get_or_set("admin_stats", compute_admin_stats)
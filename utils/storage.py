@@ -0,0 +1,306 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("storage")
+
+CHUNK_SIZE = 1024 * 1024
+# How long released bytes must stay unreferenced before collect_released_documents deletes them
+DOCUMENT_GC_GRACE_SECONDS = int(os.environ.get("DOCUMENT_GC_GRACE_SECONDS", "3600"))
+GC_BATCH_SIZE = 500
+
+# Leading bytes of the formats we expect to receive
+MAGIC_NUMBERS = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"PK\x03\x04", "application/zip"),
+]
+
+def sniff_mime(head, filename=None, declared=None):
+    """Best guess at a document's type: magic bytes first, then the filename, then what the client said"""
+    for magic, mime in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime
+    guessed = mimetypes.guess_type(filename or "")[0]
+    return guessed or declared or "application/octet-stream"
+
+class StoredObject:
+    """Result of a put: the content address plus what we learned while streaming it"""
+
+    def __init__(self, sha256, size, mime_type, created):
+        self.sha256 = sha256
+        self.size = size
+        self.mime_type = mime_type
+        # False when an identical document was already stored
+        self.created = created
+
+def spool_and_hash(stream, spool):
+    """Copy stream into spool in chunks, returning (sha256 hex, size, first bytes)"""
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if not head:
+            head = chunk[:16]
+        digest.update(chunk)
+        size += len(chunk)
+        spool.write(chunk)
+    return digest.hexdigest(), size, head
+
+class DocumentStore:
+    """
+    Content-addressed blob store interface. Documents are keyed by the SHA-256 of
+    their bytes, so storing the same file twice keeps a single copy.
+    """
+
+    def put(self, stream, filename=None, declared_mime=None):
+        raise NotImplementedError
+
+    def open(self, sha256):
+        """Readable binary file object for a stored document"""
+        raise NotImplementedError
+
+    def exists(self, sha256):
+        raise NotImplementedError
+
+    def delete(self, sha256):
+        raise NotImplementedError
+
+    def local_path(self, sha256):
+        """Filesystem path of the document, or None when the backend is not on local disk"""
+        return None
+
+    def location(self, sha256):
+        """Value recorded in PDF.file_path for a stored document"""
+        raise NotImplementedError
+
+    def touch(self, sha256):
+        """Mark an existing document as just written, so garbage collection leaves it alone"""
+        raise NotImplementedError
+
+    def modified_at(self, sha256):
+        """UTC datetime the document was last written or touched, or None if it is missing"""
+        raise NotImplementedError
+
+class LocalDocumentStore(DocumentStore):
+    """Stores documents under root/ab/cd/<sha256>, two levels of sharding by hash prefix"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, stream, filename=None, declared_mime=None):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as spool:
+                sha256, size, head = spool_and_hash(stream, spool)
+            path = self._path(sha256)
+            created = not os.path.exists(path)
+            if created:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Same filesystem, so the rename is atomic and readers never see a partial file
+                os.replace(tmp_path, path)
+            else:
+                self.touch(sha256)
+            return StoredObject(sha256, size, sniff_mime(head, filename, declared_mime), created)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open(self, sha256):
+        return open(self._path(sha256), "rb")
+
+    def exists(self, sha256):
+        return os.path.exists(self._path(sha256))
+
+    def delete(self, sha256):
+        try:
+            os.remove(self._path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, sha256):
+        return self._path(sha256)
+
+    def location(self, sha256):
+        return self._path(sha256)
+
+    def touch(self, sha256):
+        try:
+            os.utime(self._path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def modified_at(self, sha256):
+        try:
+            return datetime.fromtimestamp(os.path.getmtime(self._path(sha256)), tz=timezone.utc)
+        except FileNotFoundError:
+            return None
+
+class S3DocumentStore(DocumentStore):
+    """Stores documents in an S3-compatible bucket (AWS, MinIO, ...) under sharded sha256 keys"""
+
+    def __init__(self, bucket, endpoint_url=None, prefix="documents"):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, sha256):
+        return f"{self.prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def put(self, stream, filename=None, declared_mime=None):
+        # Hash first so an identical document is never uploaded twice
+        with tempfile.TemporaryFile() as spool:
+            sha256, size, head = spool_and_hash(stream, spool)
+            mime_type = sniff_mime(head, filename, declared_mime)
+            created = not self.exists(sha256)
+            if created:
+                spool.seek(0)
+                self.client.upload_fileobj(spool, self.bucket, self._key(sha256), ExtraArgs={"ContentType": mime_type})
+            else:
+                self.touch(sha256)
+        return StoredObject(sha256, size, mime_type, created)
+
+    def open(self, sha256):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(sha256))["Body"]
+
+    def exists(self, sha256):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(sha256))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def delete(self, sha256):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(sha256))
+
+    def location(self, sha256):
+        return f"s3://{self.bucket}/{self._key(sha256)}"
+
+    def touch(self, sha256):
+        # A server-side copy onto itself refreshes LastModified without moving the bytes.
+        # S3 only allows a self-copy with REPLACE, which drops anything not passed back
+        # in, so carry the object's existing content headers and metadata over.
+        key = self._key(sha256)
+        head = self.client.head_object(Bucket=self.bucket, Key=key)
+        headers = {
+            name: head[name]
+            for name in ("ContentType", "CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage")
+            if head.get(name)
+        }
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=key,
+            CopySource={"Bucket": self.bucket, "Key": key},
+            Metadata=head.get("Metadata", {}),
+            MetadataDirective="REPLACE",
+            **headers
+        )
+
+    def modified_at(self, sha256):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(sha256))["LastModified"]
+        except self.client.exceptions.ClientError:
+            return None
+
+def create_document_store():
+    backend = os.environ.get("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3DocumentStore(
+            os.environ.get("STORAGE_S3_BUCKET", "schirmers-documents"),
+            endpoint_url=os.environ.get("STORAGE_S3_ENDPOINT_URL") or None,
+            prefix=os.environ.get("STORAGE_S3_PREFIX", "documents")
+        )
+    return LocalDocumentStore(os.environ.get(
+        "DOCUMENT_STORE_ROOT",
+        os.path.join(os.path.dirname(__file__), '..', 'database', 'documents')
+    ))
+
+document_store = create_document_store()
+
+def store_upload(file_storage):
+    """Stream a werkzeug FileStorage into the document store"""
+    return document_store.put(file_storage.stream, file_storage.filename, file_storage.mimetype)
+
+def release_document(pdf):
+    """
+    Mark the stored bytes behind a PDF row for deletion; call before deleting the row.
+    Nothing is removed until the transaction commits: content-addressed bytes (and
+    their thumbnail and extracted text) are queued for collect_released_documents,
+    and a legacy row's own file is removed by an after-commit hook.
+    """
+    from models.journal import DocumentRelease
+    from database.db import db
+    if pdf.sha256:
+        db.session.merge(DocumentRelease(sha256=pdf.sha256, released_at=datetime.utcnow()))
+    elif pdf.file_path:
+        db.session.info.setdefault("pending_file_removals", []).append(pdf.file_path)
+
+@event.listens_for(Session, "after_commit")
+def _remove_released_files(session):
+    for path in session.info.pop("pending_file_removals", ()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+@event.listens_for(Session, "after_rollback")
+def _keep_released_files(session):
+    session.info.pop("pending_file_removals", None)
+
+def _unreferenced(sha256, cutoff, still_referenced):
+    modified = document_store.modified_at(sha256)
+    recently_written = modified is not None and modified.replace(tzinfo=None) > cutoff
+    return not recently_written and not still_referenced.first()
+
+def collect_released_documents():
+    """
+    Delete released bytes once they have gone unreferenced for the grace period,
+    along with their derivatives. An upload that finds the bytes already stored
+    touches them before its row commits, so a document re-uploaded during the
+    grace period is kept. Rows go first; bytes are deleted only after that commits.
+    """
+    from models.journal import DocumentDerivative, DocumentRelease, PDF
+    from database.db import db
+    cutoff = datetime.utcnow() - timedelta(seconds=DOCUMENT_GC_GRACE_SECONDS)
+    releases = DocumentRelease.query.filter(DocumentRelease.released_at <= cutoff).limit(GC_BATCH_SIZE).all()
+    doomed = []
+    for release in releases:
+        sha256 = release.sha256
+        db.session.delete(release)
+        if not _unreferenced(sha256, cutoff, PDF.query.filter_by(sha256=sha256)):
+            continue
+        doomed.append(sha256)
+        derivative = DocumentDerivative.query.get(sha256)
+        if derivative:
+            db.session.delete(derivative)
+            thumbnail = derivative.thumbnail_sha256
+            if thumbnail and _unreferenced(thumbnail, cutoff, DocumentDerivative.query.filter(
+                DocumentDerivative.thumbnail_sha256 == thumbnail,
+                DocumentDerivative.sha256 != sha256
+            )):
+                doomed.append(thumbnail)
+    db.session.commit()
+    for sha256 in doomed:
+        document_store.delete(sha256)
+    return {"checked": len(releases), "deleted": len(doomed)}
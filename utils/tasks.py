@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+from sqlalchemy import text
+from database.db import db
+
+logger = logging.getLogger("tasks")
+
+def _read_setting(key):
+    from models.system import SystemSetting
+    setting = SystemSetting.query.filter_by(key=key).first()
+    return setting.value if setting else None
+
+def _write_setting(key, value, type_, description):
+    from models.system import SystemSetting
+    setting = SystemSetting.query.filter_by(key=key).first()
+    if not setting:
+        setting = SystemSetting(key=key, type=type_, description=description)
+        db.session.add(setting)
+    setting.value = value
+    db.session.commit()
+
+class SupervisedTask:
+    """
+    Periodic background job that runs exactly once per deployment.
+    Each process owns at most one worker thread, and on PostgreSQL a session
+    advisory lock elects a single leader among gunicorn workers; the others
+    stand by and take over if the leader goes away. Whether the task should run,
+    pending requests for an immediate run and the leader's last run are kept in
+    system_settings, so every worker reports and obeys the same state.
+    """
+
+    def __init__(self, name, run, interval, poll_interval=30):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        # How often the leader checks for a requested run between scheduled ones
+        self.poll_interval = min(interval, poll_interval)
+        self.lock_key = zlib.crc32(name.encode())
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._guard = threading.Lock()
+        self._lock_conn = None
+        # Connections inherited across a fork; referenced so they are never closed from the child
+        self._inherited_conns = []
+        self._owner_pid = os.getpid()
+        self.leader = False
+        self.metrics = {
+            "runs": 0,
+            "failures": 0,
+            "last_started": None,
+            "last_finished": None,
+            "last_duration_ms": None,
+            "last_result": None,
+            "last_error": None
+        }
+
+    def init_app(self, app, autostart=True):
+        self.app = app
+        if autostart:
+            # Cheap check so a worker forked after startup (gunicorn --preload) still gets its thread
+            app.before_request(self._ensure_running)
+            self.start()
+
+    def _forget_inherited_state(self):
+        """
+        After a fork (gunicorn --preload) the child holds copies of the parent's
+        thread handle, locks and advisory-lock connection. Drop them so the child
+        competes for leadership with its own connection.
+        """
+        if self._owner_pid == os.getpid():
+            return
+        if self._lock_conn is not None:
+            # Closing would terminate the parent's session and release its lock
+            self._inherited_conns.append(self._lock_conn)
+        self._lock_conn = None
+        self.leader = False
+        self._thread = None
+        self._guard = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._owner_pid = os.getpid()
+
+    def _ensure_running(self):
+        if not self.running and not self._stop.is_set():
+            self.start()
+
+    @property
+    def running(self):
+        return bool(self._thread and self._thread.is_alive() and self._pid == os.getpid())
+
+    def start(self):
+        """Start the worker thread; returns False if it is already running in this process"""
+        self._forget_inherited_state()
+        with self._guard:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=f"task-{self.name}", daemon=True)
+            self._thread.start()
+        logger.info("Started background task %s (interval=%ss)", self.name, self.interval)
+        return True
+
+    def stop(self, timeout=10):
+        """Stop the worker thread and release leadership; returns False if it was not running"""
+        with self._guard:
+            if not self.running:
+                self._stop.set()
+                return False
+            self._stop.set()
+            self._wakeup.set()
+            thread = self._thread
+        thread.join(timeout)
+        logger.info("Stopped background task %s", self.name)
+        return True
+
+    def _is_leader(self):
+        self._forget_inherited_state()
+        if db.engine.dialect.name != "postgresql":
+            self.leader = True
+            return True
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.execute(text("SELECT 1"))
+                self._lock_conn.commit()
+                return True
+            except Exception:
+                # The connection holding the lock died, and the lock with it
+                self._release_leadership()
+        conn = db.engine.connect()
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_key}).scalar()
+        # Session-level advisory locks outlive the transaction; don't sit idle in one
+        conn.commit()
+        if acquired:
+            self._lock_conn = conn
+            self.leader = True
+            logger.info("Process %s is leader for task %s", os.getpid(), self.name)
+            return True
+        conn.close()
+        return False
+
+    def _release_leadership(self):
+        self.leader = False
+        if self._lock_conn is None:
+            return
+        try:
+            self._lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.lock_key})
+            self._lock_conn.commit()
+        except Exception:
+            pass
+        try:
+            self._lock_conn.close()
+        except Exception:
+            pass
+        self._lock_conn = None
+
+    def run_once(self):
+        started = time.perf_counter()
+        self.metrics["last_started"] = datetime.utcnow().isoformat()
+        try:
+            result = self.run()
+            self.metrics["last_result"] = result
+            self.metrics["last_error"] = None
+        except Exception as e:
+            self.metrics["failures"] += 1
+            self.metrics["last_error"] = str(e)
+            logger.exception("Background task %s failed", self.name)
+        finally:
+            self.metrics["runs"] += 1
+            self.metrics["last_finished"] = datetime.utcnow().isoformat()
+            self.metrics["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self._publish_metrics()
+            db.session.remove()
+
+    @property
+    def _enabled_key(self):
+        return f"task:{self.name}:enabled"
+
+    @property
+    def _request_key(self):
+        return f"task:{self.name}:requested"
+
+    @property
+    def _status_key(self):
+        return f"task:{self.name}:last_run"
+
+    def _publish_metrics(self):
+        """Record this run where workers that are not the leader can report it"""
+        try:
+            db.session.rollback()
+            _write_setting(
+                self._status_key,
+                json.dumps({**self.metrics, "pid": os.getpid()}, default=str),
+                "json",
+                f"Last run of background task {self.name}"
+            )
+        except Exception:
+            db.session.rollback()
+            logger.exception("Could not record status of background task %s", self.name)
+
+    def enabled(self):
+        """Deployment-wide switch; a task never switched off is enabled"""
+        return _read_setting(self._enabled_key) != "false"
+
+    def set_enabled(self, enabled):
+        """Switch the task on or off for every worker; the leader picks it up on its next tick"""
+        _write_setting(
+            self._enabled_key,
+            "true" if enabled else "false",
+            "boolean",
+            f"Whether background task {self.name} runs"
+        )
+
+    def request_run(self):
+        """
+        Ask the leader, whichever worker holds it, to run the task on its next
+        check instead of waiting for the interval; returns the request time
+        """
+        requested_at = datetime.utcnow().isoformat()
+        _write_setting(
+            self._request_key,
+            requested_at,
+            "string",
+            f"Pending request to run background task {self.name}"
+        )
+        # Wakes the supervisor at once when this process is the leader
+        self._wakeup.set()
+        return requested_at
+
+    def run_requested(self):
+        return bool(_read_setting(self._request_key))
+
+    def _take_request(self):
+        if not self.run_requested():
+            return False
+        _write_setting(self._request_key, "", "string", f"Pending request to run background task {self.name}")
+        return True
+
+    def _loop(self):
+        next_run = 0
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if self._is_leader() and self.enabled():
+                        # Taken before running, so a request made mid-run triggers another run
+                        requested = self._take_request()
+                        if requested or time.monotonic() >= next_run:
+                            self.run_once()
+                            next_run = time.monotonic() + self.interval
+            except Exception:
+                logger.exception("Background task %s supervisor error", self.name)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+        with self.app.app_context():
+            self._release_leadership()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "running": self.running,
+            "leader": self.running and self.leader,
+            "pid": os.getpid(),
+            "interval_seconds": self.interval,
+            **self.metrics
+        }
+
+    def shared_status(self):
+        """This worker's status plus the deployment-wide switch and the leader's last run"""
+        raw = _read_setting(self._status_key)
+        try:
+            last_run = json.loads(raw) if raw else None
+        except ValueError:
+            last_run = None
+        return {
+            **self.status(),
+            "enabled": self.enabled(),
+            "run_requested": self.run_requested(),
+            "last_run": last_run
+        }